@@ -1,8 +1,15 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, Response, stream_with_context
+import json
+import queue
 from app.service.graph_session import get_graph_session_manager
+from app.service.llm_cache import get_llm_cache
+from app.service.run_manager import get_run_manager
 
 session_controller_blueprint = Blueprint('session_controller', __name__)
 graph_session_manager = get_graph_session_manager()
+run_manager = get_run_manager()
+
+SSE_HEARTBEAT_SECONDS = 15 # Interval of the keep-alive comments sent while no event is emitted
 
 DEFAULT_LLM_CONFIG = {
     "model_name": "gemini-2.0-flash-001",
@@ -166,14 +173,166 @@ def execute_session():
     try:
         session_id = request.json.get('session_id')
         start_node = request.json.get('start_node')
+        incremental = str(request.json.get('incremental', False)).lower() == 'true'
         if not session_id or not start_node:
             return jsonify({"error": "Session ID and start node are required."}), 400
-        graph = graph_session_manager.execute_session(session_id, start_node)
+        graph = graph_session_manager.execute_session(session_id, start_node, incremental=incremental)
         return jsonify({"graph": graph.to_dict()}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
 
+@session_controller_blueprint.route('/execute-session/stream', methods=['GET', 'POST'])
+def execute_session_stream():
+    """
+    Execute a graph session and stream its progress as Server-Sent Events.
+    Each event carries only the node concerned: node_started, node_partial, node_completed, node_error,
+    then run_finished (or run_error).
+    """
+    try:
+        params = request.args if request.method == 'GET' else (request.json or {})
+        session_id = params.get('session_id')
+        start_node = params.get('start_node')
+        incremental = str(params.get('incremental', False)).lower() == 'true'
+        if not session_id or not start_node:
+            return jsonify({"error": "Session ID and start node are required."}), 400
+        if session_id not in graph_session_manager.session_metadata:
+            return jsonify({"error": f"Session with ID {session_id} does not exist."}), 404
+
+        events = queue.Queue()
+        # The run is queued like the background runs (MAX_CONCURRENT_RUNS), it continues and saves its results even if the client disconnects
+        run = run_manager.submit(session_id, start_node, incremental=incremental, on_event=events.put)
+
+        def on_done(_):
+            if run.status == "failed":
+                events.put({"event": "run_error", "error": run.error})
+            events.put(None)
+
+        run.future.add_done_callback(on_done)
+
+        def generate():
+            while True:
+                try:
+                    event = events.get(timeout=SSE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    break
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+        return Response(generate(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Run-ID": run.run_id})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@session_controller_blueprint.route('/runs', methods=['POST'])
+def submit_run():
+    """
+    Submit the execution of a graph session. The run is queued and its ID is returned immediately.
+    """
+    try:
+        session_id = request.json.get('session_id')
+        start_node = request.json.get('start_node')
+        incremental = str(request.json.get('incremental', False)).lower() == 'true'
+        if not session_id or not start_node:
+            return jsonify({"error": "Session ID and start node are required."}), 400
+        run = run_manager.submit(session_id, start_node, incremental=incremental)
+        return jsonify({"run": run.to_dict()}), 202
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@session_controller_blueprint.route('/runs', methods=['GET'])
+def list_runs():
+    """
+    List the known runs, optionally of a single session (?session_id=...).
+    """
+    try:
+        runs = run_manager.list_runs(request.args.get('session_id'))
+        return jsonify({"runs": [{"run_id": run.run_id, "session_id": run.session_id, "status": run.status} for run in runs]}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@session_controller_blueprint.route('/runs/<run_id>', methods=['GET'])
+def get_run(run_id):
+    """
+    Get the status and results of a run. With ?wait=<seconds> the request waits for the run to finish, at most that long.
+    """
+    try:
+        wait = min(float(request.args.get('wait', 0)), 60)
+        run = run_manager.get(run_id, wait=wait)
+        return jsonify({"run": run.to_dict()}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@session_controller_blueprint.route('/runs/<run_id>/cancel', methods=['POST'])
+def cancel_run(run_id):
+    """
+    Cancel a queued or running run.
+    """
+    try:
+        run = run_manager.cancel(run_id)
+        return jsonify({"run": run.to_dict()}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@session_controller_blueprint.route('/execute-batch', methods=['POST'])
+def execute_batch():
+    """
+    Execute a graph session once per input row.
+    The results are streamed as newline-delimited JSON, one line per row in completion order.
+    """
+    try:
+        session_id = request.json.get('session_id')
+        rows = request.json.get('rows')
+        max_parallel_rows = request.json.get('max_parallel_rows')
+        output_nodes = request.json.get('output_nodes')
+        if not session_id or not isinstance(rows, list):
+            return jsonify({"error": "Session ID and a list of rows are required."}), 400
+        if session_id not in graph_session_manager.session_metadata:
+            return jsonify({"error": f"Session with ID {session_id} does not exist."}), 404
+        results = graph_session_manager.execute_batch(session_id, rows, max_parallel_rows, output_nodes)
+
+        def generate():
+            try:
+                for result in results:
+                    yield json.dumps(result) + "\n"
+            except Exception as e:
+                yield json.dumps({"error": str(e)}) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@session_controller_blueprint.route('/get-node-partial-output', methods=['POST'])
+def get_node_partial_output():
+    """
+    Get the text generated so far by a streaming LLM node of a graph session.
+    """
+    try:
+        session_id = request.json.get('session_id')
+        node_name = request.json.get('node_name')
+        if not session_id or not node_name:
+            return jsonify({"error": "Session ID and node name are required."}), 400
+        partial_output = graph_session_manager.get_node_partial_output(session_id, node_name)
+        return jsonify(partial_output), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @session_controller_blueprint.route('/get-session-graph', methods=['POST'])
 def get_session_graph():
     """
@@ -261,4 +420,30 @@ def download_python_packages():
         success = graph_session_manager.download_python_packages(session_id, packages)
         return jsonify({"success": success}), 200
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+
+@session_controller_blueprint.route('/session-cache-stats', methods=['GET', 'POST'])
+def session_cache_stats():
+    """
+    Get the hit, miss and eviction counters of the in-memory session cache.
+    """
+    try:
+        stats = graph_session_manager.get_cache_stats()
+        return jsonify({"stats": stats}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@session_controller_blueprint.route('/llm-cache-stats', methods=['GET', 'POST'])
+def llm_cache_stats():
+    """
+    Get the hit, miss and eviction counters of the LLM response cache.
+    """
+    try:
+        cache = get_llm_cache()
+        if cache is None:
+            return jsonify({"stats": None, "enabled": False}), 200
+        return jsonify({"stats": cache.get_stats(), "enabled": True}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,143 @@
+import os
+import datetime
+import threading
+import time
+import google.auth.transport.requests
+from google.oauth2 import service_account
+import requests
+from ..service.logger import LOGGER
+
+
+####################################################################################################
+# The following code is used to share one Google access token between all GeminiModel instances.
+# The token is cached per authentication mode and refreshed in the background shortly before it expires.
+# Concurrent callers needing a refresh wait for a single in-flight refresh instead of each fetching a token.
+####################################################################################################
+
+METADATA_URL = "http://metadata.google.internal/computeMetadata/v1"
+
+
+class GoogleCredentialProvider:
+    def __init__(self, deployed_gcp=False, refresh_margin=300):
+        """
+        :param deployed_gcp: Use the GCP metadata server instead of the service account key file.
+        :param refresh_margin: Seconds before expiry at which the token is refreshed.
+        """
+        self.deployed_gcp = deployed_gcp
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock() # Single-flight lock for the token refresh
+        self._token = None
+        self._expires_at = 0.0 # Epoch seconds at which the cached token expires
+        self._credentials = None # Service account credentials, built once from the key file
+        self._refresh_timer = None
+        self._project_id = None
+        self._project_location = None
+
+    ####################################################################################################
+    # Service account authentication from outside a GCP Environment using a service account key.
+    def _fetch_token_service_account(self):
+        """Refresh the service account credentials and return (token, expires_at)."""
+        if self._credentials is None:
+            self._credentials = service_account.Credentials.from_service_account_file(
+                os.environ["GOOGLE_APPLICATION_CREDENTIALS"],
+                scopes=["https://www.googleapis.com/auth/cloud-platform"]
+            )
+        self._credentials.refresh(google.auth.transport.requests.Request())
+        expiry = self._credentials.expiry # Naive UTC datetime
+        expires_at = expiry.replace(tzinfo=datetime.timezone.utc).timestamp() if expiry else time.time() + 3600
+        return self._credentials.token, expires_at
+
+    ####################################################################################################
+    # GCP metadata server authentication from inside a deployed GCP Environment.
+    def _fetch_token_gcp(self):
+        """Fetch an access token from the metadata server and return (token, expires_at)."""
+        response = requests.get(f"{METADATA_URL}/instance/service-accounts/default/token", headers={"Metadata-Flavor": "Google"}, timeout=10)
+        response.raise_for_status()
+        data = response.json()
+        return data["access_token"], time.time() + data.get("expires_in", 3600)
+
+    def _get_metadata_gcp(self, path):
+        """Fetches metadata from GCP metadata server."""
+        response = requests.get(f"{METADATA_URL}/{path}", headers={"Metadata-Flavor": "Google"}, timeout=10)
+        response.raise_for_status()
+        return response.text
+
+    def _token_is_fresh(self):
+        return self._token is not None and time.time() < self._expires_at - self.refresh_margin
+
+    def _refresh(self):
+        """Fetch a new token and schedule the next proactive refresh. Must be called with the lock held."""
+        try:
+            if self.deployed_gcp:
+                token, expires_at = self._fetch_token_gcp()
+            else:
+                token, expires_at = self._fetch_token_service_account()
+        except Exception as e:
+            raise RuntimeError(f"Error obtaining access token: {str(e)}")
+
+        self._token = token
+        self._expires_at = expires_at
+        LOGGER.debug(f"Access token refreshed, valid for {int(expires_at - time.time())} seconds")
+        self._schedule_refresh()
+
+    def _schedule_refresh(self):
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+        delay = max(1.0, self._expires_at - self.refresh_margin - time.time())
+        self._refresh_timer = threading.Timer(delay, self._background_refresh)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _background_refresh(self):
+        try:
+            with self._lock:
+                if not self._token_is_fresh():
+                    self._refresh()
+        except Exception as e:
+            # The next get_token call retries synchronously
+            LOGGER.error(f"Background token refresh failed: {str(e)}")
+
+    def get_token(self):
+        """Return a valid access token, refreshing it only if it is missing or about to expire."""
+        if self._token_is_fresh():
+            return self._token
+        with self._lock:
+            if not self._token_is_fresh():
+                self._refresh()
+            return self._token
+
+    def get_project_id(self):
+        """Retrieve the project ID from environment variables or the metadata server."""
+        if self._project_id is None:
+            if self.deployed_gcp:
+                self._project_id = self._get_metadata_gcp("project/project-id")
+            else:
+                self._project_id = os.environ["GOOGLE_CLOUD_PROJECT"]
+        return self._project_id
+
+    def get_project_location(self):
+        """Retrieve the project location from environment variables or the metadata server."""
+        if self._project_location is None:
+            if self.deployed_gcp:
+                full_zone = self._get_metadata_gcp("instance/zone")  # e.g., projects/12345/zones/us-central1-a
+                self._project_location = full_zone.split("/")[-1].rsplit("-", 1)[0]  # Extracts 'us-central1' from 'us-central1-a'
+            else:
+                self._project_location = os.environ["GOOGLE_CLOUD_LOCATION"]
+        return self._project_location
+
+
+_PROVIDERS = {}
+_PROVIDERS_LOCK = threading.Lock()
+
+
+def get_credential_provider(deployed_gcp=False):
+    """
+    Return the process-wide credential provider of an authentication mode.
+    """
+    with _PROVIDERS_LOCK:
+        if deployed_gcp not in _PROVIDERS:
+            _PROVIDERS[deployed_gcp] = GoogleCredentialProvider(
+                deployed_gcp=deployed_gcp,
+                refresh_margin=int(os.environ.get("GOOGLE_TOKEN_REFRESH_MARGIN", "300"))
+            )
+        return _PROVIDERS[deployed_gcp]
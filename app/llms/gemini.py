@@ -1,9 +1,11 @@
-import os
-import google.auth
-import google.auth.transport.requests
-from google.oauth2 import service_account
 import requests
+import httpx
+import json
+import asyncio
 from .utils.tool_formatter import pydantic_schema_to_tool_format, dict_to_tool_format
+from .credentials import get_credential_provider
+from .rate_limiter import get_rate_limiter, backoff_delay, parse_retry_after
+from .http_client import get_http_session, get_async_http_client, get_http_timeout
 from ..service.logger import LOGGER
 import time
 
@@ -14,18 +16,92 @@ import time
 # For Rate Limiting: https://ai.google.dev/gemini-api/docs/rate-limits
 ####################################################################################################
 
-def make_request_with_retries(max_retries=5, wait_time=30, *args, **kwargs):
+def _is_retryable(status_code):
+    return status_code == 429 or status_code >= 500
+
+
+def make_request_with_retries(max_retries=5, wait_time=30, *args, rate_limiter=None, estimated_tokens=0, hold_slot=False, **kwargs):
+    """
+    POST with retries on 429 and 5xx responses. The responses of the failed attempts are closed.
+    The delay honors Retry-After, otherwise it is an exponential backoff with jitter capped at wait_time seconds,
+    starting from the backoff base of the rate_limiter (LLM_BACKOFF_BASE) if any.
+    With a rate_limiter every attempt first waits for a slot of the model, and 429s lower the limits of the whole process.
+    With hold_slot=True the slot of the returned response is kept, the caller releases it once the response is consumed
+    (e.g. a streamed response).
+    """
     retries = 0
-    while retries < max_retries:
-        response = requests.post(*args, **kwargs)
-        
-        if response.status_code == 429:
-            retries += 1
-            LOGGER.warning(f"Rate limit hit. Retrying in {wait_time} seconds... (Attempt {retries}/{max_retries})")
-            time.sleep(wait_time)
+    kwargs.setdefault("timeout", get_http_timeout())
+    session = get_http_session() # Pooled keep-alive connections shared by every thread
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.acquire(estimated_tokens)
+        try:
+            response = session.post(*args, **kwargs)
+        except BaseException:
+            if rate_limiter is not None:
+                rate_limiter.release()
+            raise
+
+        if not _is_retryable(response.status_code) or (response.status_code != 429 and retries + 1 >= max_retries):
+            # Successful, any other error or the last server error, which the caller raises
+            if rate_limiter is not None and not hold_slot:
+                rate_limiter.release()
+            return response
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if rate_limiter is not None:
+            rate_limiter.release(throttled=response.status_code == 429, retry_after=retry_after)
+        response.close() # Return the connection of the discarded response to the pool
+
+        retries += 1
+        if retries >= max_retries:
+            break
+        if retry_after is not None:
+            delay = retry_after
         else:
-            return response  # Return response if successful or any other error
-    
+            delay = rate_limiter.backoff(retries, wait_time) if rate_limiter is not None else backoff_delay(retries, cap=wait_time)
+        LOGGER.warning(f"Request failed with status {response.status_code}. Retrying in {delay:.1f} seconds... (Attempt {retries}/{max_retries})")
+        time.sleep(delay)
+
+    LOGGER.critical(f"Failed after {max_retries} retries due to rate limiting.")
+    raise Exception(f"Failed after {max_retries} retries due to rate limiting.")
+
+
+async def amake_request_with_retries(max_retries=5, wait_time=30, *args, rate_limiter=None, estimated_tokens=0, **kwargs):
+    """
+    Async counterpart of make_request_with_retries. Waits on the event loop instead of blocking a thread.
+    """
+    retries = 0
+    client = get_async_http_client() # Pooled keep-alive connections shared by every task of the loop
+    while True:
+        if rate_limiter is not None:
+            await rate_limiter.aacquire(estimated_tokens)
+        try:
+            response = await client.post(*args, **kwargs)
+        except BaseException:
+            if rate_limiter is not None:
+                rate_limiter.release()
+            raise
+
+        if not _is_retryable(response.status_code) or (response.status_code != 429 and retries + 1 >= max_retries):
+            # Successful, any other error or the last server error, which the caller raises
+            if rate_limiter is not None:
+                rate_limiter.release()
+            return response
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if rate_limiter is not None:
+            rate_limiter.release(throttled=response.status_code == 429, retry_after=retry_after)
+        await response.aclose() # Return the connection of the discarded response to the pool
+
+        retries += 1
+        if retries >= max_retries:
+            break
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            delay = rate_limiter.backoff(retries, wait_time) if rate_limiter is not None else backoff_delay(retries, cap=wait_time)
+        LOGGER.warning(f"Request failed with status {response.status_code}. Retrying in {delay:.1f} seconds... (Attempt {retries}/{max_retries})")
+        await asyncio.sleep(delay)
+
     LOGGER.critical(f"Failed after {max_retries} retries due to rate limiting.")
     raise Exception(f"Failed after {max_retries} retries due to rate limiting.")
 
@@ -41,14 +117,10 @@ class GeminiModel:
         """
         try:
             try:
-                if deployed_gcp:
-                    self._access_token = self._get_access_token_gcp()
-                    self._project_id = self._get_project_id_gcp()
-                    self._project_location = self._get_project_location_gcp()
-                else:
-                    self._access_token = self._get_access_token()
-                    self._project_id = self._get_project_id()
-                    self._project_location = self._get_project_location()
+                self._credentials = get_credential_provider(deployed_gcp) # Process-wide token cache shared by every model
+                self._credentials.get_token()
+                self._project_id = self._credentials.get_project_id()
+                self._project_location = self._credentials.get_project_location()
             except Exception as e:
                 LOGGER.error(f"Failed to authenticate: {str(e)}")
                 raise RuntimeError(f"Failed to authenticate: {str(e)}")
@@ -58,61 +130,24 @@ class GeminiModel:
             self.max_output_tokens = max_output_tokens
             self.max_retries = max_retries
             self.wait_time = wait_time
-            self.headers = {
-                "Authorization": f"Bearer {self._access_token}",
-                "Content-Type": "application/json"
-            }
+            self.rate_limiter = get_rate_limiter(model_name) # Shared by every model instance with the same name
 
             LOGGER.debug(f"Initialized GeminiModel with model {model_name} , project {self._project_id}, location {self._project_location}")
         except Exception as e:
             LOGGER.error(f"Failed to initialize GeminiModel: {str(e)}")
             raise RuntimeError(f"Failed to initialize GeminiModel: {str(e)}")
 
-    ####################################################################################################
-    # The following authentication methods are used for service account authentication from outside a GCP Environment using a service account key.
-    def _get_access_token(self):
-        """Retrieve an access token using service account credentials."""
-        try:
-            credentials = service_account.Credentials.from_service_account_file(
-                os.environ["GOOGLE_APPLICATION_CREDENTIALS"],
-                scopes=["https://www.googleapis.com/auth/cloud-platform"]
-            )
-            credentials.refresh(google.auth.transport.requests.Request())
-            return credentials.token
-        except Exception as e:
-            raise RuntimeError(f"Error obtaining access token: {str(e)}")
-
-    def _get_project_id(self):
-        """Retrieve the project ID from environment variables or config."""
-        return os.environ["GOOGLE_CLOUD_PROJECT"]
+    @property
+    def headers(self):
+        """Request headers built with the current cached access token, so long-lived models never send an expired token."""
+        return {
+            "Authorization": f"Bearer {self._credentials.get_token()}",
+            "Content-Type": "application/json"
+        }
 
-    def _get_project_location(self):
-        """Retrieve the project location from environment variables or config."""
-        return os.environ["GOOGLE_CLOUD_LOCATION"]
-    
-
-    ####################################################################################################
-    # The following authentication methods are used for GCP metadata server authentication from inside a deployed GCP Environment.
-    def _get_access_token_gcp(self):
-        """Fetches an access token for authentication with Vertex AI."""
-        METADATA_URL = "http://metadata.google.internal/computeMetadata/v1"
-        response = requests.get(f"{METADATA_URL}/instance/service-accounts/default/token", headers={"Metadata-Flavor": "Google"})
-        return response.json()["access_token"]
-    
-    def _get_metadata_gcp(self, path):
-        """Fetches metadata from GCP metadata server."""
-        METADATA_URL = "http://metadata.google.internal/computeMetadata/v1"
-        response = requests.get(f"{METADATA_URL}/{path}", headers={"Metadata-Flavor": "Google"})
-        return response.text
-
-    def _get_project_id_gcp(self):
-        return self.get_metadata("project/project-id")
-
-    def _get_project_location_gcp(self):
-        full_zone = self.get_metadata("instance/zone")  # e.g., projects/12345/zones/us-central1-a
-        return full_zone.split("/")[-1].rsplit("-", 1)[0]  # Extracts 'us-central1' from 'us-central1-a'
-
-    
+    def _estimate_tokens(self, payload):
+        """Rough upper bound of the tokens of a request (about 4 characters per token) used by the rate limiter."""
+        return len(json.dumps(payload)) // 4 + self.max_output_tokens
 
     def _validate_args(self, arg, type:str):
         if type == "content_role_list":
@@ -232,9 +267,11 @@ class GeminiModel:
         try:
             url = f"https://{self._project_location}-aiplatform.googleapis.com/v1/projects/{self._project_id}/locations/{self._project_location}/publishers/google/models/{self._model_name}:generateContent"
             payload = self._create_payload_for_generate(content_role_list, system_instructions)
-            response = make_request_with_retries(self.max_retries, self.wait_time, url, headers=self.headers, json=payload)
+            estimated_tokens = self._estimate_tokens(payload)
+            response = make_request_with_retries(self.max_retries, self.wait_time, url, headers=self.headers, json=payload, rate_limiter=self.rate_limiter, estimated_tokens=estimated_tokens)
             response.raise_for_status()
             response = response.json()
+            self.rate_limiter.record_usage(estimated_tokens, response.get("usageMetadata", {}).get("totalTokenCount"))
             if simplify_output:
                 response = response["candidates"][0]['content']['parts'][0]['text']
             return response
@@ -253,9 +290,11 @@ class GeminiModel:
         try:
             url = f"https://{self._project_location}-aiplatform.googleapis.com/v1/projects/{self._project_id}/locations/{self._project_location}/publishers/google/models/{self._model_name}:generateContent"
             payload = self._create_payload_for_generate_funccall(content_role_list, tools, system_instructions)
-            response = make_request_with_retries(self.max_retries, self.wait_time, url, headers=self.headers, json=payload)
+            estimated_tokens = self._estimate_tokens(payload)
+            response = make_request_with_retries(self.max_retries, self.wait_time, url, headers=self.headers, json=payload, rate_limiter=self.rate_limiter, estimated_tokens=estimated_tokens)
             response.raise_for_status()
             response = response.json()
+            self.rate_limiter.record_usage(estimated_tokens, response.get("usageMetadata", {}).get("totalTokenCount"))
             if simplify_output:
                 response = [r['functionCall'] for r in response["candidates"][0]['content']['parts']]
             
@@ -264,6 +303,94 @@ class GeminiModel:
             LOGGER.error(f"Error generating function call content: {str(e)}")
             raise RuntimeError(f"Error generating function call content: {str(e)}")
 
+    def stream_content(self, content_role_list, system_instructions=None, on_chunk=None):
+        """
+        Send a request for content generation and receive the text while it is generated (server-sent events).
+
+        :param content_role_list: List of dicts with role and content.
+        :param system_instructions: Optional system-level instructions.
+        :param on_chunk: Optional callable receiving every new piece of text as soon as it arrives.
+        :return: The full generated text.
+        """
+        try:
+            url = f"https://{self._project_location}-aiplatform.googleapis.com/v1/projects/{self._project_id}/locations/{self._project_location}/publishers/google/models/{self._model_name}:streamGenerateContent?alt=sse"
+            payload = self._create_payload_for_generate(content_role_list, system_instructions)
+            estimated_tokens = self._estimate_tokens(payload)
+            # The slot of the model is held until the stream is fully read or abandoned
+            response = make_request_with_retries(self.max_retries, self.wait_time, url, headers=self.headers, json=payload, stream=True, rate_limiter=self.rate_limiter, estimated_tokens=estimated_tokens, hold_slot=True)
+            text_parts = []
+            usage = {}
+            try:
+                with response:
+                    response.raise_for_status()
+                    response.encoding = "utf-8"
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line or not line.startswith("data:"):
+                            continue
+                        chunk = json.loads(line[len("data:"):])
+                        usage = chunk.get("usageMetadata", usage)
+                        for candidate in chunk.get("candidates", [])[:1]:
+                            for part in candidate.get("content", {}).get("parts", []):
+                                text = part.get("text")
+                                if text:
+                                    text_parts.append(text)
+                                    if on_chunk is not None:
+                                        on_chunk(text)
+            finally:
+                self.rate_limiter.release()
+            self.rate_limiter.record_usage(estimated_tokens, usage.get("totalTokenCount"))
+            return "".join(text_parts)
+        except requests.exceptions.RequestException as e:
+            LOGGER.error(f"Error streaming content: {str(e)}")
+            raise RuntimeError(f"Error streaming content: {str(e)}")
+
+    async def agenerate_content(self, content_role_list, system_instructions=None, simplify_output=False):
+        """
+        Async variant of generate_content.
+
+        :param content_role_list: List of dicts with role and content.
+        :param system_instructions: Optional system-level instructions.
+        :return: Generated content response.
+        """
+        try:
+            url = f"https://{self._project_location}-aiplatform.googleapis.com/v1/projects/{self._project_id}/locations/{self._project_location}/publishers/google/models/{self._model_name}:generateContent"
+            payload = self._create_payload_for_generate(content_role_list, system_instructions)
+            estimated_tokens = self._estimate_tokens(payload)
+            response = await amake_request_with_retries(self.max_retries, self.wait_time, url, headers=self.headers, json=payload, rate_limiter=self.rate_limiter, estimated_tokens=estimated_tokens)
+            response.raise_for_status()
+            response = response.json()
+            self.rate_limiter.record_usage(estimated_tokens, response.get("usageMetadata", {}).get("totalTokenCount"))
+            if simplify_output:
+                response = response["candidates"][0]['content']['parts'][0]['text']
+            return response
+        except httpx.HTTPError as e:
+            LOGGER.error(f"Error generating content: {str(e)}")
+            raise RuntimeError(f"Error generating content: {str(e)}")
+
+    async def agenerate_funccall_content(self, content_role_list, tools, system_instructions=None, simplify_output=False):
+        """
+        Async variant of generate_funccall_content.
+
+        :param content_role_list: List of dicts with role and content.
+        :param tools: List of tool function objects.
+        :return: Function call response.
+        """
+        try:
+            url = f"https://{self._project_location}-aiplatform.googleapis.com/v1/projects/{self._project_id}/locations/{self._project_location}/publishers/google/models/{self._model_name}:generateContent"
+            payload = self._create_payload_for_generate_funccall(content_role_list, tools, system_instructions)
+            estimated_tokens = self._estimate_tokens(payload)
+            response = await amake_request_with_retries(self.max_retries, self.wait_time, url, headers=self.headers, json=payload, rate_limiter=self.rate_limiter, estimated_tokens=estimated_tokens)
+            response.raise_for_status()
+            response = response.json()
+            self.rate_limiter.record_usage(estimated_tokens, response.get("usageMetadata", {}).get("totalTokenCount"))
+            if simplify_output:
+                response = [r['functionCall'] for r in response["candidates"][0]['content']['parts']]
+
+            return response
+        except httpx.HTTPError as e:
+            LOGGER.error(f"Error generating function call content: {str(e)}")
+            raise RuntimeError(f"Error generating function call content: {str(e)}")
+
 
 
 
@@ -297,6 +424,21 @@ class GeminiJsonEngine():
             raise ValueError("Input must be a string or list")
         response = self.model.generate_funccall_content(_content_roles, tools=[self.schema], simplify_output=True)
         return [r['args'] for r in response]
+
+    async def arun(self, user_query):
+        """
+        Async variant of run.
+        Input: user_query: List[str] or str
+        Output: response: List[Dict]
+        """
+        if isinstance(user_query, str):
+            _content_roles = self.content_roles + [{"role": "user", "content": user_query}]
+        elif isinstance(user_query, list):
+            _content_roles = self.content_roles + [{"role": "user", "content": item} for item in user_query]
+        else:
+            raise ValueError("Input must be a string or list")
+        response = await self.model.agenerate_funccall_content(_content_roles, tools=[self.schema], simplify_output=True)
+        return [r['args'] for r in response]
     
 
 
@@ -325,4 +467,35 @@ class GeminiSimpleChatEngine:
             raise ValueError("Input must be a string or list")
         
         response = self.model.generate_content(_content_roles, simplify_output=True)
-        return response
\ No newline at end of file
+        return response
+
+    async def arun(self, user_query):
+        """
+        Async variant of run.
+        Input: user_query: List[str] or str
+        Output: response: str
+        """
+        if isinstance(user_query, str):
+            _content_roles = self.content_roles + [{"role": "user", "content": user_query}]
+        elif isinstance(user_query, list):
+            _content_roles = self.content_roles + [{"role": "user", "content": item} for item in user_query]
+        else:
+            raise ValueError("Input must be a string or list")
+
+        response = await self.model.agenerate_content(_content_roles, simplify_output=True)
+        return response
+
+    def run_stream(self, user_query, on_chunk=None):
+        """
+        Streaming variant of run.
+        Input: user_query: List[str] or str, on_chunk: callable receiving every new piece of text
+        Output: response: str
+        """
+        if isinstance(user_query, str):
+            _content_roles = self.content_roles + [{"role": "user", "content": user_query}]
+        elif isinstance(user_query, list):
+            _content_roles = self.content_roles + [{"role": "user", "content": item} for item in user_query]
+        else:
+            raise ValueError("Input must be a string or list")
+
+        return self.model.stream_content(_content_roles, on_chunk=on_chunk)
\ No newline at end of file
@@ -0,0 +1,95 @@
+import os
+import asyncio
+import threading
+import weakref
+import requests
+import httpx
+from contextlib import asynccontextmanager
+from requests.adapters import HTTPAdapter
+
+
+####################################################################################################
+# The following code is used to share pooled HTTP clients between all LLM requests of the process.
+# Connections to the same host are kept alive and reused, so consecutive calls skip the TCP+TLS handshake.
+# Configuration: LLM_HTTP_POOL_CONNECTIONS (hosts kept in the pool), LLM_HTTP_POOL_MAXSIZE (connections per host),
+# LLM_HTTP_CONNECT_TIMEOUT and LLM_HTTP_READ_TIMEOUT (seconds).
+####################################################################################################
+
+def get_http_timeout():
+    """
+    Return the (connect, read) timeout in seconds of LLM requests.
+    """
+    return (
+        float(os.environ.get("LLM_HTTP_CONNECT_TIMEOUT", "10")),
+        float(os.environ.get("LLM_HTTP_READ_TIMEOUT", "300"))
+    )
+
+
+_HTTP_SESSION = None
+_HTTP_SESSION_LOCK = threading.Lock()
+
+
+def get_http_session():
+    """
+    Return the process-wide requests.Session with a connection pool per host.
+    The pool is thread-safe: up to LLM_HTTP_POOL_MAXSIZE connections per host are kept alive and threads needing more
+    wait for a free connection instead of opening new ones.
+    """
+    global _HTTP_SESSION
+    with _HTTP_SESSION_LOCK:
+        if _HTTP_SESSION is None:
+            pool_maxsize = int(os.environ.get("LLM_HTTP_POOL_MAXSIZE", "64"))
+            adapter = HTTPAdapter(
+                pool_connections=int(os.environ.get("LLM_HTTP_POOL_CONNECTIONS", "10")),
+                pool_maxsize=pool_maxsize,
+                pool_block=True
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _HTTP_SESSION = session
+        return _HTTP_SESSION
+
+
+# httpx.AsyncClient is bound to the event loop it was first used on, so one client is kept per running loop
+_ASYNC_CLIENTS = weakref.WeakKeyDictionary()
+_ASYNC_CLIENT_USERS = weakref.WeakKeyDictionary() # Dict[loop, int]: number of active async_http_client_scope of the loop
+_ASYNC_CLIENTS_LOCK = threading.Lock()
+
+
+def get_async_http_client():
+    """
+    Return the pooled httpx.AsyncClient of the running event loop, creating it on first use.
+    The client is closed when the last async_http_client_scope of the loop exits.
+    """
+    loop = asyncio.get_running_loop()
+    with _ASYNC_CLIENTS_LOCK:
+        client = _ASYNC_CLIENTS.get(loop)
+        if client is None or client.is_closed:
+            connect_timeout, read_timeout = get_http_timeout()
+            pool_maxsize = int(os.environ.get("LLM_HTTP_POOL_MAXSIZE", "64"))
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_maxsize)
+            )
+            _ASYNC_CLIENTS[loop] = client
+        return client
+
+
+@asynccontextmanager
+async def async_http_client_scope():
+    """
+    Keep the httpx.AsyncClient of the running event loop for the duration of a run, e.g. an async graph execution.
+    Concurrent runs on the same loop share the client, the last run to finish closes it with its connections.
+    """
+    loop = asyncio.get_running_loop()
+    with _ASYNC_CLIENTS_LOCK:
+        _ASYNC_CLIENT_USERS[loop] = _ASYNC_CLIENT_USERS.get(loop, 0) + 1
+    try:
+        yield
+    finally:
+        with _ASYNC_CLIENTS_LOCK:
+            _ASYNC_CLIENT_USERS[loop] -= 1
+            client = _ASYNC_CLIENTS.pop(loop, None) if _ASYNC_CLIENT_USERS[loop] == 0 else None
+        if client is not None:
+            await client.aclose()
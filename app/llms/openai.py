@@ -5,6 +5,8 @@ from langchain_core.messages import HumanMessage, SystemMessage,ToolMessage
 from langchain_core.prompts import ChatPromptTemplate
 from typing import Dict, Any, List
 from .utils.tool_formatter import dict_to_pydantic_model
+from .rate_limiter import get_rate_limiter
+from ..service.logger import LOGGER
 
 
 ####################################################################################################
@@ -16,6 +18,7 @@ from .utils.tool_formatter import dict_to_pydantic_model
 class LangchainOpenaiJsonEngine:
     def __init__(self, model_name, sampleBaseModel, systemPromptText: str=None, humanPromptText: str=None, temperature: float=0.0):
         self.llm = ChatOpenAI(model=model_name, temperature=temperature)
+        self.rate_limiter = get_rate_limiter(model_name) # Shared by every engine using the same model
 
         if isinstance(sampleBaseModel, dict):
             sampleBaseModel = dict_to_pydantic_model(sampleBaseModel)
@@ -43,9 +46,18 @@ class LangchainOpenaiJsonEngine:
 
     def run(self, query: List[str]):
         query = "\n".join(query)
-        result = self.micro_agent.invoke({
-            "query": query
-        })
+        with self.rate_limiter.limit(len(query) // 4):
+            result = self.micro_agent.invoke({
+                "query": query
+            })
+        return [dict(result)]
+
+    async def arun(self, query: List[str]):
+        query = "\n".join(query)
+        async with self.rate_limiter.alimit(len(query) // 4):
+            result = await self.micro_agent.ainvoke({
+                "query": query
+            })
         return [dict(result)]
 
 
@@ -58,6 +70,7 @@ class LangchainOpenaiJsonEngine:
 class LangchainOpenaiSimpleChatEngine:
     def __init__(self, model_name, tools:List[tool]=[], systemPromptText: str=None, humanPromptText: str=None, temperature: float=0.0):
         self.llm = ChatOpenAI(model=model_name, temperature=temperature)
+        self.rate_limiter = get_rate_limiter(model_name) # Shared by every engine using the same model
         self.tools = tools
         
         if len(tools) == 0:
@@ -82,7 +95,8 @@ class LangchainOpenaiSimpleChatEngine:
             SystemMessage(self.systemPromptText),
             HumanMessage(content=query)
         ]
-        level1_result = self.llm_with_tools.invoke(messages)
+        with self.rate_limiter.limit(len(query) // 4):
+            level1_result = self.llm_with_tools.invoke(messages)
         if len(level1_result.tool_calls) == 0:
             print("No tools to run ...")
             return level1_result.content
@@ -91,5 +105,52 @@ class LangchainOpenaiSimpleChatEngine:
             for tool_call in level1_result.tool_calls:
                 tool_output = tool_call.invoke()
                 messages.append(ToolMessage(tool_output, tool_call_id=tool_call["id"]))
-            level2_result = self.llm_with_tools.invoke(messages)
-            return level2_result.content
\ No newline at end of file
+            with self.rate_limiter.limit(len(query) // 4):
+                level2_result = self.llm_with_tools.invoke(messages)
+            return level2_result.content
+
+    async def arun(self, query: List[str]):
+        query = "\n".join(query)
+
+        messages = [
+            SystemMessage(self.systemPromptText),
+            HumanMessage(content=query)
+        ]
+        async with self.rate_limiter.alimit(len(query) // 4):
+            level1_result = await self.llm_with_tools.ainvoke(messages)
+        if len(level1_result.tool_calls) == 0:
+            LOGGER.info("No tools to run. Location: LangchainOpenaiSimpleChatEngine.arun")
+            return level1_result.content
+        else:
+            LOGGER.info(f"Running {len(level1_result.tool_calls)} tools. Location: LangchainOpenaiSimpleChatEngine.arun")
+            for tool_call in level1_result.tool_calls:
+                tool_output = tool_call.invoke()
+                messages.append(ToolMessage(tool_output, tool_call_id=tool_call["id"]))
+            async with self.rate_limiter.alimit(len(query) // 4):
+                level2_result = await self.llm_with_tools.ainvoke(messages)
+            return level2_result.content
+
+    def run_stream(self, query: List[str], on_chunk=None):
+        """
+        Streaming variant of run. The text is streamed with `.stream` when no tools are bound, tool calls need
+        the complete first answer so they fall back to run.
+        """
+        if len(self.tools) > 0:
+            result = self.run(query)
+            if on_chunk is not None:
+                on_chunk(result)
+            return result
+
+        query = "\n".join(query)
+        messages = [
+            SystemMessage(self.systemPromptText),
+            HumanMessage(content=query)
+        ]
+        text_parts = []
+        with self.rate_limiter.limit(len(query) // 4):
+            for chunk in self.llm_with_tools.stream(messages):
+                if chunk.content:
+                    text_parts.append(chunk.content)
+                    if on_chunk is not None:
+                        on_chunk(chunk.content)
+        return "".join(text_parts)
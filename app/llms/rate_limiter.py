@@ -0,0 +1,249 @@
+import os
+import json
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+from ..service.logger import LOGGER
+
+
+####################################################################################################
+# The following code is used to share one adaptive rate limiter per model between all threads and tasks of the process.
+# Each limiter combines:
+# - a request bucket (requests per minute) and a token bucket (tokens per minute), refilled continuously,
+# - a concurrency limit adapted with AIMD: +1/limit per successful call, halved once per burst of 429s,
+# - a shared cool-down after a 429 (Retry-After or exponential backoff), so throttled callers do not retry in lockstep.
+# Configuration: LLM_RATE_LIMIT_RPM, LLM_RATE_LIMIT_TPM and LLM_MAX_CONCURRENCY apply to every model (0 disables a limit),
+# LLM_RATE_LIMITS overrides them per model, e.g. {"gemini-1.5-pro-002": {"rpm": 60, "tpm": 100000, "max_concurrency": 8}}.
+# LLM_BACKOFF_BASE is the first backoff delay in seconds, the `wait_time` of a model is the maximum delay.
+####################################################################################################
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """
+    Exponential backoff with full jitter: a random delay between 0 and min(cap, base * 2^attempt) seconds.
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header (seconds or HTTP date) into a delay in seconds. Returns None if absent or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _throttle_info(error):
+    """
+    Tell whether a client library exception is a 429 and extract its Retry-After delay.
+    Output: (throttled, retry_after)
+    """
+    if getattr(error, "status_code", None) != 429:
+        return False, None
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    return True, parse_retry_after(headers.get("retry-after"))
+
+
+class _Bucket:
+    """
+    Token bucket refilled continuously at `per_minute / 60` units per second, holding at most `per_minute` units.
+    """
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` units are available (a request larger than the bucket waits for a full bucket)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= amount # May go negative when actual usage exceeds the estimate, delaying the next callers
+
+    def give(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, name, rpm=0, tpm=0, max_concurrency=16, backoff_base=1.0):
+        """
+        :param name: Name of the model, used in logs.
+        :param rpm: Requests per minute, 0 for no limit.
+        :param tpm: Tokens per minute, 0 for no limit.
+        :param max_concurrency: Upper bound of the adaptive concurrency limit, 0 for no limit.
+        :param backoff_base: First backoff delay in seconds.
+        """
+        self.name = name
+        self.request_bucket = _Bucket(rpm) if rpm else None
+        self.token_bucket = _Bucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.concurrency_limit = float(max_concurrency) # Current AIMD limit, between 1 and max_concurrency
+        self.in_flight = 0 # Number of calls currently holding a slot
+        self.cooldown_until = 0.0 # Monotonic time before which no new call starts after a 429
+        self.throttle_count = 0 # Consecutive 429s, drives the shared backoff
+        self.backoff_base = backoff_base
+        self.condition = threading.Condition() # Guards the state above and wakes waiting threads
+
+    def _try_acquire(self, estimated_tokens):
+        """
+        Take a slot if possible. Must be called with the condition held.
+        Output: 0 if the slot was taken, otherwise the number of seconds to wait before trying again.
+        """
+        now = time.monotonic()
+        wait = max(0.0, self.cooldown_until - now)
+        if self.max_concurrency and self.in_flight >= int(self.concurrency_limit):
+            wait = max(wait, 0.05) # Woken up by release
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.wait_time(1, now))
+        if self.token_bucket is not None and estimated_tokens:
+            wait = max(wait, self.token_bucket.wait_time(estimated_tokens, now))
+        if wait > 0:
+            return wait
+
+        self.in_flight += 1
+        if self.request_bucket is not None:
+            self.request_bucket.take(1)
+        if self.token_bucket is not None and estimated_tokens:
+            self.token_bucket.take(estimated_tokens)
+        return 0
+
+    def acquire(self, estimated_tokens=0):
+        """
+        Block until a call with about `estimated_tokens` tokens may start. Must be balanced by a call to release.
+        """
+        with self.condition:
+            while True:
+                wait = self._try_acquire(estimated_tokens)
+                if wait == 0:
+                    return
+                self.condition.wait(min(wait, 1.0))
+
+    async def aacquire(self, estimated_tokens=0):
+        """
+        Async variant of acquire, waiting on the event loop instead of blocking the thread.
+        """
+        while True:
+            with self.condition:
+                wait = self._try_acquire(estimated_tokens)
+            if wait == 0:
+                return
+            await asyncio.sleep(min(wait, 1.0))
+
+    def release(self, throttled=False, retry_after=None):
+        """
+        Free the slot of a finished call and adapt the limits.
+        throttled: the call was rejected with a 429.
+        retry_after: delay in seconds requested by the server, if any.
+        """
+        with self.condition:
+            self.in_flight = max(0, self.in_flight - 1)
+            if throttled:
+                now = time.monotonic()
+                if now >= self.cooldown_until:
+                    # Calls started before the cool-down are rejected together, decrease once per episode
+                    self.throttle_count += 1
+                    self.concurrency_limit = max(1.0, self.concurrency_limit / 2) # Multiplicative decrease
+                delay = retry_after if retry_after is not None else backoff_delay(self.throttle_count, self.backoff_base, 60.0)
+                self.cooldown_until = max(self.cooldown_until, now + delay)
+                LOGGER.warning(f"Rate limit hit for {self.name}, concurrency limit lowered to {int(self.concurrency_limit)}, pausing {delay:.1f} seconds. Location: AdaptiveRateLimiter.release")
+            else:
+                self.throttle_count = 0
+                if self.max_concurrency:
+                    self.concurrency_limit = min(float(self.max_concurrency), self.concurrency_limit + 1.0 / self.concurrency_limit) # Additive increase
+            self.condition.notify_all()
+
+    @contextmanager
+    def limit(self, estimated_tokens=0):
+        """
+        Hold a slot for the duration of a call made by a client library which does its own HTTP requests.
+        A 429 raised by the library lowers the limits like a 429 response.
+        """
+        self.acquire(estimated_tokens)
+        throttled, retry_after = False, None
+        try:
+            yield
+        except Exception as e:
+            throttled, retry_after = _throttle_info(e)
+            raise
+        finally:
+            self.release(throttled=throttled, retry_after=retry_after)
+
+    @asynccontextmanager
+    async def alimit(self, estimated_tokens=0):
+        """
+        Async variant of limit.
+        """
+        await self.aacquire(estimated_tokens)
+        throttled, retry_after = False, None
+        try:
+            yield
+        except Exception as e:
+            throttled, retry_after = _throttle_info(e)
+            raise
+        finally:
+            self.release(throttled=throttled, retry_after=retry_after)
+
+    def record_usage(self, estimated_tokens, used_tokens):
+        """
+        Correct the token bucket with the actual token usage reported by the provider.
+        """
+        if self.token_bucket is None or used_tokens is None:
+            return
+        with self.condition:
+            if used_tokens > estimated_tokens:
+                self.token_bucket.take(used_tokens - estimated_tokens)
+            else:
+                self.token_bucket.give(estimated_tokens - used_tokens)
+
+    def backoff(self, attempt, cap):
+        """
+        Delay in seconds before retrying a failed call for the `attempt`-th time.
+        """
+        return backoff_delay(attempt, self.backoff_base, cap)
+
+
+_RATE_LIMITERS = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+def get_rate_limiter(model_name):
+    """
+    Return the process-wide rate limiter of a model, configured from the LLM_RATE_LIMIT_RPM, LLM_RATE_LIMIT_TPM,
+    LLM_MAX_CONCURRENCY, LLM_RATE_LIMITS and LLM_BACKOFF_BASE environment variables.
+    """
+    with _RATE_LIMITERS_LOCK:
+        if model_name not in _RATE_LIMITERS:
+            config = {
+                "rpm": int(os.environ.get("LLM_RATE_LIMIT_RPM", "0")),
+                "tpm": int(os.environ.get("LLM_RATE_LIMIT_TPM", "0")),
+                "max_concurrency": int(os.environ.get("LLM_MAX_CONCURRENCY", "16"))
+            }
+            try:
+                config.update(json.loads(os.environ.get("LLM_RATE_LIMITS", "{}")).get(model_name, {}))
+            except ValueError as e:
+                LOGGER.error(f"Invalid LLM_RATE_LIMITS: {str(e)}. Location: get_rate_limiter")
+            _RATE_LIMITERS[model_name] = AdaptiveRateLimiter(
+                model_name,
+                rpm=config["rpm"],
+                tpm=config["tpm"],
+                max_concurrency=config["max_concurrency"],
+                backoff_base=float(os.environ.get("LLM_BACKOFF_BASE", "1"))
+            )
+        return _RATE_LIMITERS[model_name]
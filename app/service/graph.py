@@ -1,17 +1,26 @@
 from .logger import LOGGER
 from .pyenv_manager import PythonEnvironmentManager
+from .venv_cache import get_venv_cache
 from .graph_node import GraphNode
+from .graph_index import GraphIndex
+from .graph_persister import get_graph_persister
+from .graph_codec import encode_graph, decode_graph, get_graph_compression, dumps, loads
+from .graph_scheduler import GraphScheduler
+from ..llms.http_client import async_http_client_scope
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import hashlib
 import json
 import threading
+import asyncio
 import time
-from collections import defaultdict
 import os
 import json
 
 # Add import for GCS
 from google.cloud import storage
 
+JOURNAL_FILE_NAME = "graph.journal.jsonl" # Append-only journal of the node changes written after the snapshot graph.json
+NODE_STATE_FIELDS = ("status", "_compiled", "_inputs", "_outputs", "_fingerprint") # Node attributes of a "state" journal record
 
 
 class Graph:
@@ -19,31 +28,68 @@ class Graph:
     This class represents a directed acyclic graph (DAG) of nodes.
     Each node can have multiple parents and children, and the graph can be executed
     in a topological order.
-    The graph can be saved to and loaded from a JSON file.
-    Seperate threads are used to execute the nodes concurrently.
-    If a node is waiting for its parent nodes to complete, it will wait for a specified timeout.
+    The graph can be saved to and loaded from a JSON file, saves are written behind by the GraphPersister.
+    A bounded pool of worker threads is used to execute the nodes concurrently (see GraphScheduler).
+    A node is only scheduled once all of its parent nodes are completed, at most `max_parallel_nodes` nodes run at once.
     The graph can also be compiled to check for circular dependencies and to generate a unique ID.
+    Compilation is incremental: only the nodes marked dirty by a mutation (see mark_dirty) are resolved and validated again.
+    The parent-child relationships are maintained incrementally by a GraphIndex, so edits cost O(degree) of the edited node.
     The graph can be executed from a specific starting node, and the execution can be controlled with timeouts.
     """
-    def __init__(self, timeout=10, venv_path=None, create_env=False, python_packages=[], save_dir=None):
+    def __init__(self, timeout=10, venv_path=None, create_env=False, python_packages=[], save_dir=None, max_parallel_nodes=None):
         self.nodePool = {
         } # Dictionary to hold all nodes
+        self.index = GraphIndex(self.nodePool) # Adjacency index of the nodes
         self.save_dir = save_dir # Directory to save the graph
         self.graph_id = None # Unique ID for the graph (auto-generated from the node hashes)
-        self.conditions = defaultdict(threading.Condition) # Dictionary to hold conditional variables for each node
+        self._dirty = set() # Set[str]: names of the nodes to resolve and validate again on the next compile
+        self._changed_nodes = {} # Dict[str, str]: nodes changed since the last write ("node", "state" or "remove"), see write_graph
+        self._journal_seq = 0 # Sequence number of the last journal record
+        self._needs_snapshot = True # The next write compacts the graph into a snapshot
+        self.journal_max_bytes = int(os.environ.get("GRAPH_JOURNAL_MAX_BYTES", str(8 * 1024 * 1024))) # Journal size beyond which it is compacted
         self.lock = threading.Lock() # Lock for thread safety
-        self.timeout = timeout # Timeout for node execution
+        self.write_lock = threading.Lock() # Serializes the writes of the graph, so concurrent writes never interleave
+        self.timeout = timeout # Seconds after the start of a run at which nodes still waiting for their parents are not started (None or 0: no limit)
+        self.max_parallel_nodes = max_parallel_nodes if max_parallel_nodes is not None else int(os.environ.get("MAX_PARALLEL_NODES", "8")) # Maximum number of nodes of this graph executing concurrently
 
         self.venv_path = venv_path # Path to the virtual environment
         self.python_packages = python_packages # List of Python packages to install in the virtual environment
         self.create_env = create_env # Flag to create a new virtual environment
 
-        if self.venv_path is not None:
-            self.python_env_manager = PythonEnvironmentManager(self.venv_path, self.create_env) # Initialize the Python environment manager
-            if python_packages:
-                self.python_env_manager.install_dependencies(python_packages) # Install the required packages
-        else:
-            self.python_env_manager = None
+        self.python_env_manager = self._resolve_python_env() # Initialize the Python environment manager
+
+    def _resolve_python_env(self, background=True):
+        """
+        Resolve the Python environment manager of the graph.
+        Graphs requiring packages share a content-addressed environment keyed by their package set (see VirtualEnvCache),
+        so the packages are installed once for all sessions and sessions never alter each other's environment.
+        Graphs without packages use the base environment at venv_path.
+        A missing environment is installed in the background (background=True), so creating or loading a session never
+        blocks on pip, Python nodes wait for the environment to be ready.
+        """
+        if self.venv_path is None:
+            return None
+        if self.python_packages:
+            return get_venv_cache().acquire(self.python_packages, background=background)
+        return PythonEnvironmentManager(self.venv_path, self.create_env)
+
+    def set_python_packages(self, python_packages, background=False):
+        """
+        Replace the Python packages of the graph, switching to the shared environment of the new package set.
+        """
+        previous_packages = self.python_packages
+        self.python_packages = get_venv_cache().normalize_packages(python_packages)
+        self.python_env_manager = self._resolve_python_env(background)
+        if previous_packages:
+            get_venv_cache().release(previous_packages)
+
+    def release_resources(self):
+        """
+        Release the shared resources held by the graph, e.g. when its session is deleted.
+        """
+        if self.venv_path is not None and self.python_packages:
+            get_venv_cache().release(self.python_packages)
+        self.python_env_manager = None
 
     def addInput(self, inputFields):
         """
@@ -71,6 +117,9 @@ class Graph:
                 LOGGER.error(f"Value '{value}' in input fields must be a string")
                 raise ValueError(f"Value '{value}' in input fields must be a string")
         
+        # The nodes referencing the previous input node resolve their references against the new one
+        self.mark_dirty(["inputs"])
+
         # Create a new input node with dummy instructions. Only the outputSchema are important. The nodename is fixed as "inputs"
         new_node = GraphNode("inputs", # nodeName
                                 "N/A", # systemInstructions
@@ -149,9 +198,11 @@ class Graph:
             toolDescription=toolDescription,
             **kwargs
         )
+        new_node.validate_definition()
         self.nodePool[nodeName] = new_node
+        self.mark_dirty([nodeName], dependents=False)
         try:
-            self.compile()
+            self.compile(raise_errors=False) # The new node is validated, other invalid nodes are not caused by it
         except Exception as e:
             LOGGER.error(f"Error compiling graph after adding node {nodeName}: {e}. Location: Graph.addNode")
             self.removeNode(nodeName)
@@ -171,21 +222,12 @@ class Graph:
         dependency_nodes = self._traverse_nodes(nodeName)
         dependency_nodes.remove(nodeName)
 
-        # Remove the node from its parents
-        for parent in self.nodePool[nodeName]._parents:
-            parent_node = self.nodePool[parent[0]]
-            if nodeName in parent_node._children:
-                parent_node._children.remove(nodeName)
-        # Remove the node from its children
-        for child in self.nodePool[nodeName]._children:
-            child_node = self.nodePool[child]
-            for parent in child_node._parents:
-                if parent[0] == nodeName:
-                    child_node._parents.remove(parent)
-
+        # Remove the node from its parents and its children
+        self.index.remove(nodeName)
 
         # Remove the node from the node pool
         del self.nodePool[nodeName]
+        self._record_changes([nodeName], "remove")
         LOGGER.info(f"Node {nodeName} removed from the graph. Location: Graph.removeNode")
         
         # Uncompile the graph which are dependent on this node including this node
@@ -236,13 +278,7 @@ class Graph:
         dependency_nodes = self._traverse_nodes(nodeName)
         dependency_nodes.remove(nodeName)
 
-        # # Existing kwargs
-        # existing_kwargs = self.nodePool[nodeName].kwargs
-
-        # Dlelete the node from the graph
-        self.removeNode(nodeName)
-
-        # Add the updated node
+        # Build and validate the updated node first, an invalid definition leaves the graph unchanged
         new_node = GraphNode(
             nodeName=nodeName,
             systemInstructions=systemInstructions,
@@ -255,15 +291,30 @@ class Graph:
             toolDescription=toolDescription,
             **kwargs
         )
+        new_node.validate_definition()
 
-        # Add the updated node to the node pool
+        # Replace the node in place: it is detached from its previous parents and keeps its children,
+        # whose references to it are validated again on compile
+        old_node = self.nodePool[nodeName]
+        self.index.detach(nodeName)
+        new_node._children = old_node._children
         self.nodePool[nodeName] = new_node
+        self.mark_dirty([nodeName])
 
         # Reset the compliation status of the graph which are dependent on this node including this node
         self.reset_compiled_nodes(dependency_nodes)
 
         # Compile the graph
-        self.compile()
+        try:
+            self.compile(raise_errors=False) # The new node is validated, other invalid nodes are not caused by it
+        except Exception as e:
+            # Put the previous node back, e.g. when the update introduced a circular dependency
+            LOGGER.error(f"Error compiling graph after updating node {nodeName}: {e}. Location: Graph.updateNode")
+            self.index.detach(nodeName)
+            self.nodePool[nodeName] = old_node
+            self.mark_dirty([nodeName])
+            self.compile(raise_errors=False)
+            raise ValueError(e)
 
         return new_node
     
@@ -280,77 +331,113 @@ class Graph:
         
         return self.nodePool[nodeName]
     
-    def compile(self):
+    def mark_dirty(self, nodeNames, dependents=True):
         """
-        Compile the graph by checking dependencies and setting parent-child relationships.
-        This method also checks for circular dependencies and generates a unique ID for the graph.
-        The graph ID is generated from the hashes of the nodes in the graph.
-        The graph is saved to a JSON file after compilation.
+        Mark nodes to be resolved and validated again by the next compile, e.g. after their definition changed.
+        nodeNames: names of the nodes
+        dependents: bool, also mark the child nodes, whose references to the nodes must be validated again
         """
-        # Compile the graph by checking dependencies and setting parent-child relationships
-        for node in self.nodePool.values():
-            if self.nodePool[node.nodeName].resolve_parent_nodes(self.nodePool) is not None:
-                self.nodePool[node.nodeName].resolve_engine()
-                node._compiled = True
-            else:
-                node._compiled = False
-                LOGGER.error(f"Node {node.nodeName} is not compiled. Location: Graph.compile")
+        for nodeName in nodeNames:
+            self._dirty.add(nodeName)
+            if dependents and nodeName in self.nodePool:
+                self._dirty.update(self.nodePool[nodeName]._children)
 
-        # Check for circular dependencies
-        self.check_circular_dependency()
+    def compile(self, raise_errors=True):
+        """
+        Compile the graph by checking dependencies and setting parent-child relationships.
+        Only the dirty nodes (see mark_dirty) are compiled, so editing one node costs O(affected nodes) instead of O(graph).
+        A node whose references cannot be resolved stays dirty and is compiled again on the next call, e.g. once its parent is added.
+        The Python code of the nodes is syntax-checked and their LLM configuration is validated, without constructing
+        any engine, so compiling never touches the network. A node with an invalid definition is left uncompiled and is
+        only validated again once its definition changes. With raise_errors=True (default) the first validation error
+        is raised once the other nodes are compiled, with raise_errors=False it is only logged (e.g. on load).
+        This method also checks for circular dependencies through the dirty nodes and generates a unique ID for the graph.
+        The graph ID is generated from the hashes of the nodes in the graph, which are only recomputed for the dirty nodes.
+        The graph is saved to a JSON file after compilation, unless nothing changed.
+        """
+        dirty_nodes = [nodeName for nodeName in self._dirty if nodeName in self.nodePool]
+        if not dirty_nodes and self.graph_id is not None:
+            self._dirty = set()
+            LOGGER.debug(f"Graph {self.graph_id} is up to date. Location: Graph.compile")
+            return
+
+        # Compile the dirty nodes by checking dependencies and setting parent-child relationships
+        failed_nodes = set()
+        invalid_nodes = {} # Dict[str, ValueError]: nodes with an invalid definition, not kept dirty
+        try:
+            for nodeName in dirty_nodes:
+                node = self.nodePool[nodeName]
+                # Detach the node from its previous parents, its references are resolved again
+                self.index.detach(nodeName)
+                node.id = node.hash()
+                if node.resolve_parent_nodes(self.nodePool) is not None:
+                    node.engine = None # The engine is resolved lazily on first execution
+                    try:
+                        node.validate_definition()
+                        node._compiled = True
+                    except ValueError as e:
+                        node._compiled = False
+                        invalid_nodes[nodeName] = e
+                        LOGGER.error(f"Node {node.nodeName} is not compiled: {e}. Location: Graph.compile")
+                else:
+                    node._compiled = False
+                    failed_nodes.add(nodeName)
+                    LOGGER.error(f"Node {node.nodeName} is not compiled. Location: Graph.compile")
+
+            # A new cycle goes through a node whose references changed, i.e. a dirty node
+            self.check_circular_dependency(dirty_nodes)
+        except Exception:
+            self._dirty.update(dirty_nodes)
+            raise
+        self._dirty = failed_nodes
+        self._record_changes(dirty_nodes)
 
         # Gnerate a unique graph ID from the node hashes
-        node_hashes = [node.hash() for node in self.nodePool.values()]
-        self.graph_id = hashlib.sha256("".join(node_hashes).encode()).hexdigest()
+        self.graph_id = hashlib.sha256("".join(node.id for node in self.nodePool.values()).encode()).hexdigest()
 
-        LOGGER.info(f"Graph compiled with ID: {self.graph_id}. Location: Graph.compile")
+        LOGGER.info(f"Graph compiled with ID: {self.graph_id} ({len(dirty_nodes)} nodes compiled). Location: Graph.compile")
 
         # Save the graph
         self.save_graph()
 
+        if invalid_nodes and raise_errors:
+            raise next(iter(invalid_nodes.values()))
+
     def reset_compiled_nodes(self,nodeNames=None):
         """
         Reset the compiled status of all nodes in the graph.
-        This method sets the status of all nodes to "pending" and clears their parent and child relationships.
+        This method sets the status of all nodes to "pending" and marks them dirty, their relationships are resolved again on compile.
         It also clears the inputs and outputs of all nodes.
         The graph is saved to a JSON file after resetting.
         Exception: input node is not reset.
         """
         # Reset the compiled status of all nodes
-        target_node_names = self.nodePool.keys() if nodeNames is None else nodeNames
-        for node in self.nodePool.values():
-            if node.nodeName == "inputs" or node.nodeName not in target_node_names:
+        target_node_names = list(self.nodePool) if nodeNames is None else nodeNames
+        for nodeName in target_node_names:
+            node = self.nodePool.get(nodeName)
+            if node is None or nodeName == "inputs":
                 continue
             node._compiled = False
             node.status = "pending"
-            node._parents = []
-            node._children = []
             node._inputs = {}
             node._outputs = {}
+            node._fingerprint = None
+            self._dirty.add(node.nodeName)
+            self._record_changes([nodeName], "state")
         LOGGER.info("All nodes reset to uncompiled state. Location: Graph.reset_compiled_nodes")
 
         # self.compile() # Recompile the graph
         self.save_graph()
         
-    def check_circular_dependency(self):
+    def check_circular_dependency(self, nodeNames=None):
         """
         Check for circular dependencies in the graph.
+        nodeNames: names of the nodes to search from, all nodes by default. Any cycle reachable from them is detected.
         """
         # Check for circular dependencies in the graph
-        visited = set()
-        stack = set()
-        def visit(node):
-            if node in stack:
-                raise ValueError(f"Circular dependency detected: {node}. Location: Graph.check_circular_dependency")
-            if node not in visited:
-                visited.add(node)
-                stack.add(node)
-                for child in self.nodePool[node]._children:
-                    visit(child)
-                stack.remove(node)
-        for node in self.nodePool:
-            if node not in visited:
-                visit(node)
+        node = self.index.find_cycle(self.nodePool if nodeNames is None else nodeNames)
+        if node is not None:
+            raise ValueError(f"Circular dependency detected: {node}. Location: Graph.check_circular_dependency")
         return True
      
     
@@ -362,67 +449,20 @@ class Graph:
             print(node.to_dict())
         print("\n")
 
-    def _execute_node_with_condition(self, node, timeout, involved_nodes):
-        """
-        Execute a node with a condition to wait for its parent nodes to complete.
-        node: GraphNode object representing the node to be executed.
-        timeout: int, timeout for the node execution.
-        involved_nodes: set, set of nodes involved in the execution
-
-        This method uses a condition variable to wait for the parent nodes to complete before executing the node.
-        It also handles timeouts and notifies all waiting threads when a node is completed.
-        """
-
-        start_time = time.time() # Record the start time
-        condition = self.conditions[node.nodeName] # Get the condition variable for the node
-
-        # Wait for the parent nodes to complete
-        with condition:
-            while not node.check_parent_status(self.nodePool):
-                remaining = timeout - (time.time() - start_time)
-                if remaining <= 0:
-                    LOGGER.warning(f"Timeout reached for node {node.nodeName}. Location: Graph._execute_node_with_condition")
-                    raise TimeoutError(f"Node {node.nodeName} timed out.")
-                LOGGER.debug(f"Node {node.nodeName} is waiting for parent nodes to complete. Location: Graph._execute_node_with_condition")
-                condition.wait(timeout=remaining)
-
-        # Execute the node
-        with self.lock:
-            involved_nodes.add(node.nodeName)
-            LOGGER.info(f"Running node: {node.nodeName}. Location: Graph._execute_node_with_condition")
-            result = node.execute(self.nodePool, self.python_env_manager) # Execute the node
-            LOGGER.info(f"Completed node: {node.nodeName} with result: {result} . Location: Graph._execute_node_with_condition")
-
-        # Notify all waiting threads
-        for child in node._children:
-            # if all parents of the child node are completed
-            if self.nodePool[child].check_parent_status(self.nodePool):
-                with self.lock:
-                    # Notify all waiting threads for the child node
-                    with self.conditions[child]:
-                        self.conditions[child].notify_all()
-
     def _traverse_nodes(self, start_node):
         """
-        Depth-first traversal of the graph starting from a specific node.
+        Breadth-first traversal of the graph starting from a specific node.
         Returns a list of all visited nodenames
         """
-        visited = set()
-        queue = [start_node]
-        while queue:
-            current = queue.pop(0)
-            if current in visited:
-                continue
-            visited.add(current)
-            node = self.nodePool[current]
-            queue.extend(node._children)
-        
-        return list(visited)
+        return list(self.index.descendants(start_node))
     
-    def execute_from_node(self, start_node):
-        # Execute the graph from a specific starting node
+    def _prepare_execution(self, start_node):
+        """
+        Validate that the graph can be executed from a specific starting node and reset the involved nodes to pending.
+        Returns the list of node names to be executed.
+        """
         if start_node not in self.nodePool:
-            LOGGER.error(f"Node with name {start_node} does not exist. Location: Graph.execute_from_node")
+            LOGGER.error(f"Node with name {start_node} does not exist. Location: Graph._prepare_execution")
             raise ValueError(f"Node with name {start_node} does not exist.")
         
         visited = self._traverse_nodes(start_node)
@@ -431,7 +471,7 @@ class Graph:
         for node_name in visited:
             node = self.nodePool[node_name]
             if not node._compiled:
-                LOGGER.error(f"Node {node_name} is not compiled. Location: Graph.execute_from_node")
+                LOGGER.error(f"Node {node_name} is not compiled. Location: Graph._prepare_execution")
                 raise ValueError(f"Node {node_name} is not compiled.")
             
         # Check if all nodes are completed
@@ -440,56 +480,172 @@ class Graph:
                 continue
             node = self.nodePool[node_name]
             if node.status == "running" or node.status == "waiting":
-                LOGGER.error(f"Node {node_name} is already running or waiting. Location: Graph.execute_from_node")  
+                LOGGER.error(f"Node {node_name} is already running or waiting. Location: Graph._prepare_execution")  
                 raise ValueError(f"Node {node_name} is already running or waiting.")
             node.status = "pending"
             LOGGER.info(f"Node {node_name} status set to pending.")
 
+        return visited
 
-        threads = [] # List to hold threads for concurrent execution
-        involved_nodes = set() # Set to hold nodes involved in the traversal
+    def _emit_run_finished(self, visited, on_event):
+        if on_event is None:
+            return
+        try:
+            on_event({"event": "run_finished", "node_status": {node_name: self.nodePool[node_name].status for node_name in visited}})
+        except Exception as e:
+            LOGGER.error(f"Error in execution event listener: {e}. Location: Graph._emit_run_finished")
 
-        # Execute the nodes in a separate thread
+    def execute_from_node(self, start_node, incremental=False, on_event=None, cancel_event=None):
+        """
+        Execute the graph from a specific starting node.
+        With incremental=True the nodes whose definition and resolved inputs did not change since their last successful
+        execution keep their outputs, only the changed nodes and the descendants whose inputs change are executed.
+        on_event: optional callable receiving the node events of the run (see GraphScheduler) and a final run_finished event.
+        cancel_event: optional threading.Event, once set no further node is started.
+        """
+        visited = self._prepare_execution(start_node)
+
+        # Execute the nodes on a bounded pool of worker threads
+        scheduler = GraphScheduler(self.nodePool, self.python_env_manager, self.max_parallel_nodes, on_event=on_event, cancel_event=cancel_event, timeout=self.timeout)
         try:
-            for node_name in visited:
-                node = self.nodePool[node_name]
-                if node.status == "pending":
-                    # Create a new thread for each node
-                    thread = threading.Thread(target=self._execute_node_with_condition, args=(node, self.timeout, involved_nodes))
-                    threads.append(thread)
-                    thread.start()
-                    LOGGER.info(f"Thread started for node: {node_name} . Location: Graph.execute_from_node")
-            
-            for thread in threads:
-                thread.join() # Wait for all threads to complete
-
-        except TimeoutError as e:
-            # Handle timeout error
-            LOGGER.critical(f"Timeout error: {e}")
-            # Set the status of all involved nodes to completed if they are still running (!!Unnecessary, already handled in finally block)
-            for node_name in involved_nodes:
-                node = self.nodePool[node_name]
-                if node.status == "running":
-                    node.status = "completed"
-                    LOGGER.warning(f"Node {node_name} status set to completed due to timeout. Location: Graph.execute_from_node")
-            LOGGER.error(f"Error during execution: {e}")
-            
+            scheduler.run(visited, incremental=incremental)
+        except Exception as e:
+            LOGGER.error(f"Error during execution: {e}. Location: Graph.execute_from_node")
         finally:
-            # # Set the status of all nodes to completed if they are still running
-            # for node_name in visited:
-            #     node = self.nodePool[node_name]
-            #     if node.status == "running":
-            #         node.status = "completed"
-            #         LOGGER.info(f"Node {node_name} status set to completed. Location: Graph.execute_from_node")
             LOGGER.info("Execution completed for all nodes. Location: Graph.execute_from_node")
 
+        self._record_changes(visited, "state")
         self.save_graph()
+        self._emit_run_finished(visited, on_event)
+
+    async def aexecute_from_node(self, start_node, incremental=False, on_event=None, cancel_event=None):
+        """
+        Async variant of execute_from_node.
+        All nodes are executed as tasks on the running event loop, LLM calls use the engines' async `arun`.
+        """
+        visited = self._prepare_execution(start_node)
+
+        scheduler = GraphScheduler(self.nodePool, self.python_env_manager, self.max_parallel_nodes, on_event=on_event, cancel_event=cancel_event, timeout=self.timeout)
+        try:
+            async with async_http_client_scope(): # The pooled connections of the LLM calls are closed with the run
+                await scheduler.arun(visited, incremental=incremental)
+        except Exception as e:
+            LOGGER.error(f"Error during execution: {e}. Location: Graph.aexecute_from_node")
+        finally:
+            LOGGER.info("Execution completed for all nodes. Location: Graph.aexecute_from_node")
+
+        self._record_changes(visited, "state")
+        await asyncio.to_thread(self.save_graph)
+        self._emit_run_finished(visited, on_event)
+
+    def _run_batch_row(self, row_index, row, output_nodes):
+        """
+        Execute the graph for a single input row on a private copy of the node pool.
+        The shared nodes are never modified, so rows can run concurrently with each other.
+
+        Output:
+        Dictionary with the row index, its status and the outputs of the requested nodes.
+        """
+        try:
+            if not isinstance(row, dict):
+                raise ValueError("Each row must be a dictionary of input fields.")
+            inputs_schema = self.nodePool["inputs"].outputSchema
+            for key, value in row.items():
+                if key not in inputs_schema:
+                    raise ValueError(f"Input field '{key}' does not exist.")
+                if not isinstance(value, str):
+                    raise ValueError(f"Value of input field '{key}' must be a string.")
+
+            nodePool = {node_name: node.clone_for_run() for node_name, node in self.nodePool.items()}
+            nodePool["inputs"]._outputs.update(row)
+
+            scheduler = GraphScheduler(nodePool, self.python_env_manager, self.max_parallel_nodes, timeout=self.timeout)
+            scheduler.run([node_name for node_name in nodePool if node_name != "inputs"])
+        except Exception as e:
+            LOGGER.error(f"Error executing batch row {row_index}: {e}. Location: Graph._run_batch_row")
+            return {"row": row_index, "status": "error", "error": str(e)}
+
+        node_names = output_nodes if output_nodes is not None else [node_name for node_name in nodePool if node_name != "inputs"]
+        statuses = {node_name: nodePool[node_name].status for node_name in node_names if node_name in nodePool}
+        return {
+            "row": row_index,
+            "status": "completed" if all(status == "completed" for status in statuses.values()) else "error",
+            "node_status": statuses,
+            "outputs": {node_name: nodePool[node_name]._outputs for node_name in statuses}
+        }
+
+    def execute_batch(self, rows, max_parallel_rows=None, output_nodes=None):
+        """
+        Execute the compiled graph once per input row and yield the result of every row as soon as it completes.
+        Each row runs in an isolated copy of the node pool whose `inputs` outputs are overridden by the row, so the
+        state of the graph itself is left untouched and nothing is saved. Engines, the Python environment and the LLM
+        response cache are shared by all rows.
+        rows: iterable of Dict[str, str], values of the input fields of each row (missing fields keep their current value)
+        max_parallel_rows: int, number of rows executing at once, defaults to the MAX_PARALLEL_BATCH_ROWS environment variable
+        output_nodes: List[str], nodes whose outputs are returned, all nodes by default
+
+        Output:
+        Generator of Dict: {"row": int, "status": str, "node_status": Dict, "outputs": Dict} in completion order
+        The graph is validated before the generator is returned (see validate_batch).
+        """
+        self.validate_batch(output_nodes)
+        if max_parallel_rows is None:
+            max_parallel_rows = int(os.environ.get("MAX_PARALLEL_BATCH_ROWS", "4"))
+        return self._iter_batch_rows(rows, max(1, int(max_parallel_rows)), output_nodes)
+
+    def validate_batch(self, output_nodes=None):
+        """
+        Check that the graph can execute a batch: it has an inputs node, all its nodes are compiled and the output nodes exist.
+        Raises a ValueError otherwise.
+        """
+        if "inputs" not in self.nodePool:
+            raise ValueError("The graph has no inputs node.")
+        for node_name, node in self.nodePool.items():
+            if not node._compiled:
+                LOGGER.error(f"Node {node_name} is not compiled. Location: Graph.execute_batch")
+                raise ValueError(f"Node {node_name} is not compiled.")
+        if output_nodes is not None:
+            for node_name in output_nodes:
+                if node_name not in self.nodePool:
+                    raise ValueError(f"Node with name {node_name} does not exist.")
+
+    def _iter_batch_rows(self, rows, max_parallel_rows, output_nodes):
+        rows = iter(enumerate(rows))
+        with ThreadPoolExecutor(max_workers=max_parallel_rows, thread_name_prefix="graph-batch") as executor:
+            futures = set()
+            try:
+                while True:
+                    # Keep a bounded number of rows in flight so that large batches are not materialized at once
+                    for row_index, row in rows:
+                        futures.add(executor.submit(self._run_batch_row, row_index, row, output_nodes))
+                        if len(futures) >= max_parallel_rows * 2:
+                            break
+                    if not futures:
+                        break
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            finally:
+                # The consumer stopped early (e.g. the client disconnected), drop the rows not started yet
+                for future in futures:
+                    future.cancel()
+
+    def approximate_size(self):
+        """
+        Approximate memory footprint of the graph in bytes, dominated by the prompts, code, inputs and outputs of its nodes.
+        """
+        size = 0
+        for node in list(self.nodePool.values()):
+            size += len(node.systemInstructions) + len(node.userPrompt) + len(node.pythonCode.get("function_body", ""))
+            for values in (node.outputSchema, node._inputs, node._outputs):
+                size += sum(len(str(value)) for value in values.values())
+        return size
 
     def to_dict(self):
         # Convert the graph to a dictionary representation
         graph_dict = {
             "graph_id": self.graph_id,
-            "nodes": {node_name: node.to_dict() for node_name, node in self.nodePool.items()}, # Dictionary of nodes
+            "nodes": {node_name: node.to_dict() for node_name, node in list(self.nodePool.items())}, # Dictionary of nodes
             "venv_path": self.venv_path,
             "python_packages": self.python_packages,
             "create_env": self.create_env
@@ -497,45 +653,261 @@ class Graph:
         return graph_dict
 
 
-    def save_graph(self):
+    def save_graph(self, sync=False):
         """
         Save the graph to a JSON file or GCS bucket.
+        The graph is only marked dirty and written in the background by the GraphPersister, which coalesces repeated saves.
+        sync: bool, write the graph before returning, e.g. before it is unloaded from memory.
+        Without write-behind (GRAPH_WRITE_BEHIND=false) the graph is always written synchronously.
+        """
+        persister = get_graph_persister()
+        if persister is None:
+            self.write_graph()
+        elif sync:
+            persister.write(self)
+        else:
+            persister.schedule(self)
+
+    def write_graph(self):
+        """
+        Write the graph to a JSON file or GCS bucket.
         Path is resolved as : /self.save_dir(session_id)/graph.json
         The graph is saved in a directory specified by the save_dir attribute or to GCS if ACCESS_GCS is true.
+        On local disk the graph is stored as a snapshot (graph.json) plus an append-only journal (graph.journal.jsonl):
+        a write only appends the nodes changed since the previous write, so persisting a node completion costs
+        O(size of the node) instead of O(size of the graph). The journal is compacted into a new snapshot once it exceeds
+        journal_max_bytes. In GCS the whole graph is uploaded.
+        Snapshots use the compact v2 format with large strings stored once, optionally compressed (see graph_codec).
+        Concurrent writes are serialized, also without write-behind (GRAPH_WRITE_BEHIND=false).
         """
+        with self.write_lock:
+            self._write_graph()
+
+    def _write_graph(self):
         access_gcs = os.environ.get("ACCESS_GCS", "false").lower() == "true"
         gcs_bucket = os.environ.get("GCS_BUCKET")
         file_name = "graph.json"
         file_path = os.path.join(self.save_dir, file_name)
 
+        with self.lock:
+            changes, self._changed_nodes = self._changed_nodes, {}
+            needs_snapshot, self._needs_snapshot = self._needs_snapshot, False
+
         if access_gcs:
             if not gcs_bucket:
-                LOGGER.error("GCS_BUCKET environment variable is not set. Location: Graph.save_graph")
-                raise ValueError("GCS_BUCKET environment variable is not set. Location: Graph.save_graph")
+                LOGGER.error("GCS_BUCKET environment variable is not set. Location: Graph.write_graph")
+                raise ValueError("GCS_BUCKET environment variable is not set. Location: Graph.write_graph")
             # Save to GCS
             try:
                 client = storage.Client()
                 bucket = client.bucket(gcs_bucket)
                 blob_path = os.path.join(self.save_dir, file_name) if self.save_dir else file_name
                 blob = bucket.blob(blob_path)
-                blob.upload_from_string(json.dumps(self.to_dict(), indent=4), content_type="application/json")
-                LOGGER.info(f"Graph saved to GCS: gs://{gcs_bucket}/{blob_path}. Location: Graph.save_graph")
+                compression = get_graph_compression()
+                blob.upload_from_string(
+                    encode_graph(self.to_dict(), compression),
+                    content_type="application/json" if compression == "none" else "application/octet-stream"
+                )
+                LOGGER.info(f"Graph saved to GCS: gs://{gcs_bucket}/{blob_path}. Location: Graph.write_graph")
             except Exception as e:
-                LOGGER.error(f"Failed to save graph to GCS: {e}. Location: Graph.save_graph")
+                self._restore_changes(changes, needs_snapshot)
+                LOGGER.error(f"Failed to save graph to GCS: {e}. Location: Graph.write_graph")
                 raise
         else:
             # Save to local disk
             if not self.save_dir:
-                LOGGER.error("Save directory is not set. Location: Graph.save_graph")
-                raise ValueError("Save directory is not set. Location: Graph.save_graph")
-            with open(file_path, "w") as f:
-                json.dump(self.to_dict(), f, indent=4)
-            LOGGER.info(f"Graph saved to {file_path}. Location: Graph.save_graph")
+                LOGGER.error("Save directory is not set. Location: Graph.write_graph")
+                raise ValueError("Save directory is not set. Location: Graph.write_graph")
+            journal_path = os.path.join(self.save_dir, JOURNAL_FILE_NAME)
+            try:
+                journal_size = os.path.getsize(journal_path) if os.path.exists(journal_path) else 0
+                if (needs_snapshot or not os.path.exists(file_path) or journal_size > self.journal_max_bytes
+                        or len(changes) > len(self.nodePool) // 2):
+                    self._write_snapshot(file_path, journal_path)
+                    LOGGER.info(f"Graph saved to {file_path}. Location: Graph.write_graph")
+                elif changes:
+                    self._append_journal(journal_path, changes, journal_size == 0)
+                    LOGGER.info(f"{len(changes)} node changes appended to {journal_path}. Location: Graph.write_graph")
+            except Exception:
+                self._restore_changes(changes, needs_snapshot)
+                raise
+
+    def _record_changes(self, nodeNames, change="node"):
+        """
+        Record nodes changed since the last write, only they are appended to the journal.
+        change: "node" (definition, relationships and state), "state" (status, inputs and outputs) or "remove"
+        """
+        with self.lock:
+            for nodeName in nodeNames:
+                if change == "state" and self._changed_nodes.get(nodeName) in ("node", "remove"):
+                    continue
+                self._changed_nodes[nodeName] = change
+
+    def _restore_changes(self, changes, needs_snapshot):
+        """
+        Record again the changes of a failed write, without overriding the changes recorded meanwhile.
+        """
+        with self.lock:
+            for nodeName, change in changes.items():
+                current = self._changed_nodes.get(nodeName)
+                if current is None or (current == "state" and change != "state"):
+                    self._changed_nodes[nodeName] = change
+            self._needs_snapshot = self._needs_snapshot or needs_snapshot
+
+    def _write_file_atomically(self, file_path, data):
+        """
+        Write a file through a synced temporary file renamed over it, so a crash leaves either the previous or the new file.
+        """
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+        self._fsync_dir(self.save_dir)
+
+    def _write_snapshot(self, file_path, journal_path):
+        """
+        Compact the graph into a new snapshot and drop the journal.
+        The snapshot records the sequence number of the last journal record it includes, so the records left by a crash
+        between the two steps are skipped on load.
+        """
+        with self.lock:
+            journal_seq = self._journal_seq
+        data = self.to_dict()
+        data["journal_seq"] = journal_seq
+        self._write_file_atomically(file_path, encode_graph(data))
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+            self._fsync_dir(self.save_dir)
+
+    def _append_journal(self, journal_path, changes, new_file):
+        """
+        Append the changed nodes and the graph settings to the journal as one synced write of JSON lines.
+        """
+        records = []
+        with self.lock:
+            for nodeName, change in changes.items():
+                node = self.nodePool.get(nodeName)
+                if change == "remove":
+                    record = {"op": "remove", "node": nodeName}
+                elif node is None:
+                    continue
+                elif change == "node":
+                    record = {"op": "node", "node": nodeName, "data": node.to_dict()}
+                else:
+                    record = {"op": "state", "node": nodeName, "data": {key: getattr(node, key) for key in NODE_STATE_FIELDS}}
+                self._journal_seq += 1
+                records.append({"seq": self._journal_seq, **record})
+            self._journal_seq += 1
+            records.append({
+                "seq": self._journal_seq,
+                "op": "graph",
+                "data": {"venv_path": self.venv_path, "python_packages": self.python_packages, "create_env": self.create_env}
+            })
+        with open(journal_path, "ab") as f:
+            f.write(b"".join(dumps(record) + b"\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+        if new_file:
+            self._fsync_dir(self.save_dir)
+
+    @staticmethod
+    def _fsync_dir(directory):
+        """
+        Sync a directory so that a rename inside it survives a crash. Not supported on every platform.
+        """
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _load_node(node_data):
+        """
+        Build a node from its dictionary representation (see GraphNode.to_dict).
+        """
+        node = GraphNode(
+            nodeName=node_data["nodeName"],
+            systemInstructions=node_data["systemInstructions"],
+            userPrompt=node_data["userPrompt"],
+            pythonCode=node_data["pythonCode"],
+            outputSchema=node_data["outputSchema"],
+            useLLM=node_data["useLLM"],
+            jsonMode=node_data["jsonMode"],
+            toolName=node_data["toolName"],
+            toolDescription=node_data["toolDescription"],
+            **node_data["kwargs"]
+        )
+        node._compiled = node_data["_compiled"]
+        node._parents = node_data["_parents"]
+        node._children = set(node_data["_children"])
+        node._inputs = node_data["_inputs"]
+        node._outputs = node_data["_outputs"]
+        node._fingerprint = node_data.get("_fingerprint")
+        node.status = node_data["status"]
+        return node
+
+    def _load_data(self, data):
+        """
+        Load the nodes and settings of a snapshot.
+        """
+        for node_name, node_data in data["nodes"].items():
+            self.nodePool[node_name] = self._load_node(node_data)
+            self._dirty.add(node_name)
+        self.venv_path = data.get("venv_path", None)
+        self.python_packages = data.get("python_packages", [])
+        self.create_env = data.get("create_env", False)
+
+    def _replay_journal(self, journal_path, journal_seq):
+        """
+        Apply the journal records written after the snapshot, in order.
+        A truncated last record, left by a crash during an append, is ignored and the journal is compacted on the next write.
+        """
+        self._journal_seq = journal_seq
+        if not os.path.exists(journal_path):
+            return
+        replayed = 0
+        with open(journal_path, "rb") as f:
+            for line in f:
+                try:
+                    record = loads(line)
+                except ValueError:
+                    LOGGER.warning(f"Ignoring the truncated end of {journal_path}. Location: Graph._replay_journal")
+                    self._needs_snapshot = True
+                    break
+                if record["seq"] <= self._journal_seq:
+                    continue
+                if record["op"] == "node":
+                    self.nodePool[record["node"]] = self._load_node(record["data"])
+                    self._dirty.add(record["node"])
+                elif record["op"] == "state" and record["node"] in self.nodePool:
+                    node = self.nodePool[record["node"]]
+                    for key, value in record["data"].items():
+                        setattr(node, key, value)
+                elif record["op"] == "remove":
+                    self.nodePool.pop(record["node"], None)
+                elif record["op"] == "graph":
+                    self.venv_path = record["data"]["venv_path"]
+                    self.python_packages = record["data"]["python_packages"]
+                    self.create_env = record["data"]["create_env"]
+                self._journal_seq = record["seq"]
+                replayed += 1
+        if os.path.getsize(journal_path) > self.journal_max_bytes:
+            self._needs_snapshot = True
+        LOGGER.info(f"Replayed {replayed} journal records from {journal_path}. Location: Graph._replay_journal")
 
     def load_graph(self):
         """
-        Load the graph from a JSON file or GCS bucket.
+        Load the graph from a JSON file or GCS bucket, in the v1 or v2 format (see graph_codec).
         Path is resolved as : /self.save_dir(session_id)/graph.json
+        On local disk the journal written after the snapshot is replayed (see write_graph).
         """
         access_gcs = os.environ.get("ACCESS_GCS", "false").lower() == "true"
         gcs_bucket = os.environ.get("GCS_BUCKET")
@@ -555,35 +927,9 @@ class Graph:
                 if not blob.exists():
                     LOGGER.error(f"Graph file not found in GCS: gs://{gcs_bucket}/{blob_path}. Location: Graph.load_graph")
                     raise FileNotFoundError(f"Graph file not found in GCS: gs://{gcs_bucket}/{blob_path}")
-                data = json.loads(blob.download_as_text())
-                for node_name, node_data in data["nodes"].items():
-                    node = GraphNode(
-                        nodeName=node_data["nodeName"],
-                        systemInstructions=node_data["systemInstructions"],
-                        userPrompt=node_data["userPrompt"],
-                        pythonCode=node_data["pythonCode"],
-                        outputSchema=node_data["outputSchema"],
-                        useLLM=node_data["useLLM"],
-                        jsonMode=node_data["jsonMode"],
-                        toolName=node_data["toolName"],
-                        toolDescription=node_data["toolDescription"],
-                        **node_data["kwargs"]
-                    )
-                    node._compiled = node_data["_compiled"]
-                    node._parents = node_data["_parents"]
-                    node._children = node_data["_children"]
-                    node._inputs = node_data["_inputs"]
-                    node._outputs = node_data["_outputs"]
-                    node.status = node_data["status"]
-                    self.nodePool[node_name] = node
-
-                self.venv_path = data.get("venv_path", None)
-                self.python_packages = data.get("python_packages", [])
-                self.create_env = data.get("create_env", False)
-                if self.venv_path is not None:
-                    self.python_env_manager = PythonEnvironmentManager(self.venv_path, self.create_env)
-                    if self.python_packages:
-                        self.python_env_manager.install_dependencies(self.python_packages)
+                data = decode_graph(blob.download_as_bytes())
+                self._load_data(data)
+                self.python_env_manager = self._resolve_python_env()
                 LOGGER.info(f"Graph loaded from GCS: gs://{gcs_bucket}/{blob_path}. Location: Graph.load_graph")
             except Exception as e:
                 LOGGER.error(f"Error loading graph from GCS: {e}. Location: Graph.load_graph")
@@ -591,37 +937,13 @@ class Graph:
         else:
             # Load from local disk
             try:
-                with open(file_path, "r") as f:
-                    data = json.load(f)
-                    for node_name, node_data in data["nodes"].items():
-                        node = GraphNode(
-                            nodeName=node_data["nodeName"],
-                            systemInstructions=node_data["systemInstructions"],
-                            userPrompt=node_data["userPrompt"],
-                            pythonCode=node_data["pythonCode"],
-                            outputSchema=node_data["outputSchema"],
-                            useLLM=node_data["useLLM"],
-                            jsonMode=node_data["jsonMode"],
-                            toolName=node_data["toolName"],
-                            toolDescription=node_data["toolDescription"],
-                            **node_data["kwargs"]
-                        )
-                        node._compiled = node_data["_compiled"]
-                        node._parents = node_data["_parents"]
-                        node._children = node_data["_children"]
-                        node._inputs = node_data["_inputs"]
-                        node._outputs = node_data["_outputs"]
-                        node.status = node_data["status"]
-                        self.nodePool[node_name] = node
-
-                    self.venv_path = data.get("venv_path", None)
-                    self.python_packages = data.get("python_packages", [])
-                    self.create_env = data.get("create_env", False)
-                    if self.venv_path is not None:
-                        self.python_env_manager = PythonEnvironmentManager(self.venv_path, self.create_env)
-                        if self.python_packages:
-                            self.python_env_manager.install_dependencies(self.python_packages)
-                    LOGGER.info(f"Graph loaded from {file_path}. Location: Graph.load_graph")
+                with open(file_path, "rb") as f:
+                    data = decode_graph(f.read())
+                self._load_data(data)
+                self._needs_snapshot = False
+                self._replay_journal(os.path.join(self.save_dir, JOURNAL_FILE_NAME), data.get("journal_seq", 0))
+                self.python_env_manager = self._resolve_python_env()
+                LOGGER.info(f"Graph loaded from {file_path}. Location: Graph.load_graph")
             except FileNotFoundError:
                 LOGGER.error(f"Graph file not found: {file_path}. Location: Graph.load_graph")
                 raise
@@ -631,5 +953,9 @@ class Graph:
             except Exception as e:
                 LOGGER.error(f"Error loading graph: {e}. Location: Graph.load_graph")
                 raise
-        self.compile()
-        LOGGER.info(f"Graph compiled after loading. Location: Graph.load_graph")
\ No newline at end of file
+        # The child sets are derived from the references, which the journal keeps up to date
+        self.index.rebuild()
+        self.compile(raise_errors=False) # A node which no longer validates is left uncompiled, the graph stays loadable
+        # The loaded state is already persisted
+        with self.lock:
+            self._changed_nodes = {}
@@ -0,0 +1,136 @@
+from .logger import LOGGER
+import gzip
+import hashlib
+import json
+import os
+
+try:
+    import orjson # Fast JSON encoder and decoder, the standard library is used without it
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard # zstd compression of saved graphs
+except ImportError:
+    zstandard = None
+
+
+####################################################################################################
+# On-disk format of saved graphs.
+# v1: the graph dictionary (see Graph.to_dict) as JSON.
+# v2: {"format": 2, "values": {hash: string}, "graph": graph dictionary} as JSON without indentation, where every
+#     string of at least GRAPH_INTERN_MIN_LENGTH characters is stored once in the value table and replaced by
+#     "$$v:<hash>". Prompts, inputs and outputs repeated across nodes (e.g. an input copied into the outputs of the
+#     input node and the inputs of every consuming node) are stored once.
+# The encoded file is optionally compressed with gzip or zstd (GRAPH_COMPRESSION), which is detected on read from its
+# magic bytes, so any file written by any configuration can be read.
+####################################################################################################
+
+FORMAT_VERSION = 2
+VALUE_PREFIX = "$$v:" # Prefix of a reference to the value table
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def dumps(obj):
+    """
+    Encode an object as compact JSON bytes.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def loads(data):
+    """
+    Decode JSON bytes or string.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _intern(value, values, min_length):
+    if isinstance(value, str):
+        # Strings looking like a reference are interned whatever their length, so decoding is unambiguous
+        if len(value) >= min_length or value.startswith(VALUE_PREFIX):
+            key = hashlib.blake2b(value.encode(), digest_size=16).hexdigest()
+            values[key] = value
+            return VALUE_PREFIX + key
+        return value
+    if isinstance(value, dict):
+        return {key: _intern(item, values, min_length) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_intern(item, values, min_length) for item in value]
+    return value
+
+
+def _resolve(value, values):
+    if isinstance(value, str):
+        return values[value[len(VALUE_PREFIX):]] if value.startswith(VALUE_PREFIX) else value
+    if isinstance(value, dict):
+        return {key: _resolve(item, values) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_resolve(item, values) for item in value]
+    return value
+
+
+def get_graph_compression():
+    """
+    Compression of saved graphs from the GRAPH_COMPRESSION environment variable: "none", "gzip" or "zstd".
+    zstd falls back to gzip when the zstandard package is not installed.
+    """
+    compression = os.environ.get("GRAPH_COMPRESSION", "none").lower()
+    if compression == "zstd" and zstandard is None:
+        LOGGER.warning("GRAPH_COMPRESSION=zstd requires the zstandard package, using gzip. Location: get_graph_compression")
+        return "gzip"
+    if compression not in ("none", "gzip", "zstd"):
+        LOGGER.warning(f"Unknown GRAPH_COMPRESSION {compression}, saving uncompressed. Location: get_graph_compression")
+        return "none"
+    return compression
+
+
+def encode_graph(graph_dict, compression=None, min_length=None):
+    """
+    Encode a graph dictionary in the v2 format.
+    Input:
+        graph_dict: Dict, see Graph.to_dict
+        compression: "none", "gzip" or "zstd", GRAPH_COMPRESSION by default
+        min_length: minimum length of the interned strings, GRAPH_INTERN_MIN_LENGTH (default 256) by default
+    Output:
+        bytes
+    """
+    if compression is None:
+        compression = get_graph_compression()
+    if min_length is None:
+        min_length = int(os.environ.get("GRAPH_INTERN_MIN_LENGTH", "256"))
+    values = {}
+    graph = _intern(graph_dict, values, min_length)
+    data = dumps({"format": FORMAT_VERSION, "values": values, "graph": graph})
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    return data
+
+
+def decode_graph(data):
+    """
+    Decode a saved graph in the v1 or v2 format, compressed or not.
+    Input:
+        data: bytes
+    Output:
+        Dict, see Graph.to_dict
+    """
+    if data[:4] == ZSTD_MAGIC:
+        if zstandard is None:
+            raise ValueError("The graph is compressed with zstd but the zstandard package is not installed.")
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    elif data[:2] == GZIP_MAGIC:
+        data = gzip.decompress(data)
+    document = loads(data)
+    if document.get("format") == FORMAT_VERSION:
+        return _resolve(document["graph"], document["values"])
+    if "format" in document:
+        raise ValueError(f"Unsupported graph format {document['format']}.")
+    return document # v1
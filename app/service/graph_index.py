@@ -0,0 +1,97 @@
+from collections import deque
+
+
+class GraphIndex:
+    """
+    Adjacency index of the nodes of a graph, maintained incrementally on every mutation of the graph.
+    The index is stored on the nodes themselves, so the scheduler reads it directly and it is saved with the graph:
+    - forward adjacency: `_children`, the set of the names of the child nodes,
+    - reverse adjacency and reference table: `_parents`, the distinct references [nodeName, outputKey] of the node in order of appearance.
+    Every operation costs O(degree) of the nodes involved, traversals cost O(visited nodes + edges).
+    """
+    def __init__(self, nodePool):
+        self.nodePool = nodePool # Dictionary of all nodes of the graph, shared with the Graph
+
+    def parent_names(self, nodeName):
+        """
+        Names of the parent nodes of a node.
+        """
+        return {parent[0] for parent in self.nodePool[nodeName]._parents}
+
+    def detach(self, nodeName):
+        """
+        Remove the edges from the parent nodes to a node, before its references are resolved again.
+        """
+        for parent_name in self.parent_names(nodeName):
+            parent_node = self.nodePool.get(parent_name)
+            if parent_node is not None:
+                parent_node._children.discard(nodeName)
+
+    def remove(self, nodeName):
+        """
+        Remove all the edges of a node: it is detached from its parents and its children drop their references to it.
+        Output:
+            Set of the names of the former child nodes
+        """
+        node = self.nodePool[nodeName]
+        self.detach(nodeName)
+        children = node._children
+        for child in children:
+            child_node = self.nodePool.get(child)
+            if child_node is not None:
+                child_node._parents = [parent for parent in child_node._parents if parent[0] != nodeName]
+        node._children = set()
+        return children
+
+    def rebuild(self):
+        """
+        Rebuild the child sets of all nodes from their references, e.g. after loading a graph.
+        """
+        for node in self.nodePool.values():
+            node._children = set()
+        for nodeName, node in self.nodePool.items():
+            for parent_name in self.parent_names(nodeName):
+                if parent_name in self.nodePool:
+                    self.nodePool[parent_name]._children.add(nodeName)
+
+    def descendants(self, start_node):
+        """
+        Breadth-first traversal from a node.
+        Output:
+            Set of the names of the node and of all the nodes depending on it
+        """
+        visited = {start_node}
+        queue = deque([start_node])
+        while queue:
+            for child in self.nodePool[queue.popleft()]._children:
+                if child not in visited:
+                    visited.add(child)
+                    queue.append(child)
+        return visited
+
+    def find_cycle(self, nodeNames):
+        """
+        Iterative depth-first search for a cycle reachable from the given nodes, so deep graphs do not hit the recursion limit.
+        Output:
+            Name of a node on a cycle, or None if there is no cycle
+        """
+        state = {} # Dict[str, bool]: True while the node is on the current path, False once fully explored
+        for root in nodeNames:
+            if root in state:
+                continue
+            state[root] = True
+            stack = [(root, iter(self.nodePool[root]._children))]
+            while stack:
+                name, children = stack[-1]
+                for child in children:
+                    on_path = state.get(child)
+                    if on_path:
+                        return child
+                    if on_path is None:
+                        state[child] = True
+                        stack.append((child, iter(self.nodePool[child]._children)))
+                        break
+                else:
+                    state[name] = False
+                    stack.pop()
+        return None
@@ -1,12 +1,81 @@
 from .logger import LOGGER
 from .pyenv_manager import PythonEnvironmentManager
+from .python_worker_pool import function_hash
+from .llm_cache import LLMResponseCache, get_llm_cache
+import copy
 import hashlib
+import json
+import os
 import re
+import asyncio
+import threading
+from collections import OrderedDict
 
 from ..llms.gemini import GeminiJsonEngine, GeminiSimpleChatEngine
 from ..llms.openai import LangchainOpenaiJsonEngine, LangchainOpenaiSimpleChatEngine
 
 
+# References to the outputs of other nodes, in the format @[nodeName.outputKey]
+REFERENCE_PATTERN = re.compile(r'@\[(\w+)\.(\w+)\]')
+
+# Hashes of the function bodies which already passed the syntax check, shared by all nodes of all graphs
+_CHECKED_FUNCTION_HASHES = set()
+
+# LLM engines shared by all nodes of all graphs, keyed by their class and constructor arguments, least recently used first
+_SHARED_ENGINES = OrderedDict()
+_SHARED_ENGINE_LOCKS = {}
+_SHARED_ENGINES_LOCK = threading.Lock()
+
+
+def parse_reference_template(text):
+    """
+    Split a string into a template of segments: literal strings and references (nodeName, outputKey, reference).
+    Input:
+        text: "Summarize @[node1.output1] in French"
+    Output:
+        ("Summarize ", ("node1", "output1", "@[node1.output1]"), " in French")
+    """
+    segments = []
+    position = 0
+    for match in REFERENCE_PATTERN.finditer(text):
+        if match.start() > position:
+            segments.append(text[position:match.start()])
+        segments.append((match.group(1), match.group(2), match.group(0)))
+        position = match.end()
+    if position < len(text):
+        segments.append(text[position:])
+    return tuple(segments)
+
+
+def get_shared_engine(engine_class, **engine_kwargs):
+    """
+    Return the engine of this class and configuration, constructing it on first use.
+    Concurrent first uses of the same configuration construct a single engine.
+    At most MAX_SHARED_ENGINES (default 64) engines are kept, the least recently used ones are dropped first.
+    """
+    key = (engine_class.__name__, json.dumps(engine_kwargs, sort_keys=True, default=str))
+    with _SHARED_ENGINES_LOCK:
+        engine = _SHARED_ENGINES.get(key)
+        if engine is not None:
+            _SHARED_ENGINES.move_to_end(key)
+            return engine
+        key_lock = _SHARED_ENGINE_LOCKS.setdefault(key, threading.Lock())
+
+    with key_lock:
+        with _SHARED_ENGINES_LOCK:
+            engine = _SHARED_ENGINES.get(key)
+        if engine is None:
+            LOGGER.info(f"Constructing {engine_class.__name__} for model {engine_kwargs.get('model_name')}. Location: get_shared_engine")
+            engine = engine_class(**engine_kwargs)
+            with _SHARED_ENGINES_LOCK:
+                _SHARED_ENGINES[key] = engine
+                max_engines = int(os.environ.get("MAX_SHARED_ENGINES", "64"))
+                while len(_SHARED_ENGINES) > max_engines:
+                    evicted_key, _ = _SHARED_ENGINES.popitem(last=False)
+                    _SHARED_ENGINE_LOCKS.pop(evicted_key, None)
+    return engine
+
+
 class GraphNode:
     def __init__(self, nodeName, systemInstructions, userPrompt, pythonCode, outputSchema, useLLM, jsonMode, toolName, toolDescription, **kwargs):
         
@@ -29,10 +98,14 @@ class GraphNode:
 
         self._compiled = False # bool: Flag to indicate if the node has been compiled
         self._parents = [] # List: Parent nodes
-        self._children = [] # List: Child nodes
+        self._children = set() # Set: Names of the child nodes ( Maintained by the GraphIndex of the graph )
 
         self._inputs = {} # It is a mutable mapping of input names to their values where the keys are the output keys of the parent nodes' outputs
         self._outputs = {} # It is a mutable mapping of output names to their values where the keys are the output keys of the current node's outputs
+        self._fingerprint = None # str: Fingerprint of the definition and resolved inputs of the last successful execution
+        self._partial_output = "" # str: Text generated so far by a streaming LLM node while it is running ( Not persisted )
+        self._partial_listener = None # Optional callable receiving every streamed piece of text, set by the scheduler
+        self._templates = None # Dict: the prompts, function body and arguments parsed into segments ( Resolved at compile time, see parse_reference_template )
 
         self.status = "pending" # str: Status of the node, can be "pending", "running" or "completed" or "waiting" or "error"
 
@@ -42,7 +115,7 @@ class GraphNode:
             self._outputs = {**outputSchema} # It seems weird. But we set the output values to the description of the output schema
             self.status = "completed"
 
-        self.engine = None # LLM Engine object: The LLM engine to be used for generating output ( Resolved while compiling the graph )
+        self.engine = None # LLM Engine object: The LLM engine to be used for generating output ( Resolved lazily on first execution )
 
     
     def _validate(self):
@@ -151,81 +224,193 @@ class GraphNode:
                 raise ValueError(f"Output key '{key}' has incorrect type. Expected {type(value)}, got {type(result[key])}.")
         return True
 
+    def engine_spec(self):
+        """
+        Validate the LLM configuration of the node and describe the engine it needs, without constructing it.
+        Output:
+            (engine_class, engine_kwargs) or None if the node does not use an LLM or its model is not supported
+        Raises ValueError if the configuration is invalid.
+        """
+        if not self.useLLM:
+            return None
+        if not (self.systemInstructions is not None and self.userPrompt is not None and self.systemInstructions != "" and self.userPrompt != ""):
+            raise ValueError("systemInstructions and userPrompt must be provided for LLM mode.")
+
+        model_name = self.kwargs.get("model_name", "gemini-2.0-flash-001")
+        temperature = self.kwargs.get("temperature", 0.5)
+        max_output_tokens = self.kwargs.get("max_tokens", 1000)
+        max_retries = self.kwargs.get("max_retries", 5)
+        wait_time = self.kwargs.get("wait_time", 30)
+        deployed_gcp = self.kwargs.get("deployed_gcp", False)
+
+        if len(self.outputSchema.keys()) == 0:
+            raise ValueError("outputSchema must have at least one key for LLM mode.")
+
+        if self.jsonMode:
+            if self.toolName is None or self.toolDescription is None:
+                raise ValueError("toolName and toolDescription must be provided for JSON mode.")
+            basemodel = {
+                "tool_name": self.toolName,
+                "description" : self.toolDescription,
+                "output_schema": {
+                    **self.outputSchema
+                }
+            }
+            if "gemini" in model_name:
+                return GeminiJsonEngine, {
+                    "model_name": model_name,
+                    "basemodel": basemodel,
+                    "temperature": temperature,
+                    "max_output_tokens": max_output_tokens,
+                    "systemInstructions": self.systemInstructions,
+                    "max_retries": max_retries,
+                    "wait_time": wait_time,
+                    "deployed_gcp": deployed_gcp
+                }
+            elif "gpt" in model_name:
+                return LangchainOpenaiJsonEngine, {
+                    "model_name": model_name,
+                    "sampleBaseModel": basemodel,
+                    "temperature": temperature,
+                    "systemPromptText": self.systemInstructions
+                }
+        else:
+            if len(self.outputSchema.keys()) > 1:
+                raise ValueError("outputSchema must have only one key for Non JSON LLM mode.")
+
+            if "gemini" in model_name:
+                return GeminiSimpleChatEngine, {
+                    "model_name": model_name,
+                    "temperature": temperature,
+                    "max_output_tokens": max_output_tokens,
+                    "systemInstructions": self.systemInstructions,
+                    "max_retries": max_retries,
+                    "wait_time": wait_time,
+                    "deployed_gcp": deployed_gcp
+                }
+            elif "gpt" in model_name:
+                return LangchainOpenaiSimpleChatEngine, {
+                    "model_name": model_name,
+                    "temperature": temperature,
+                    "systemPromptText": self.systemInstructions
+                }
+        return None
+
     def resolve_engine(self):
-        if self.useLLM:
-            if self.systemInstructions is not None and self.userPrompt is not None and self.systemInstructions != "" and self.userPrompt != "":
-                
-                model_name = self.kwargs.get("model_name", "gemini-2.0-flash-001")
-                temperature = self.kwargs.get("temperature", 0.5)
-                max_output_tokens = self.kwargs.get("max_tokens", 1000)
-                max_retries = self.kwargs.get("max_retries", 5)
-                wait_time = self.kwargs.get("wait_time", 30)
-                deployed_gcp = self.kwargs.get("deployed_gcp", False)
-
-                if len(self.outputSchema.keys()) == 0:
-                    raise ValueError("outputSchema must have at least one key for LLM mode.")
-
-                if self.jsonMode:
-                    if self.toolName is not None and self.toolDescription is not None:
-                        basemodel = {
-                            "tool_name": self.toolName,
-                            "description" : self.toolDescription,
-                            "output_schema": {
-                                **self.outputSchema
-                            }
-                        }
-                        if "gemini" in model_name:
-                            self.engine = GeminiJsonEngine(
-                                model_name=model_name,
-                                basemodel=basemodel,
-                                temperature=temperature,
-                                max_output_tokens=max_output_tokens,
-                                systemInstructions=self.systemInstructions,
-                                max_retries=max_retries,
-                                wait_time=wait_time,
-                                deployed_gcp=deployed_gcp
-                            )
-                        elif "gpt" in model_name:
-                            self.engine = LangchainOpenaiJsonEngine(
-                                model_name=model_name,
-                                sampleBaseModel=basemodel,
-                                temperature=temperature,
-                                systemPromptText=self.systemInstructions
-                            )
+        """
+        Resolve the LLM engine of the node. It is called lazily on first execution, never while compiling.
+        Engines are shared by all nodes with an identical configuration (see get_shared_engine).
+        """
+        spec = self.engine_spec()
+        if spec is None:
+            self.engine = None
+            return None
+        engine_class, engine_kwargs = spec
+        self.engine = get_shared_engine(engine_class, **engine_kwargs)
+        return self.engine
 
-                    else:
-                        raise ValueError("toolName and toolDescription must be provided for JSON mode.")
-                else:
-                    if len(self.outputSchema.keys()) > 1:
-                        raise ValueError("outputSchema must have only one key for Non JSON LLM mode.")
-                        
-                    if "gemini" in model_name:
-                        self.engine = GeminiSimpleChatEngine(
-                            model_name=model_name,
-                            temperature=temperature,
-                            max_output_tokens=max_output_tokens,
-                            systemInstructions=self.systemInstructions,
-                            max_retries=max_retries,
-                            wait_time=wait_time,
-                            deployed_gcp=deployed_gcp
-                        )
-                    elif "gpt" in model_name:
-                        self.engine = LangchainOpenaiSimpleChatEngine(
-                            model_name=model_name,
-                            temperature=temperature,
-                            systemPromptText=self.systemInstructions
-                        )
-            else:
-                raise ValueError("systemInstructions and userPrompt must be provided for LLM mode.")
+    def validate_definition(self):
+        """
+        Validate the definition of the node on its own: its LLM configuration and the syntax of its Python code.
+        Raises a ValueError if the definition is invalid.
+        """
+        self.engine_spec() # Validate the LLM configuration without touching the network
+        self.compile_python_code()
+
+    def compile_python_code(self):
+        """
+        Syntax-check the Python function of a non-LLM node once, so a broken node fails at compile time
+        instead of in the worker. The check is cached by the content hash of the function body.
+        Function bodies containing references are only known after resolution and are checked by the worker.
+        Output:
+            The content hash of the function body, or None if there is nothing to check
+        """
+        function_body = self.pythonCode.get("function_body", "")
+        if self.useLLM or function_body == "" or "@[" in function_body:
+            return None
+
+        body_hash = function_hash(function_body)
+        if body_hash in _CHECKED_FUNCTION_HASHES:
+            return body_hash
+
+        try:
+            compile(function_body, f"<{self.nodeName}>", "exec")
+        except (SyntaxError, ValueError) as e:
+            LOGGER.error(f"Syntax error in the Python code of node {self.nodeName}: {e}. Location: GraphNode.compile_python_code")
+            raise ValueError(f"Syntax error in the Python code of node {self.nodeName}: {e}")
+
+        _CHECKED_FUNCTION_HASHES.add(body_hash)
+        return body_hash
 
     def hash(self):
         # Generate a hash for the node based on its properties
         node_string = f"{self.nodeName}{self.systemInstructions}{self.userPrompt}{self.pythonCode}{str(self.outputSchema)}{str(self.kwargs)}"
         return hashlib.sha256(node_string.encode()).hexdigest()
     
+    def clone_for_run(self):
+        """
+        Shallow copy of the node for an isolated run (see Graph.execute_batch).
+        The copy shares the definition, the parent-child relationships and the engine of the node, which are only read
+        during execution, but has its own status, inputs and outputs.
+        """
+        node = copy.copy(self)
+        node._inputs = {}
+        node._fingerprint = None
+        node._partial_output = ""
+        if self.nodeName == "inputs":
+            node._outputs = dict(self._outputs)
+            node.status = "completed"
+        else:
+            node._outputs = {}
+            node.status = "pending"
+        return node
+
+    def fingerprint(self, nodePool):
+        """
+        Fingerprint of what determines the outputs of the node: its definition and the current values of the parent
+        outputs it references. Only meaningful once all parent nodes are completed.
+        """
+        inputs = {}
+        for node_name, output_key in self._parents:
+            parent_node = nodePool.get(node_name)
+            inputs[f"@[{node_name}.{output_key}]"] = parent_node._outputs.get(output_key) if parent_node is not None else None
+        key = {
+            "id": self.hash(),
+            "mode": [self.useLLM, self.jsonMode, self.toolName, self.toolDescription],
+            "inputs": inputs
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+    def is_up_to_date(self, nodePool):
+        """
+        Check whether the outputs of the last successful execution can be reused, i.e. neither the definition of the
+        node nor its resolved inputs changed since then.
+        """
+        if self._fingerprint is None or not self._outputs or "error" in self._outputs:
+            return False
+        if not self.check_parent_status(nodePool):
+            return False
+        return self._fingerprint == self.fingerprint(nodePool)
+
+    def reference_templates(self):
+        """
+        Parse the system instructions, user prompt, function body and arguments into templates of segments, once.
+        Output:
+            {"systemInstructions": segments, "userPrompt": segments, "function_body": segments, "argument": {name: segments}}
+        """
+        if self._templates is None:
+            self._templates = {
+                "systemInstructions": parse_reference_template(self.systemInstructions),
+                "userPrompt": parse_reference_template(self.userPrompt),
+                "function_body": parse_reference_template(self.pythonCode.get("function_body", "")),
+                "argument": {key: parse_reference_template(value) for key, value in self.pythonCode.get("argument", {}).items()}
+            }
+        return self._templates
+
     def resolve_parent_nodes(self, nodePool):
         """
         Resolve the parent nodes of the current node by finding references in the system instructions, user prompt, and Python code.
+        The fields are parsed into templates once, which are rendered on every execution (see render_template).
         Input:
             nodePool: Dictionary of all nodes in the graph. This is prvided from the Graph class
         Output:
@@ -233,13 +418,12 @@ class GraphNode:
         """
 
         self._parents = []
-        pattern = r'@\[(\w+)\.(\w+)\]' # Regex pattern to match references in the format @[nodeName.outputKey]
-        
+        templates = self.reference_templates()
+
         # Creates a list of references of the form [nodeName, outputKey] from the system instructions, user prompt, and Python code
-        references = re.findall(pattern, self.systemInstructions)
-        references += re.findall(pattern, self.userPrompt)
-        references += re.findall(pattern, self.pythonCode.get("function_body", ""))
-        references += re.findall(pattern, str(self.pythonCode.get("argument", {})))
+        references = []
+        for segments in (templates["systemInstructions"], templates["userPrompt"], templates["function_body"], *templates["argument"].values()):
+            references += [segment[:2] for segment in segments if segment.__class__ is tuple]
 
         
         # Check if the references are valid i.e. if the node names and output keys exist in the node pool
@@ -248,18 +432,51 @@ class GraphNode:
         if not success_validate_references:
             return None
 
-        # Add the references to the _parents list and update the _children list of the referenced nodes
+        # Add the references to the _parents list and update the _children set of the referenced nodes
+        seen = set()
         for node_name, output_key in references:
             # Handle duplicate parent references
-            if [node_name, output_key] not in self._parents:
+            if (node_name, output_key) not in seen:
+                seen.add((node_name, output_key))
                 self._parents.append([node_name, output_key])
             # Add the current node as a child of the referenced node
-            nodePool[node_name]._children.append(self.nodeName)
-            # Remove duplicate children
-            nodePool[node_name]._children = list(set(nodePool[node_name]._children))
+            nodePool[node_name]._children.add(self.nodeName)
 
         return self._parents
-    
+
+    def render_template(self, segments, nodePool):
+        """
+        Render a template by replacing its references with the outputs of the parent nodes, in a single join.
+        A reference which cannot be resolved is kept as is. The resolved values are recorded in the inputs of the node.
+        Input:
+            segments: template returned by parse_reference_template
+            nodePool: Dictionary of all nodes in the graph
+        Output:
+            The rendered string
+        """
+        parts = []
+        for segment in segments:
+            if segment.__class__ is str:
+                parts.append(segment)
+                continue
+            node_name, output_key, reference = segment
+            parent_node = nodePool.get(node_name)
+            if parent_node is None or output_key not in parent_node.outputSchema:
+                parts.append(reference)
+                continue
+            try:
+                value = parent_node._outputs[output_key]
+                if not isinstance(value, str):
+                    raise TypeError(f"output is a {type(value).__name__}, not a string")
+            except Exception as e:
+                LOGGER.error(f"Error replacing reference @{node_name}.{output_key}: {e}. Location: GraphNode.render_template")
+                # If there's an error, keep the original string
+                parts.append(reference)
+                continue
+            self._inputs[reference] = value
+            parts.append(value)
+        return "".join(parts)
+
     def resolve_references(self, input_str, nodePool):
         """
         Resolve references in the input string by replacing them with actual values from the node pool.
@@ -276,24 +493,7 @@ class GraphNode:
 
             where value is the output of node1 with the key outputKey1
         """
-        # Replace references in the input string with actual values from the node pool
-
-        for node_name, output_key in self._parents:
-            if node_name in nodePool and output_key in nodePool[node_name].outputSchema:
-                try:
-                    # Parent key
-                    parent_key = nodePool[node_name]._outputs[output_key]
-                    # Replace the reference with the actual value from the node pool
-                    # Add the current node as a child of the referenced node
-                    if f"@[{node_name}.{output_key}]" in input_str:
-                        self._inputs[f"@[{node_name}.{output_key}]"] = parent_key
-
-                    input_str = input_str.replace(f"@[{node_name}.{output_key}]", parent_key)
-                except Exception as e:
-                    LOGGER.error(f"Error replacing reference @{node_name}.{output_key}: {e}. Location: GraphNode.resolve_references")
-                    # If there's an error, keep the original string
-
-        return input_str
+        return self.render_template(parse_reference_template(input_str), nodePool)
     
 
     def get_current_state(self, nodePool):
@@ -305,13 +505,13 @@ class GraphNode:
             Dictionary containing the current state of the node
         """
         nodeName = self.nodeName # str: Name of the node
-        systemInstructions = self.resolve_references(self.systemInstructions, nodePool) # Replace references in the system instructions
-        userPrompt = self.resolve_references(self.userPrompt, nodePool) # Replace references in the user prompt
-        pythonCode = self.resolve_references(self.pythonCode.get("function_body", ""), nodePool) # Replace references in the Python code
-        argument = self.pythonCode.get("argument", {}) # Replace references in the Python code arguments
+        templates = self.reference_templates() # Prompts and code parsed into segments at compile time
+        systemInstructions = self.render_template(templates["systemInstructions"], nodePool) # Replace references in the system instructions
+        userPrompt = self.render_template(templates["userPrompt"], nodePool) # Replace references in the user prompt
+        pythonCode = self.render_template(templates["function_body"], nodePool) # Replace references in the Python code
         args_replaced = {}
-        for key, value in argument.items():
-            args_replaced[key] = self.resolve_references(value, nodePool) # Replace references in the Python code arguments
+        for key, segments in templates["argument"].items():
+            args_replaced[key] = self.render_template(segments, nodePool) # Replace references in the Python code arguments
 
         outputs = self._outputs # Get the outputs of the node
 
@@ -356,6 +556,84 @@ class GraphNode:
                 return False
         return True
 
+    def _streams(self):
+        """
+        Whether the LLM output is streamed into _partial_output, enabled with the node keyword argument stream=True.
+        Only plain text nodes stream, JSON mode needs the complete response.
+        """
+        return bool(self.kwargs.get("stream", False)) and not self.jsonMode and hasattr(self.engine, "run_stream")
+
+    def _append_partial_output(self, text):
+        self._partial_output += text
+        if self._partial_listener is not None:
+            self._partial_listener(text)
+
+    def get_partial_output(self):
+        """
+        Text generated so far by a running streaming node, or its outputs once completed.
+        Output:
+            Dictionary with the status, the partial text and the outputs of the node
+        """
+        return {
+            "nodeName": self.nodeName,
+            "status": self.status,
+            "partial_output": self._partial_output,
+            "outputs": self._outputs if self.status == "completed" else {}
+        }
+
+    def _llm_cache_lookup(self, state):
+        """
+        Find the LLM response cache and the cache key of the request described by the current state of the node.
+        Caching is skipped when disabled globally or with the node keyword argument cache_llm_response=False.
+        With LLM_CACHE_DETERMINISTIC_ONLY=true, sampled requests (temperature > 0) are only cached when the node opts in
+        with cache_llm_response=True, so that their executions do not replay the same sample.
+        Output:
+            (cache, cache_key) or (None, None)
+        """
+        cache_llm_response = str(self.kwargs.get("cache_llm_response", "")).lower() # "true", "false" or "" when not set
+        if cache_llm_response == "false":
+            return None, None
+        cache = get_llm_cache()
+        spec = self.engine_spec()
+        if cache is None or spec is None:
+            return None, None
+        engine_class, engine_kwargs = spec
+        if os.environ.get("LLM_CACHE_DETERMINISTIC_ONLY", "false").lower() == "true" and cache_llm_response != "true":
+            try:
+                sampled = float(engine_kwargs.get("temperature") or 0) > 0
+            except (TypeError, ValueError):
+                sampled = True
+            if sampled:
+                return None, None
+        return cache, LLMResponseCache.make_key(engine_class.__name__, engine_kwargs, state["systemInstructions"], state["userPrompt"])
+
+    def _parse_engine_result(self, engine_result):
+        """
+        Convert the raw result of an LLM engine into a dictionary keyed by the output schema.
+        Input:
+            engine_result: List[Dict] in JSON mode, str otherwise
+        Output:
+            Dictionary of output key to value
+        """
+        result = {}
+        if self.jsonMode:
+            # Parse the JSON output
+            try:
+                # In case of JSON mode, the output is expected to be a list of dictionaries
+                result = engine_result[0]
+            except Exception as e:
+                LOGGER.error(f"Error parsing JSON output: {e}. Location: GraphNode._parse_engine_result")
+                raise ValueError(f"Error parsing JSON output: {e}")
+        else:
+            # Parse the output for non-JSON mode
+            try:
+                # In case of non-JSON mode, the output is expected to be a string and outputSchema is a dictionary with only one key
+                result = {output_key: engine_result for output_key in self.outputSchema.keys()}
+            except Exception as e:
+                LOGGER.error(f"Error parsing output: {e}. Location: GraphNode._parse_engine_result")
+                raise ValueError(f"Error parsing output: {e}")
+        return result
+
     def execute(self, nodePool, python_env_manager: PythonEnvironmentManager):
         """
         Execute the node by running the Python code or generating output based on the system instructions and user prompt using LLM.
@@ -373,6 +651,9 @@ class GraphNode:
         
         # Set the status to running
         self.status = "running"
+        fingerprint = self.fingerprint(nodePool) # Fingerprint of the inputs this execution uses
+        self._fingerprint = None # Only a successful execution records its fingerprint
+        self._partial_output = ""
 
         try:
             # Get the current state of the node
@@ -393,50 +674,136 @@ class GraphNode:
                     # Store the result in _outputs
                     self._outputs = result
             else:
-                if self.engine is None:
-                    self.resolve_engine()
-                
-                # Generate output using LLM
-                engine_result = self.engine.run([
-                    userPrompt
-                ])
+                # Reuse the response of an identical request if it is cached
+                cache, cache_key = self._llm_cache_lookup(state)
+                engine_result = cache.get(cache_key) if cache_key is not None else None
+                cached = engine_result is not None
+
+                if not cached:
+                    if self.engine is None:
+                        self.resolve_engine()
+
+                    # Generate output using LLM
+                    if self._streams():
+                        engine_result = self.engine.run_stream([
+                            userPrompt
+                        ], on_chunk=self._append_partial_output)
+                    else:
+                        engine_result = self.engine.run([
+                            userPrompt
+                        ])
                 
-                result = {}
-                if self.jsonMode:
-                    # Parse the JSON output
-                    try:
-                        # In case of JSON mode, the output is expected to be a list of dictionaries
-                        result = engine_result[0]
-                    except Exception as e:
-                        LOGGER.error(f"Error parsing JSON output: {e}. Location: GraphNode.execute")
-                        raise ValueError(f"Error parsing JSON output: {e}")
-                else:
-                    # Parse the output for non-JSON mode
-                    try:
-                        # In case of non-JSON mode, the output is expected to be a string and outputSchema is a dictionary with only one key
-                        result = {output_key: engine_result for output_key in self.outputSchema.keys()}
-                    except Exception as e:
-                        LOGGER.error(f"Error parsing output: {e}. Location: GraphNode.execute")
-                        raise ValueError(f"Error parsing output: {e}")
+                result = self._parse_engine_result(engine_result)
                 
                 # Check if the result matches the output schema
                 if not self._validate_output(result):
                     LOGGER.error(f"Output does not match the schema for {self.nodeName}. Location: GraphNode.execute")
                     return None
+
+                if cache_key is not None and not cached:
+                    cache.put(cache_key, engine_result)
                 
                 # Store the result in _outputs
                 self._outputs = result
                 
             # Set the status to completed
             self.status = "completed"
+            self._fingerprint = fingerprint
+            self._partial_output = "" # The complete text is in _outputs now
 
         except Exception as e:
             LOGGER.critical(f"Error executing node {self.nodeName}: {e}. Location: GraphNode.execute")
             self.status = "error"
+            self._fingerprint = None
             self._outputs = {"error": f"Error executing node {self.nodeName}: {e}. Location: GraphNode.execute"}
 
         return self._outputs
 
+    async def aexecute(self, nodePool, python_env_manager: PythonEnvironmentManager):
+        """
+        Async variant of execute. LLM calls are awaited on the event loop through the engine's `arun`.
+        Python code still runs in a subprocess, it is awaited from a worker thread so the event loop is never blocked.
+        """
+
+        # Check if the node is already completed
+        if self.status == "completed":
+            LOGGER.warning(f"Node {self.nodeName} is already completed. Location: GraphNode.aexecute")
+            return self._outputs
+        
+        # Check if parent nodes are completed
+        if not self.check_parent_status(nodePool):
+            LOGGER.warning(f"Parent nodes are not completed for {self.nodeName}. Location: GraphNode.aexecute")
+            return None
+        
+        # Set the status to running
+        self.status = "running"
+        fingerprint = self.fingerprint(nodePool) # Fingerprint of the inputs this execution uses
+        self._fingerprint = None # Only a successful execution records its fingerprint
+        self._partial_output = ""
+
+        try:
+            # Get the current state of the node
+            state = self.get_current_state(nodePool)
+            userPrompt = state["userPrompt"]
+            pythonFunctionBody = state["pythonCode"]["function_body"]
+            pythonCodeArgument = state["pythonCode"]["argument"]
+
+            # Check if the Python code is provided
+            if self.useLLM is False:
+                if pythonFunctionBody != "" and python_env_manager is not None:
+                    result = await asyncio.to_thread(python_env_manager.execute_python_code, pythonFunctionBody, pythonCodeArgument)
+                    # Check if the result matches the output schema
+                    if not self._validate_output(result):
+                        LOGGER.error(f"Output does not match the schema for {self.nodeName}. Location: GraphNode.aexecute")
+                        return None
+                    # Store the result in _outputs
+                    self._outputs = result
+            else:
+                # Reuse the response of an identical request if it is cached
+                cache, cache_key = self._llm_cache_lookup(state)
+                engine_result = cache.get(cache_key) if cache_key is not None else None
+                cached = engine_result is not None
+
+                if not cached:
+                    if self.engine is None:
+                        await asyncio.to_thread(self.resolve_engine) # May fetch an access token over the network
+
+                    # Generate output using LLM
+                    if self._streams():
+                        # The streaming engines are synchronous, the stream is consumed on a worker thread
+                        engine_result = await asyncio.to_thread(self.engine.run_stream, [
+                            userPrompt
+                        ], on_chunk=self._append_partial_output)
+                    else:
+                        engine_result = await self.engine.arun([
+                            userPrompt
+                        ])
+                result = self._parse_engine_result(engine_result)
+                
+                # Check if the result matches the output schema
+                if not self._validate_output(result):
+                    LOGGER.error(f"Output does not match the schema for {self.nodeName}. Location: GraphNode.aexecute")
+                    return None
+
+                if cache_key is not None and not cached:
+                    cache.put(cache_key, engine_result)
+                
+                # Store the result in _outputs
+                self._outputs = result
+                
+            # Set the status to completed
+            self.status = "completed"
+            self._fingerprint = fingerprint
+            self._partial_output = "" # The complete text is in _outputs now
+
+        except Exception as e:
+            LOGGER.critical(f"Error executing node {self.nodeName}: {e}. Location: GraphNode.aexecute")
+            self.status = "error"
+            self._fingerprint = None
+            self._outputs = {"error": f"Error executing node {self.nodeName}: {e}. Location: GraphNode.aexecute"}
+
+        return self._outputs
+
     def to_dict(self):
         # Convert the node to a dictionary representation
         key_value_pairs = {
@@ -453,9 +820,10 @@ class GraphNode:
             "id": self.id,
             "_compiled": self._compiled,
             "_parents": self._parents,
-            "_children": self._children,
+            "_children": sorted(self._children), # Stable order in the saved graph
             "_inputs": self._inputs,
             "_outputs": self._outputs,
+            "_fingerprint": self._fingerprint,
             "status": self.status
         }
 
@@ -0,0 +1,187 @@
+from .logger import LOGGER
+import atexit
+import os
+import threading
+import time
+import weakref
+
+
+# Write errors which a retry cannot fix, e.g. the directory of a deleted session or a missing setting
+PERMANENT_WRITE_ERRORS = (ValueError, FileNotFoundError, NotADirectoryError, PermissionError)
+
+
+class GraphPersister:
+    """
+    Write-behind persistence of graphs.
+    Graph.save_graph only marks the graph dirty, a background thread writes it once no change happened for
+    `idle_delay` seconds, or at the latest `max_delay` seconds after its first unsaved change. Repeated saves of the same
+    graph are coalesced into a single write of its latest state, so the request latency no longer depends on the size
+    of the graph times the number of saves.
+    Writes of a graph are serialized and always write its latest state, so an older state never overwrites a newer one.
+    Pending writes are flushed synchronously on request (flush), on eviction of a session and at interpreter exit.
+    A failed write is retried every `max_delay` seconds unless its error is permanent (PERMANENT_WRITE_ERRORS), and
+    the graphs of deleted sessions are never written again.
+    """
+    def __init__(self, idle_delay=0.5, max_delay=5.0):
+        self.idle_delay = idle_delay # Seconds without change after which a dirty graph is written
+        self.max_delay = max_delay # Maximum seconds a change stays unsaved while the graph keeps changing
+        self.pending = {} # Dict[Graph, Dict]: dirty graphs with their first and last change times and generation
+        self.write_locks = weakref.WeakKeyDictionary() # Dict[Graph, threading.Lock]: serializes the writes of a graph
+        self.deleted = weakref.WeakSet() # Graphs of deleted sessions, their saves are ignored
+        self.condition = threading.Condition() # Guards the dictionaries above and wakes the writer thread
+        self.stats = {"scheduled": 0, "writes": 0, "errors": 0}
+        self.writer = threading.Thread(target=self._run, name="graph-persister", daemon=True)
+        self.writer.start()
+
+    def schedule(self, graph):
+        """
+        Mark a graph dirty, it is written by the background thread.
+        """
+        now = time.monotonic()
+        with self.condition:
+            if graph in self.deleted:
+                return
+            entry = self.pending.get(graph)
+            if entry is None:
+                self.pending[graph] = self._new_entry(now)
+            else:
+                entry["last_change"] = now
+                entry["generation"] += 1
+            self.stats["scheduled"] += 1
+            self.condition.notify()
+
+    def cancel(self, graph):
+        """
+        Drop the pending write of a graph whose session is deleted and ignore its later saves, e.g. by a run still in
+        progress. A write in progress is waited for.
+        """
+        with self.condition:
+            self.deleted.add(graph)
+            self.pending.pop(graph, None)
+        with self._write_lock(graph):
+            pass
+
+    def flush(self, graph=None):
+        """
+        Synchronously write the pending state of a graph, or of all dirty graphs when graph is None.
+        """
+        with self.condition:
+            if graph is None:
+                graphs = list(self.pending)
+            else:
+                graphs = [graph] if graph in self.pending else []
+        for dirty_graph in graphs:
+            self._write(dirty_graph, raise_errors=graph is not None)
+
+    def write(self, graph):
+        """
+        Synchronously write a graph, superseding its pending write.
+        """
+        with self.condition:
+            if graph in self.deleted:
+                return
+            entry = self.pending.setdefault(graph, self._new_entry(time.monotonic()))
+            entry["generation"] += 1
+        self._write(graph, raise_errors=True)
+
+    @staticmethod
+    def _new_entry(now):
+        return {"first_change": now, "last_change": now, "generation": 1, "retry_at": 0.0}
+
+    def _write_lock(self, graph):
+        with self.condition:
+            if graph not in self.write_locks:
+                self.write_locks[graph] = threading.Lock()
+            return self.write_locks[graph]
+
+    def _write(self, graph, raise_errors=False):
+        """
+        Write the latest state of a dirty graph.
+        Output:
+            False if the write failed, True otherwise
+        """
+        with self._write_lock(graph):
+            with self.condition:
+                entry = self.pending.get(graph)
+                if entry is None:
+                    return True # Written by a concurrent flush or cancelled meanwhile
+                generation = entry["generation"]
+            try:
+                graph.write_graph()
+            except Exception as e:
+                with self.condition:
+                    self.stats["errors"] += 1
+                    if isinstance(e, PERMANENT_WRITE_ERRORS):
+                        # Retrying cannot succeed, the graph is written again on its next change
+                        self.pending.pop(graph, None)
+                LOGGER.error(f"Error writing graph {graph.save_dir}: {e}. Location: GraphPersister._write")
+                if raise_errors:
+                    raise
+                return False
+            with self.condition:
+                self.stats["writes"] += 1
+                entry = self.pending.get(graph)
+                if entry is not None and entry["generation"] == generation:
+                    # Nothing changed while writing, otherwise the graph stays dirty for the next write
+                    del self.pending[graph]
+            return True
+
+    def _due_graphs(self, now):
+        """
+        Dirty graphs to write now and the seconds until the next one is due. Must be called with the condition held.
+        """
+        due, next_due = [], None
+        for graph, entry in self.pending.items():
+            due_at = max(min(entry["last_change"] + self.idle_delay, entry["first_change"] + self.max_delay), entry["retry_at"])
+            if due_at <= now:
+                due.append(graph)
+            elif next_due is None or due_at - now < next_due:
+                next_due = due_at - now
+        return due, next_due
+
+    def _run(self):
+        while True:
+            with self.condition:
+                due, next_due = self._due_graphs(time.monotonic())
+                while not due:
+                    self.condition.wait(next_due)
+                    due, next_due = self._due_graphs(time.monotonic())
+            for graph in due:
+                try:
+                    written = self._write(graph)
+                except Exception as e:
+                    LOGGER.error(f"Unexpected error in the graph writer: {e}. Location: GraphPersister._run")
+                    written = False
+                if not written:
+                    with self.condition:
+                        entry = self.pending.get(graph)
+                        if entry is not None:
+                            # A failed write is retried later instead of in a tight loop
+                            entry["retry_at"] = time.monotonic() + self.max_delay
+
+    def get_stats(self):
+        with self.condition:
+            return {**self.stats, "pending": len(self.pending)}
+
+
+_GRAPH_PERSISTER = None
+_GRAPH_PERSISTER_LOCK = threading.Lock()
+
+
+def get_graph_persister():
+    """
+    Return the process-wide GraphPersister configured with the GRAPH_SAVE_IDLE_DELAY and GRAPH_SAVE_MAX_DELAY
+    environment variables, or None if GRAPH_WRITE_BEHIND is false (graphs are then written synchronously).
+    Pending writes are flushed at interpreter exit.
+    """
+    global _GRAPH_PERSISTER
+    if os.environ.get("GRAPH_WRITE_BEHIND", "true").lower() != "true":
+        return None
+    with _GRAPH_PERSISTER_LOCK:
+        if _GRAPH_PERSISTER is None:
+            _GRAPH_PERSISTER = GraphPersister(
+                idle_delay=float(os.environ.get("GRAPH_SAVE_IDLE_DELAY", "0.5")),
+                max_delay=float(os.environ.get("GRAPH_SAVE_MAX_DELAY", "5"))
+            )
+            atexit.register(_GRAPH_PERSISTER.flush)
+        return _GRAPH_PERSISTER
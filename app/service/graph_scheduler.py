@@ -0,0 +1,375 @@
+from .logger import LOGGER
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from collections import deque
+import asyncio
+import os
+import threading
+import time
+
+
+class NodeSlots:
+    """
+    Counting semaphore shared by the worker threads and the event loops executing nodes.
+    Waiters are served in arrival order: a thread blocks on an event and a task awaits a future, both are handed the
+    slot by release, so neither polls and tasks are not starved by threads.
+    """
+    def __init__(self, value):
+        self.value = value # Number of free slots
+        self.waiters = deque() # threading.Event of a waiting thread or (loop, future) of a waiting task
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.value > 0 and not self.waiters:
+                self.value -= 1
+                return
+            event = threading.Event()
+            self.waiters.append(event)
+        event.wait()
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self.value > 0 and not self.waiters:
+                self.value -= 1
+                return
+            future = loop.create_future()
+            self.waiters.append((loop, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self.lock:
+                waiting = (loop, future) in self.waiters
+                if waiting:
+                    self.waiters.remove((loop, future))
+            if not waiting and future.done() and not future.cancelled():
+                self.release() # The slot was handed over just before the cancellation
+            raise
+
+    def _hand_over(self, future):
+        if future.cancelled():
+            self.release() # The task was cancelled before receiving the slot
+        else:
+            future.set_result(None)
+
+    def release(self):
+        with self.lock:
+            while self.waiters:
+                waiter = self.waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                loop, future = waiter
+                try:
+                    loop.call_soon_threadsafe(self._hand_over, future)
+                    return
+                except RuntimeError:
+                    continue # The loop of the task is closed
+            self.value += 1
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+# Process-wide cap on the number of nodes executing at the same time across every graph and session.
+# Each graph additionally bounds its own fan-out with `max_parallel_nodes`.
+MAX_PARALLEL_NODES_PER_PROCESS = int(os.environ.get("MAX_PARALLEL_NODES_PER_PROCESS", "32"))
+PROCESS_NODE_SEMAPHORE = NodeSlots(MAX_PARALLEL_NODES_PER_PROCESS)
+
+
+class GraphScheduler:
+    """
+    Executes a set of nodes of a graph on a bounded pool of worker threads using Kahn's algorithm.
+    The indegree of every node (number of its parent nodes still to be executed) is precomputed once from `_parents`.
+    When a node completes, the indegree of each of its children is decremented and the children reaching zero
+    are pushed onto the ready queue and handed to the pool. No thread ever waits or polls on the parent status.
+    Independent nodes run truly in parallel, bounded by `max_parallel_nodes` for the graph and by
+    PROCESS_NODE_SEMAPHORE for the whole process.
+    The lock only guards the shared bookkeeping (involved nodes and indegrees), never the node execution itself.
+    `arun` is the asyncio counterpart: the same ready queue drives tasks on a single event loop instead of threads.
+    In incremental mode a ready node whose definition and resolved inputs match its last successful execution is
+    completed with its previous outputs right away, only the dirty frontier is handed to the pool.
+    `on_event` receives a small dictionary per node transition (node_started, node_partial, node_completed, node_error)
+    carrying only the node concerned, e.g. to stream the progress of a run to a client.
+    Once `cancel_event` is set no further node is started, the running nodes finish and the others stay pending.
+    The same happens `timeout` seconds after the start of a run: the nodes still waiting for their parents are not started.
+    """
+    def __init__(self, nodePool, python_env_manager, max_parallel_nodes=4, on_event=None, cancel_event=None, timeout=None):
+        self.nodePool = nodePool # Dictionary of all nodes in the graph
+        self.python_env_manager = python_env_manager # Python environment manager used by the Python nodes
+        self.max_parallel_nodes = max(1, int(max_parallel_nodes)) # Maximum number of nodes of this graph running at once
+        self.on_event = on_event # Optional callable receiving the execution events
+        self.cancel_event = cancel_event # Optional threading.Event requesting the run to stop
+        self.timeout = timeout # Optional seconds after which a run starts no further node
+        self.lock = threading.Lock() # Lock for the shared scheduler state
+
+    def _emit(self, event, node, **fields):
+        """
+        Send an execution event to on_event. A failing listener never interrupts the execution.
+        """
+        if self.on_event is None:
+            return
+        try:
+            self.on_event({"event": event, "node": node.nodeName, **fields})
+        except Exception as e:
+            LOGGER.error(f"Error in execution event listener: {e}. Location: GraphScheduler._emit")
+
+    def _emit_result(self, node, **fields):
+        if node.status == "completed":
+            self._emit("node_completed", node, status=node.status, outputs=node._outputs, **fields)
+        else:
+            self._emit("node_error", node, status=node.status, outputs=node._outputs, **fields)
+
+    def _fail_node(self, node, error):
+        """
+        Mark a node whose execution raised as failed and emit its node_error event.
+        """
+        node.status = "error"
+        node._outputs = {"error": f"Error executing node {node.nodeName}: {error}"}
+        self._emit_result(node)
+
+    def _partial_listener(self, node):
+        if self.on_event is None:
+            return None
+        return lambda text: self._emit("node_partial", node, text=text)
+
+    def _execute_node(self, node, involved_nodes):
+        """
+        Execute a single node on a worker thread.
+        node: GraphNode object representing the node to be executed.
+        involved_nodes: set, set of nodes involved in the execution
+        """
+        with self.lock:
+            involved_nodes.add(node.nodeName)
+
+        with PROCESS_NODE_SEMAPHORE:
+            LOGGER.info(f"Running node: {node.nodeName}. Location: GraphScheduler._execute_node")
+            self._emit("node_started", node)
+            node._partial_listener = self._partial_listener(node)
+            try:
+                result = node.execute(self.nodePool, self.python_env_manager) # Execute the node
+            except Exception as e:
+                self._fail_node(node, e)
+                raise
+            finally:
+                node._partial_listener = None
+            LOGGER.info(f"Completed node: {node.nodeName} with result: {result} . Location: GraphScheduler._execute_node")
+        self._emit_result(node)
+        return node.nodeName
+
+    async def _aexecute_node(self, node, involved_nodes, semaphore):
+        """
+        Execute a single node as a task on the event loop.
+        node: GraphNode object representing the node to be executed.
+        involved_nodes: set, set of nodes involved in the execution
+        semaphore: asyncio.Semaphore bounding the number of nodes of this graph running at once
+        """
+        involved_nodes.add(node.nodeName)
+
+        async with semaphore:
+            await PROCESS_NODE_SEMAPHORE.aacquire() # The process-wide cap is shared with the threads
+            try:
+                LOGGER.info(f"Running node: {node.nodeName}. Location: GraphScheduler._aexecute_node")
+                self._emit("node_started", node)
+                node._partial_listener = self._partial_listener(node)
+                try:
+                    result = await node.aexecute(self.nodePool, self.python_env_manager) # Execute the node
+                except Exception as e:
+                    self._fail_node(node, e)
+                    raise
+                finally:
+                    node._partial_listener = None
+                LOGGER.info(f"Completed node: {node.nodeName} with result: {result} . Location: GraphScheduler._aexecute_node")
+            finally:
+                PROCESS_NODE_SEMAPHORE.release()
+        self._emit_result(node)
+        return node.nodeName
+
+    def _compute_indegrees(self, target_nodes):
+        """
+        Compute the indegree of every pending target node.
+        The indegree counts the distinct parent nodes which are part of this run and still pending.
+        Nodes having a parent outside of this run which is not completed can never become ready and are returned as blocked.
+
+        Output:
+        indegrees: Dict[str, int]
+        blocked: set of node names which cannot be executed in this run
+        """
+        indegrees = {}
+        blocked = set()
+        for node_name in target_nodes:
+            node = self.nodePool[node_name]
+            if node.status != "pending":
+                continue
+            indegree = 0
+            for parent_name in {parent[0] for parent in node._parents}:
+                parent_node = self.nodePool.get(parent_name)
+                if parent_node is None:
+                    blocked.add(node_name)
+                elif parent_name in target_nodes and parent_node.status == "pending":
+                    indegree += 1
+                elif parent_node.status != "completed":
+                    blocked.add(node_name)
+            indegrees[node_name] = indegree
+        return indegrees, blocked
+
+    def _cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def _deadline(self):
+        return time.monotonic() + self.timeout if self.timeout else None
+
+    def _remaining(self, deadline):
+        """
+        Seconds until the deadline of the run, None if it has none or already passed (no further wake-up is needed).
+        """
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        return remaining if remaining > 0 else None
+
+    def _stopped(self, deadline):
+        """
+        Whether no further node may be started, because the run was cancelled or its deadline passed.
+        """
+        return self._cancelled() or (deadline is not None and time.monotonic() >= deadline)
+
+    def _log_unexecuted(self, indegrees, involved_nodes, skipped_nodes, deadline, location):
+        # Nodes which never became ready (a parent failed or is not completed) are left pending
+        not_executed = [node_name for node_name in indegrees if node_name not in involved_nodes and node_name not in skipped_nodes]
+        if self._cancelled():
+            LOGGER.warning(f"Run cancelled, {len(not_executed)} nodes were not executed. Location: {location}")
+        elif not_executed and self._stopped(deadline):
+            LOGGER.warning(f"Run timed out after {self.timeout} seconds, {len(not_executed)} nodes were not executed. Location: {location}")
+        else:
+            for node_name in not_executed:
+                LOGGER.warning(f"Node {node_name} was not executed as its parent nodes did not complete. Location: {location}")
+        if skipped_nodes:
+            LOGGER.info(f"Executed {len(involved_nodes)} nodes, reused the outputs of {len(skipped_nodes)} unchanged nodes. Location: {location}")
+
+    def _release_children(self, node_name, indegrees, blocked, ready_queue):
+        """
+        Decrement the indegree of the children of a completed node and queue the children reaching zero.
+        """
+        for child in self.nodePool[node_name]._children:
+            if child not in indegrees:
+                continue
+            indegrees[child] -= 1
+            if indegrees[child] == 0 and child not in blocked:
+                ready_queue.append(child)
+
+    def _reuse_outputs(self, node_name, skipped_nodes):
+        """
+        Complete an up-to-date node with the outputs of its last execution instead of executing it again.
+        """
+        node = self.nodePool[node_name]
+        node.status = "completed"
+        skipped_nodes.add(node_name)
+        LOGGER.info(f"Node {node_name} is unchanged, reusing its outputs. Location: GraphScheduler._reuse_outputs")
+        self._emit_result(node, reused=True)
+
+    def run(self, node_names, incremental=False):
+        """
+        Execute the given nodes respecting their parent-child dependencies.
+        node_names: iterable of node names to be executed. Nodes outside of this set are expected to be completed already.
+        incremental: bool, reuse the outputs of the nodes whose definition and resolved inputs did not change
+
+        Output:
+        involved_nodes: set of node names which were executed.
+        """
+        target_nodes = set(node_names)
+        involved_nodes = set() # Set to hold nodes involved in the execution
+        skipped_nodes = set() # Set to hold unchanged nodes which reused their outputs
+        indegrees, blocked = self._compute_indegrees(target_nodes)
+        ready_queue = deque(node_name for node_name, indegree in indegrees.items() if indegree == 0 and node_name not in blocked)
+        deadline = self._deadline()
+
+        with ThreadPoolExecutor(max_workers=self.max_parallel_nodes, thread_name_prefix="graph-node") as executor:
+            futures = set()
+            while ready_queue or futures:
+                if self._stopped(deadline):
+                    ready_queue.clear() # Let the running nodes finish but start no new one
+                # Hand every ready node to the pool
+                while ready_queue:
+                    node_name = ready_queue.popleft()
+                    if incremental and self.nodePool[node_name].is_up_to_date(self.nodePool):
+                        self._reuse_outputs(node_name, skipped_nodes)
+                        with self.lock:
+                            self._release_children(node_name, indegrees, blocked, ready_queue)
+                        continue
+                    futures.add(executor.submit(self._execute_node, self.nodePool[node_name], involved_nodes))
+                    LOGGER.debug(f"Node {node_name} submitted for execution. Location: GraphScheduler.run")
+                if not futures:
+                    break
+
+                done, futures = wait(futures, timeout=self._remaining(deadline), return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        node_name = future.result()
+                    except Exception as e:
+                        LOGGER.error(f"Error during execution: {e}. Location: GraphScheduler.run")
+                        continue
+                    if self.nodePool[node_name].status != "completed":
+                        LOGGER.warning(f"Node {node_name} did not complete, its descendants are skipped. Location: GraphScheduler.run")
+                        continue
+                    # Release the children whose parents are now all completed
+                    with self.lock:
+                        self._release_children(node_name, indegrees, blocked, ready_queue)
+
+        self._log_unexecuted(indegrees, involved_nodes, skipped_nodes, deadline, "GraphScheduler.run")
+
+        return involved_nodes
+
+    async def arun(self, node_names, incremental=False):
+        """
+        Async variant of run. Nodes are executed as tasks on the running event loop.
+        node_names: iterable of node names to be executed. Nodes outside of this set are expected to be completed already.
+        incremental: bool, reuse the outputs of the nodes whose definition and resolved inputs did not change
+
+        Output:
+        involved_nodes: set of node names which were executed.
+        """
+        target_nodes = set(node_names)
+        involved_nodes = set() # Set to hold nodes involved in the execution
+        skipped_nodes = set() # Set to hold unchanged nodes which reused their outputs
+        indegrees, blocked = self._compute_indegrees(target_nodes)
+        ready_queue = deque(node_name for node_name, indegree in indegrees.items() if indegree == 0 and node_name not in blocked)
+        deadline = self._deadline()
+        semaphore = asyncio.Semaphore(self.max_parallel_nodes)
+
+        tasks = set()
+        while ready_queue or tasks:
+            if self._stopped(deadline):
+                ready_queue.clear() # Let the running nodes finish but start no new one
+            # Start a task for every ready node
+            while ready_queue:
+                node_name = ready_queue.popleft()
+                if incremental and self.nodePool[node_name].is_up_to_date(self.nodePool):
+                    self._reuse_outputs(node_name, skipped_nodes)
+                    self._release_children(node_name, indegrees, blocked, ready_queue)
+                    continue
+                tasks.add(asyncio.create_task(self._aexecute_node(self.nodePool[node_name], involved_nodes, semaphore)))
+                LOGGER.debug(f"Node {node_name} submitted for execution. Location: GraphScheduler.arun")
+            if not tasks:
+                break
+
+            done, tasks = await asyncio.wait(tasks, timeout=self._remaining(deadline), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    node_name = task.result()
+                except Exception as e:
+                    LOGGER.error(f"Error during execution: {e}. Location: GraphScheduler.arun")
+                    continue
+                if self.nodePool[node_name].status != "completed":
+                    LOGGER.warning(f"Node {node_name} did not complete, its descendants are skipped. Location: GraphScheduler.arun")
+                    continue
+                # Release the children whose parents are now all completed
+                self._release_children(node_name, indegrees, blocked, ready_queue)
+
+        self._log_unexecuted(indegrees, involved_nodes, skipped_nodes, deadline, "GraphScheduler.arun")
+
+        return involved_nodes
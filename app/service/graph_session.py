@@ -1,8 +1,12 @@
 from .logger import LOGGER
 from .graph import Graph
+from .graph_persister import get_graph_persister
 import time
 import os
 import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from functools import lru_cache
 
 # Add import for GCS
@@ -14,8 +18,9 @@ class GraphSessionManager:
     It allows creating, updating, deleting, and executing graph sessions.
     Each session contains a unique graph object and metadata.
     """
-    def __init__(self, session_root_dir, timeout=10, venv_path=None, create_env=False):
+    def __init__(self, session_root_dir, timeout=10, venv_path=None, create_env=False, max_parallel_nodes=None, max_loaded_sessions=None, max_loaded_bytes=None):
         self.timeout = timeout
+        self.max_parallel_nodes = max_parallel_nodes # Maximum number of nodes executing concurrently per graph (None: MAX_PARALLEL_NODES env)
         self.venv_path = venv_path
         self.create_env = create_env
 
@@ -40,19 +45,142 @@ class GraphSessionManager:
         else:
             self.session_keys = os.listdir(session_root_dir)
         self.session_metadata = {}
+        self.lock = threading.Lock() # Lock for the session index
+        self.session_locks = {} # Dict[session_id, threading.Lock]: deduplicates concurrent first loads of a session
+
+        # Loaded graphs are kept in an LRU cache bounded by count and approximate size, idle ones are saved and unloaded
+        self.max_loaded_sessions = max_loaded_sessions if max_loaded_sessions is not None else int(os.environ.get("MAX_LOADED_SESSIONS", "50"))
+        self.max_loaded_bytes = max_loaded_bytes if max_loaded_bytes is not None else int(os.environ.get("MAX_LOADED_SESSION_BYTES", str(512 * 1024 * 1024)))
+        self.loaded_sessions = OrderedDict() # Dict[session_id, approximate size in bytes], least recently used first
+        self.cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
         
+        # Only a lightweight index is built at startup, graphs are loaded on first access (see _get_graph)
         for session_key in self.session_keys:
+            self.session_metadata[session_key] = {
+                'session_id': session_key,
+                'graph': None,
+                'created_at': time.time(),
+                'updated_at': time.time(),
+                'in_use': 0, # Number of operations (e.g. executions) currently using the graph, it is never evicted meanwhile
+            }
+        LOGGER.info(f"Indexed {len(self.session_metadata)} sessions. Location: GraphSessionManager.__init__")
+
+    def _session_lock(self, session_id):
+        with self.lock:
+            if session_id not in self.session_locks:
+                self.session_locks[session_id] = threading.Lock()
+            return self.session_locks[session_id]
+
+    def _get_graph(self, session_id, pin=False):
+        """
+        It returns the graph of a session, loading it from the session directory on first access or after an eviction.
+        Concurrent first accesses of the same session share a single load.
+        If the graph cannot be loaded a ValueError is raised, the session stays in the index and the next access retries.
+        With pin=True the session is marked in use and is not evicted until _unpin_session is called.
+        """
+        with self.lock:
+            metadata = self.session_metadata.get(session_id)
+            if metadata is None:
+                raise ValueError(f"Session with ID {session_id} does not exist.")
+            if metadata['graph'] is not None:
+                metadata['in_use'] += int(pin)
+                self.loaded_sessions.move_to_end(session_id)
+                self.cache_stats["hits"] += 1
+                return metadata['graph']
+
+        with self._session_lock(session_id):
+            with self.lock:
+                if metadata['graph'] is not None:
+                    metadata['in_use'] += int(pin)
+                    self.loaded_sessions.move_to_end(session_id)
+                    self.cache_stats["hits"] += 1
+                    return metadata['graph']
             try:
-                self.session_metadata[session_key] = {
-                    'session_id': session_key,
-                    'graph': None,
-                    'created_at': time.time(),
-                    'updated_at': time.time(),
-                }
-                self.session_metadata[session_key]['graph'] = self.load_graph_into_session(session_key)
+                graph = self.load_graph_into_session(session_id)
+                LOGGER.info(f"Session {session_id} loaded on access. Location: GraphSessionManager._get_graph")
             except Exception as e:
-                LOGGER.error(f"Error loading session {session_key}: {e}")
-                del self.session_metadata[session_key]
+                # The session stays indexed, the error may be transient (GCS, IO) and the next access retries the load
+                LOGGER.error(f"Error loading session {session_id}: {e}")
+                raise ValueError(f"Session with ID {session_id} could not be loaded: {e}")
+            with self.lock:
+                metadata['graph'] = graph
+                metadata['in_use'] += int(pin)
+                self.loaded_sessions[session_id] = graph.approximate_size()
+                self.cache_stats["misses"] += 1
+
+        self._evict_idle_sessions()
+        return graph
+
+    def _unpin_session(self, session_id):
+        """
+        Release a pin taken by _get_graph, refresh the size of the session and evict idle sessions if needed.
+        """
+        with self.lock:
+            metadata = self.session_metadata.get(session_id)
+            if metadata is None:
+                return
+            metadata['in_use'] -= 1
+            metadata['updated_at'] = time.time()
+            if metadata['graph'] is not None and session_id in self.loaded_sessions:
+                self.loaded_sessions[session_id] = metadata['graph'].approximate_size()
+        self._evict_idle_sessions()
+
+    @contextmanager
+    def _use_session(self, session_id):
+        """
+        Context manager giving the graph of a session, which is not evicted while the context is active.
+        """
+        graph = self._get_graph(session_id, pin=True)
+        try:
+            yield graph
+        finally:
+            self._unpin_session(session_id)
+
+    def _evict_idle_sessions(self):
+        """
+        Save and unload the least recently used sessions which are not in use while the cache exceeds
+        max_loaded_sessions or max_loaded_bytes. An evicted session keeps its index entry and is reloaded on next access.
+        """
+        with self.lock:
+            candidates = list(self.loaded_sessions.keys())
+
+        for session_id in candidates:
+            # The graph is unloaded and saved under the session lock, so a reload waits until it is saved
+            with self._session_lock(session_id):
+                with self.lock:
+                    if len(self.loaded_sessions) <= self.max_loaded_sessions and sum(self.loaded_sessions.values()) <= self.max_loaded_bytes:
+                        return
+                    metadata = self.session_metadata.get(session_id)
+                    if session_id not in self.loaded_sessions or (metadata is not None and metadata['in_use'] > 0):
+                        continue
+                    self.loaded_sessions.pop(session_id)
+                    graph = metadata['graph'] if metadata is not None else None
+                    if graph is None:
+                        continue
+                    metadata['graph'] = None
+                    self.cache_stats["evictions"] += 1
+                try:
+                    graph.save_graph(sync=True) # Flush the pending writes before the graph leaves memory
+                    graph.release_resources()
+                    LOGGER.info(f"Session {session_id} evicted from memory. Location: GraphSessionManager._evict_idle_sessions")
+                except Exception as e:
+                    LOGGER.error(f"Error saving evicted session {session_id}: {e}. Location: GraphSessionManager._evict_idle_sessions")
+
+    def get_cache_stats(self):
+        """
+        It returns the hit, miss and eviction counters of the session cache and its current occupancy.
+        """
+        persister = get_graph_persister()
+        with self.lock:
+            return {
+                **self.cache_stats,
+                "loaded_sessions": len(self.loaded_sessions),
+                "loaded_bytes": sum(self.loaded_sessions.values()),
+                "total_sessions": len(self.session_metadata),
+                "max_loaded_sessions": self.max_loaded_sessions,
+                "max_loaded_bytes": self.max_loaded_bytes,
+                "persister": persister.get_stats() if persister is not None else None
+            }
     
 
     def load_graph_into_session(self, session_key):
@@ -60,7 +188,7 @@ class GraphSessionManager:
         It initializes a dummy graph object and loads the graph from the session directory.
         The graph is stored as /saved_graphs/{session_key}/graph.json.
         """
-        graph = Graph(timeout=self.timeout, venv_path=None, create_env=None, python_packages=None, save_dir=f"{self.session_root_dir.rstrip('/')}/{session_key}/")
+        graph = Graph(timeout=self.timeout, venv_path=None, create_env=None, python_packages=None, save_dir=f"{self.session_root_dir.rstrip('/')}/{session_key}/", max_parallel_nodes=self.max_parallel_nodes)
         graph.load_graph()
         return graph
     
@@ -80,7 +208,7 @@ class GraphSessionManager:
             python_packages = [] # default to empty list
         
         ############# Create a new graph and save it to the session directory
-        graph = Graph(timeout=self.timeout, venv_path=venv_path, create_env=create_env, python_packages=python_packages, save_dir=f"{self.session_root_dir.rstrip('/')}/{session_id}/")
+        graph = Graph(timeout=self.timeout, venv_path=venv_path, create_env=create_env, python_packages=python_packages, save_dir=f"{self.session_root_dir.rstrip('/')}/{session_id}/", max_parallel_nodes=self.max_parallel_nodes)
         if not self.access_gcs:
             os.makedirs(os.path.join(self.session_root_dir, session_id), exist_ok=True) # create the session directory if it doesn't exist
 
@@ -92,92 +220,106 @@ class GraphSessionManager:
 
         graph.compile() # compile the graph
         
-        self.session_metadata[session_id] = {
-            'session_id': session_id,
-            'graph': graph,
-            'created_at': time.time(),
-            'updated_at': time.time(),
-        }
+        with self.lock:
+            self.session_metadata[session_id] = {
+                'session_id': session_id,
+                'graph': graph,
+                'created_at': time.time(),
+                'updated_at': time.time(),
+                'in_use': 0,
+            }
+            self.loaded_sessions[session_id] = graph.approximate_size()
+        self._evict_idle_sessions()
         return graph
     
     def add_input_to_session(self, session_id, inputFields):
         """
         It is wrapper around the addInput method of the Graph class.
         """
-        if session_id not in self.session_metadata:
-            raise ValueError(f"Session with ID {session_id} does not exist.")
-        
-        graph = self.session_metadata[session_id]['graph']
-        new_node = graph.addInput(inputFields)
-        graph.compile()
-        return new_node
+        with self._use_session(session_id) as graph:
+            new_node = graph.addInput(inputFields)
+            graph.compile()
+            return new_node
 
     def add_node_to_session(self, session_id, nodeName, systemInstructions, userPrompt, pythonCode, outputSchema ,useLLM, jsonMode, toolName, toolDescription, **kwargs):
         """
         It is wrapper around the addNode method of the Graph class.
         """
-        if session_id not in self.session_metadata:
-            raise ValueError(f"Session with ID {session_id} does not exist.")
-        
-        graph = self.session_metadata[session_id]['graph']
-        new_node = graph.addNode(nodeName, systemInstructions, userPrompt, pythonCode, outputSchema, useLLM, jsonMode, toolName, toolDescription, **kwargs)
-        # graph.compile()
-        return new_node
+        with self._use_session(session_id) as graph:
+            new_node = graph.addNode(nodeName, systemInstructions, userPrompt, pythonCode, outputSchema, useLLM, jsonMode, toolName, toolDescription, **kwargs)
+            # graph.compile()
+            return new_node
     
     def update_node_in_session(self, session_id, nodeName, systemInstructions, userPrompt, pythonCode, outputSchema, useLLM, jsonMode, toolName, toolDescription, **kwargs):
         """
         It is wrapper around the updateNode method of the Graph class.
         """
-        if session_id not in self.session_metadata:
-            raise ValueError(f"Session with ID {session_id} does not exist.")
-        
-        graph = self.session_metadata[session_id]['graph']
-        updated_node = graph.updateNode(nodeName, systemInstructions, userPrompt, pythonCode, outputSchema ,useLLM, jsonMode, toolName, toolDescription, **kwargs)
-        # graph.compile()
-        return updated_node
+        with self._use_session(session_id) as graph:
+            updated_node = graph.updateNode(nodeName, systemInstructions, userPrompt, pythonCode, outputSchema ,useLLM, jsonMode, toolName, toolDescription, **kwargs)
+            # graph.compile()
+            return updated_node
     
     def remove_node_from_session(self, session_id, nodeName):
         """
         It is wrapper around the removeNode method of the Graph class.
         """
-        if session_id not in self.session_metadata:
-            raise ValueError(f"Session with ID {session_id} does not exist.")
-        
-        graph = self.session_metadata[session_id]['graph']
-        graph.removeNode(nodeName)
-        # graph.compile()
-        return True
+        with self._use_session(session_id) as graph:
+            graph.removeNode(nodeName)
+            # graph.compile()
+            return True
     
     def compile_session(self, session_id):
         """
         It is wrapper around the compile method of the Graph class.
         """
-        if session_id not in self.session_metadata:
-            raise ValueError(f"Session with ID {session_id} does not exist.")
-        
-        graph = self.session_metadata[session_id]['graph']
-        graph.compile()
-        return graph
+        with self._use_session(session_id) as graph:
+            graph.compile()
+            return graph
     
-    def execute_session(self, session_id, start_node):
+    def execute_session(self, session_id, start_node, incremental=False, on_event=None, cancel_event=None):
         """
         It is wrapper around the execute method of the Graph class.
         """
-        if session_id not in self.session_metadata:
-            raise ValueError(f"Session with ID {session_id} does not exist.")
-        
-        graph = self.session_metadata[session_id]['graph']
-        graph.execute_from_node(start_node)
-        return graph
+        with self._use_session(session_id) as graph:
+            graph.execute_from_node(start_node, incremental=incremental, on_event=on_event, cancel_event=cancel_event)
+            return graph
+    
+    async def aexecute_session(self, session_id, start_node, incremental=False, on_event=None, cancel_event=None):
+        """
+        It is wrapper around the aexecute_from_node method of the Graph class.
+        Library entry point for callers running their own event loop, the HTTP routes use the threaded execute_session.
+        """
+        with self._use_session(session_id) as graph:
+            await graph.aexecute_from_node(start_node, incremental=incremental, on_event=on_event, cancel_event=cancel_event)
+            return graph
     
+    def execute_batch(self, session_id, rows, max_parallel_rows=None, output_nodes=None):
+        """
+        It is wrapper around the execute_batch method of the Graph class.
+        The graph is validated before the generator is returned, so an invalid batch raises a ValueError right away.
+        The session stays loaded until the last row result was consumed.
+        """
+        with self._use_session(session_id) as graph:
+            graph.validate_batch(output_nodes)
+        return self._execute_batch(session_id, rows, max_parallel_rows, output_nodes)
+
+    def _execute_batch(self, session_id, rows, max_parallel_rows, output_nodes):
+        with self._use_session(session_id) as graph:
+            yield from graph.execute_batch(rows, max_parallel_rows=max_parallel_rows, output_nodes=output_nodes)
+
+    def get_node_partial_output(self, session_id, node_name):
+        """
+        It returns the text streamed so far by a node of the session, readable while the node is running.
+        """
+        with self._use_session(session_id) as graph:
+            return graph.getNode(node_name).get_partial_output()
+
     def get_session_graph(self, session_id):
         """
         It returns the graph object of the session with the given session ID.
         """
-        if session_id not in self.session_metadata:
-            raise ValueError(f"Session with ID {session_id} does not exist.")
-        
-        return self.session_metadata[session_id]['graph']
+        with self._use_session(session_id) as graph:
+            return graph
     
     def delete_session(self, session_id):
         """
@@ -187,7 +329,16 @@ class GraphSessionManager:
         if session_id not in self.session_metadata:
             raise ValueError(f"Session with ID {session_id} does not exist.")
         
-        del self.session_metadata[session_id]
+        # A session which was never loaded is deleted without loading its graph
+        with self.lock:
+            graph = self.session_metadata.pop(session_id)['graph']
+            self.loaded_sessions.pop(session_id, None)
+        if graph is not None:
+            # A pending write would recreate the deleted session
+            persister = get_graph_persister()
+            if persister is not None:
+                persister.cancel(graph)
+            graph.release_resources()
         LOGGER.info(f"Session {session_id} deleted.")
         session_dir = os.path.join(self.session_root_dir, session_id)
         if self.access_gcs:
@@ -234,58 +385,57 @@ class GraphSessionManager:
         if self.venv_path is None:
             raise ValueError(f"Virtual environment path is not set.")
         
-        graph = self.session_metadata[session_id]['graph']
+        with self._use_session(session_id) as graph:
         
-        if graph.python_env_manager is None:
-            raise ValueError(f"Graph does not have a virtual environment manager.")
+            if graph.python_env_manager is None:
+                raise ValueError(f"Graph does not have a virtual environment manager.")
         
-        graph.python_env_manager.install_dependencies(python_packages)
-        return True
+            if isinstance(python_packages, str):
+                python_packages = [python_packages]
+            # The graph moves to the shared environment of its new package set instead of installing into a shared one
+            graph.set_python_packages((graph.python_packages or []) + list(python_packages))
+            graph.save_graph()
+            return True
     
     def get_config(self,session_id):
         """
         It returns the kwargs configuration of the GraphSessionManager.
         """
-        if session_id not in self.session_metadata:
-            raise ValueError(f"Session with ID {session_id} does not exist.")
-        
-        graph = self.session_metadata[session_id]['graph']
+        with self._use_session(session_id) as graph:
 
-        configs = {}
+            configs = {}
 
-        for nodeName,node in graph.nodePool.items():
-            configs[node.nodeName] = {
-                'useLLM': node.useLLM,
-                'jsonMode': node.jsonMode,
-                **node.kwargs
-            } 
+            for nodeName,node in graph.nodePool.items():
+                configs[node.nodeName] = {
+                    'useLLM': node.useLLM,
+                    'jsonMode': node.jsonMode,
+                    **node.kwargs
+                } 
 
-        return configs
+            return configs
     
     def set_config(self, session_id, config):
         """
         It sets the kwargs configuration of the GraphSessionManager.
         """
-        if session_id not in self.session_metadata:
-            raise ValueError(f"Session with ID {session_id} does not exist.")
-        
-        graph = self.session_metadata[session_id]['graph']
+        with self._use_session(session_id) as graph:
 
 
-        for nodeName,node in graph.nodePool.items():
-            if node.nodeName in config:
-                # Check config's key are valid
-                node.useLLM = config[node.nodeName].get('useLLM', node.useLLM)
-                node.jsonMode = config[node.nodeName].get('jsonMode', node.jsonMode)
-                for key, value in config[node.nodeName].items():
-                    if key not in ['useLLM', 'jsonMode']:
-                        node.kwargs[key] = value
+            for nodeName,node in graph.nodePool.items():
+                if node.nodeName in config:
+                    graph.mark_dirty([node.nodeName], dependents=False)
+                    # Check config's key are valid
+                    node.useLLM = config[node.nodeName].get('useLLM', node.useLLM)
+                    node.jsonMode = config[node.nodeName].get('jsonMode', node.jsonMode)
+                    for key, value in config[node.nodeName].items():
+                        if key not in ['useLLM', 'jsonMode']:
+                            node.kwargs[key] = value
 
-        # Compile the graph after setting the config
-        graph.compile()
-        # Save the graph to the session directory
-        graph.save_graph()
-        return True
+            # Compile the graph after setting the config
+            graph.compile()
+            # Save the graph to the session directory
+            graph.save_graph()
+            return True
 
 @lru_cache(maxsize=None)
 def get_graph_session_manager():
@@ -295,7 +445,7 @@ def get_graph_session_manager():
     """
     if not hasattr(get_graph_session_manager, "_instance"):
         get_graph_session_manager._instance = GraphSessionManager(session_root_dir="./saved_graphs/", 
-                                                                    timeout=20, 
+                                                                    timeout=float(os.environ.get("GRAPH_TIMEOUT", "20")), 
                                                                     venv_path="./runner_envs/venv", 
                                                                     create_env=True
                                                                     )
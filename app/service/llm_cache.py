@@ -0,0 +1,198 @@
+from .logger import LOGGER
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LLMResponseCache:
+    """
+    Content-addressed, on-disk cache of LLM responses.
+    An entry is keyed by a hash of everything which determines the response: the engine (provider), the model name,
+    temperature, max tokens, system instructions, tool schema and the resolved user prompt.
+    Entries live in a SQLite database so they survive restarts and are shared by the processes of a server.
+    Entries older than `ttl` seconds are ignored, and the least recently used entries are evicted beyond
+    `max_entries` entries or `max_bytes` bytes. The bounds are checked every EVICT_INTERVAL stores of this process,
+    since checking them scans the table.
+    The most recently used entries are also kept in memory so repeated hits do not touch the database; their last
+    access time on disk is refreshed at most once per TOUCH_INTERVAL seconds.
+    """
+    TOUCH_INTERVAL = 60
+    EVICT_INTERVAL = 100
+
+    def __init__(self, cache_dir, max_entries=10000, max_bytes=256 * 1024 * 1024, ttl=7 * 24 * 3600, memory_entries=1000):
+        self.cache_dir = cache_dir # Directory holding the database
+        self.max_entries = max_entries # Maximum number of cached responses
+        self.max_bytes = max_bytes # Maximum total size in bytes of the cached responses
+        self.ttl = ttl # Seconds after which a response is stale, 0 to keep responses until evicted
+        self.memory_entries = memory_entries # Maximum number of responses kept in memory
+        self.memory = OrderedDict() # OrderedDict[key, (response, created, last_touch)]: in-memory LRU in front of the database
+        self.lock = threading.Lock() # Serializes the use of the connection and of the in-memory LRU
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0} # Counters of this process
+        self.stores_since_evict = 0 # Stores of this process since the bounds were last checked
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(self.cache_dir, "llm_cache.sqlite3"), check_same_thread=False, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(engine_name, engine_kwargs, system_instructions, user_prompt):
+        """
+        Hash of a request.
+        engine_name: str, name of the engine class, identifies the provider and the output mode
+        engine_kwargs: Dict, engine configuration (model name, temperature, max tokens, system instructions, schema)
+        system_instructions: str, system instructions with their references resolved
+        user_prompt: str, user prompt with its references resolved
+        """
+        # Retry settings and the authentication mode do not change the response
+        config = {k: v for k, v in engine_kwargs.items() if k not in ("max_retries", "wait_time", "deployed_gcp")}
+        key = {
+            "engine": engine_name,
+            "config": config,
+            "system_instructions": system_instructions,
+            "user_prompt": user_prompt
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Return the cached response of a key or None.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None and not (self.ttl and now - entry[1] > self.ttl):
+                response, created, last_touch = entry
+                self.memory.move_to_end(key)
+                if now - last_touch > self.TOUCH_INTERVAL:
+                    self.connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                    self.connection.commit()
+                    self.memory[key] = (response, created, now)
+                self.stats["hits"] += 1
+                return json.loads(response)
+            self.memory.pop(key, None)
+
+            row = self.connection.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl and now - row[1] > self.ttl:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.connection.commit()
+                self.stats["expired"] += 1
+                row = None
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self._remember(key, row[0], row[1], now)
+            self.stats["hits"] += 1
+        return json.loads(row[0])
+
+    def _remember(self, key, value, created, last_touch):
+        """
+        Keep a serialized response in the in-memory LRU. Must be called with the lock held.
+        """
+        self.memory[key] = (value, created, last_touch)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def put(self, key, response):
+        """
+        Store a JSON-serializable response, and every EVICT_INTERVAL stores evict the least recently used entries
+        beyond the bounds.
+        """
+        value = json.dumps(response)
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now)
+            )
+            self._remember(key, value, now, now)
+            self.stats["stores"] += 1
+            self.stores_since_evict += 1
+            if self.stores_since_evict >= self.EVICT_INTERVAL:
+                self.stores_since_evict = 0
+                self._evict()
+            self.connection.commit()
+
+    def _evict(self):
+        """
+        Delete expired entries and the least recently used entries beyond max_entries or max_bytes. Must be called with the lock held.
+        """
+        if self.ttl:
+            deleted = self.connection.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,)).rowcount
+            self.stats["expired"] += max(0, deleted)
+        count, total_bytes = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+        # Evict down to 90% of the bounds so that eviction does not run again on the next store
+        target_entries, target_bytes = int(self.max_entries * 0.9), int(self.max_bytes * 0.9)
+        evicted = 0
+        for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            if count <= target_entries and total_bytes <= target_bytes:
+                break
+            self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.memory.pop(key, None)
+            count -= 1
+            total_bytes -= size
+            evicted += 1
+        self.stats["evictions"] += evicted
+        LOGGER.debug(f"Evicted {evicted} cached LLM responses. Location: LLMResponseCache._evict")
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM responses")
+            self.connection.commit()
+            self.memory.clear()
+
+    def get_stats(self):
+        """
+        Return the counters of this process and the size of the cache.
+        """
+        with self.lock:
+            count, total_bytes = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats.update({
+            "hit_rate": stats["hits"] / lookups if lookups else 0.0,
+            "entries": count,
+            "bytes": total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl
+        })
+        return stats
+
+
+_LLM_CACHE = None
+_LLM_CACHE_LOCK = threading.Lock()
+
+
+def get_llm_cache():
+    """
+    Return the process-wide LLMResponseCache configured with the LLM_CACHE_DIR, LLM_CACHE_MAX_ENTRIES,
+    LLM_CACHE_MAX_BYTES, LLM_CACHE_TTL and LLM_CACHE_MEMORY_ENTRIES environment variables, or None if LLM_CACHE_ENABLED is false.
+    """
+    global _LLM_CACHE
+    if os.environ.get("LLM_CACHE_ENABLED", "true").lower() != "true":
+        return None
+    with _LLM_CACHE_LOCK:
+        if _LLM_CACHE is None:
+            _LLM_CACHE = LLMResponseCache(
+                cache_dir=os.environ.get("LLM_CACHE_DIR", "./llm_cache"),
+                max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "10000")),
+                max_bytes=int(os.environ.get("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+                ttl=float(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+                memory_entries=int(os.environ.get("LLM_CACHE_MEMORY_ENTRIES", "1000"))
+            )
+        return _LLM_CACHE
@@ -1,21 +1,50 @@
 from .logger import LOGGER
+from .python_worker_pool import get_worker_pool, pool_size
 import json
 import os
+import re
 import subprocess
 import tempfile
 import json
 import sys
+import threading
+
+
+# Run with the python of the virtual environment: prints the subset of the given [name, version] requirements
+# which are not installed. A version of None accepts any installed version.
+MISSING_PACKAGES_SCRIPT = r'''
+import importlib.metadata, json, sys
+missing = []
+for name, version in json.loads(sys.argv[1]):
+    try:
+        installed = importlib.metadata.version(name)
+        if version is not None and installed != version:
+            missing.append([name, version])
+    except importlib.metadata.PackageNotFoundError:
+        missing.append([name, version])
+print(json.dumps(missing))
+'''
 
 
 class PythonEnvironmentManager:
-    def __init__(self, venv_path: str, create_env: bool = False):
+    def __init__(self, venv_path: str, create_env: bool = False, use_worker_pool: bool = None, defer_check: bool = False):
         self.venv_path = venv_path
+        # Python code runs on a pool of warm interpreters unless disabled (PYTHON_WORKER_POOL_SIZE=0) or unsupported (Windows)
+        if use_worker_pool is None:
+            use_worker_pool = os.name != "nt" and pool_size() > 0
+        self.use_worker_pool = use_worker_pool
+        self.manifest_path = os.path.join(venv_path, ".installed-packages.json") # Package specifiers known to be installed
+        self.manifest_lock = threading.Lock() # Lock for the manifest and the installs
+        self.ready = threading.Event() # Cleared while a background install is running
+        self.ready.set()
+        self.install_error = None # Error of the last background install, raised on execution
         if create_env:
             self.create_virtualenv()
 
         self.python_bin = os.path.join(venv_path, "bin", "python") if os.name != "nt" else os.path.join(venv_path, "Scripts", "python.exe")
 
-        if not os.path.exists(self.python_bin):
+        # With defer_check the environment is created later, e.g. by a background task (see run_in_background)
+        if not defer_check and not os.path.exists(self.python_bin):
             raise FileNotFoundError(f"Python executable not found in virtualenv: {self.python_bin}")
         LOGGER.info(f"Using Python from virtual environment: {self.python_bin}")
 
@@ -31,18 +60,144 @@ class PythonEnvironmentManager:
             LOGGER.critical(f"Failed to create virtual environment: {e}")
             raise
 
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as f:
+                return set(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return set()
+
+    def _write_manifest(self, packages):
+        manifest_tmp_path = self.manifest_path + ".tmp"
+        with open(manifest_tmp_path, "w") as f:
+            json.dump(sorted(packages), f)
+        os.replace(manifest_tmp_path, self.manifest_path)
+
+    def missing_packages(self, packages):
+        """
+        Return the package specifiers which are not satisfied by the virtual environment.
+        Specifiers recorded in the manifest of previous installs are satisfied without spawning anything.
+        Plain names and `name==version` pins are then checked with importlib.metadata inside the environment,
+        any other specifier is considered missing and left to pip.
+        """
+        if isinstance(packages, str):
+            packages = [packages]
+        manifest = self._read_manifest()
+        unknown = [package for package in packages if package.strip() not in manifest]
+        if not unknown:
+            return []
+
+        checkable = {}
+        missing = []
+        for package in unknown:
+            match = re.fullmatch(r"\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:==\s*([A-Za-z0-9._+!-]+))?\s*", package)
+            if match:
+                checkable[package] = [match.group(1), match.group(2)]
+            else:
+                missing.append(package)
+        if checkable:
+            try:
+                process = subprocess.run(
+                    [self.python_bin, "-c", MISSING_PACKAGES_SCRIPT, json.dumps(list(checkable.values()))],
+                    capture_output=True,
+                    text=True,
+                    timeout=30
+                )
+                not_installed = [tuple(requirement) for requirement in json.loads(process.stdout)]
+            except Exception as e:
+                LOGGER.warning(f"Could not check the installed packages: {e}")
+                not_installed = [tuple(requirement) for requirement in checkable.values()]
+            missing += [package for package, requirement in checkable.items() if tuple(requirement) in not_installed]
+        return missing
+
     def install_dependencies(self, packages):
+        """
+        Install the packages with pip, skipping pip entirely when they are already satisfied.
+        """
         if isinstance(packages, str):
             packages = [packages]
 
+        with self.manifest_lock:
+            missing = self.missing_packages(packages)
+            if not missing:
+                LOGGER.info(f"Dependencies already satisfied, skipping pip: {packages}")
+                self._write_manifest(self._read_manifest() | {package.strip() for package in packages})
+                return
+
+            try:
+                subprocess.check_call([self.python_bin, "-m", "pip", "install"] + missing)
+                LOGGER.info(f"Installed dependencies: {missing}")
+                self._write_manifest(self._read_manifest() | {package.strip() for package in packages})
+                if self.use_worker_pool:
+                    get_worker_pool(self.python_bin).recycle_all() # Warm workers may have imported the previous versions
+            except subprocess.CalledProcessError as e:
+                LOGGER.critical(f"Failed to install dependencies: {e}")
+                raise
+
+    def install_dependencies_async(self, packages, on_done=None):
+        """
+        Install the packages on a background thread. The environment is not ready until the install is finished,
+        execute_python_code waits for it. on_done(error) is called once the install finished, error is None on success.
+        """
+        self.run_in_background(lambda: self.install_dependencies(packages), on_done)
+
+    def run_in_background(self, task, on_done=None):
+        """
+        Run task() on a background thread, e.g. the creation of the environment and the install of its packages.
+        The environment is not ready until the task is finished and its error is raised on execution.
+        on_done(error) is called once the task finished, error is None on success.
+        """
+        self.ready.clear()
+        self.install_error = None
+
+        def run():
+            error = None
+            try:
+                task()
+            except Exception as e:
+                error = e
+                self.install_error = e
+            finally:
+                self.ready.set()
+                if on_done is not None:
+                    on_done(error)
+
+        threading.Thread(target=run, name=f"pip-install-{os.path.basename(self.venv_path)}", daemon=True).start()
+
+    def is_ready(self):
+        """
+        Whether no background install is running on this environment.
+        """
+        return self.ready.is_set()
+
+    def wait_until_ready(self, timeout=None):
+        """
+        Wait for a background install to finish. Raises the install error if it failed.
+        """
+        if not self.ready.wait(timeout):
+            raise TimeoutError(f"Python packages are still being installed in {self.venv_path}.")
+        if self.install_error is not None:
+            raise RuntimeError(f"Failed to install Python packages in {self.venv_path}: {self.install_error}")
+
+    def execute_python_code(self, function_body: str, arguments: dict) -> dict:
+        """
+        Execute `function(**arguments)` defined in function_body inside the virtual environment.
+        Returns the result dictionary with its keys and values converted to strings.
+        """
+        self.wait_until_ready(float(os.environ.get("PYTHON_INSTALL_WAIT_TIMEOUT", "600")))
+        if not self.use_worker_pool:
+            return self._execute_python_code_subprocess(function_body, arguments)
+
         try:
-            subprocess.check_call([self.python_bin, "-m", "pip", "install"] + packages)
-            LOGGER.info(f"Installed dependencies: {packages}")
-        except subprocess.CalledProcessError as e:
-            LOGGER.critical(f"Failed to install dependencies: {e}")
+            result = get_worker_pool(self.python_bin).execute(function_body, arguments)
+            LOGGER.debug(f"Worker output: {result}")
+            result = {str(k): str(v) for k, v in result.items()}
+            return result
+        except Exception as e:
+            LOGGER.critical(f"Exception during execution: {e}")
             raise
 
-    def execute_python_code(self, function_body: str, arguments: dict) -> dict:
+    def _execute_python_code_subprocess(self, function_body: str, arguments: dict) -> dict:
         # Wrap the function in a script with a fixed "result" dict output
         code = f"""
 import json
@@ -0,0 +1,271 @@
+from .logger import LOGGER
+import hashlib
+import json
+import os
+import queue
+import select
+import time
+import subprocess
+import threading
+
+
+# Source of the long-lived worker process. It is started with the python of the virtual environment and reads one
+# JSON task per line on stdin: {"hash": str, "arguments": dict, "function_body": str (only the first time)}.
+# The compiled code of a function is cached by the hash of its source, so later tasks only carry the arguments.
+# Every task runs in a fresh namespace in which `json` is already imported, like the former per-call script, and the
+# environment variables, working directory and sys.path are restored after each task. Imported modules stay loaded
+# (which keeps the worker warm), so state stored in third-party modules is shared by the tasks of a worker.
+# It answers one JSON line per task on the original stdout. Anything the user code prints is captured (and echoed to
+# stderr) so it cannot corrupt the protocol, and is returned as "stderr" like the output of the former subprocess.
+WORKER_SOURCE = r'''
+import io
+import json
+import os
+import resource
+import sys
+import traceback
+
+protocol_out = os.fdopen(os.dup(1), "w")
+os.dup2(2, 1)
+sys.stdout = sys.stderr
+
+base_environ = dict(os.environ)
+base_cwd = os.getcwd()
+base_path = list(sys.path)
+
+codes = {}
+
+for line in sys.stdin:
+    task = json.loads(line)
+    captured = io.StringIO()
+    sys.stdout = sys.stderr = captured
+    try:
+        if task["hash"] not in codes:
+            codes[task["hash"]] = compile(task["function_body"], "<node>", "exec")
+        namespace = {"__name__": "__node__"}
+        exec("import json", namespace)
+        exec(codes[task["hash"]], namespace)
+        reply = {"ok": True, "result": namespace["function"](**task["arguments"])}
+    except BaseException:
+        reply = {"ok": False, "error": traceback.format_exc()}
+    finally:
+        # Do not leak the process state changed by a task into the next one
+        os.environ.clear()
+        os.environ.update(base_environ)
+        try:
+            os.chdir(base_cwd)
+        except OSError:
+            pass
+        sys.path[:] = base_path
+        sys.stdout = sys.stderr = sys.__stderr__
+    reply["stderr"] = captured.getvalue()
+    sys.stderr.write(reply["stderr"])
+    sys.stderr.flush()
+    reply["cached"] = task["hash"] in codes
+    reply["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        reply = json.dumps(reply)
+    except Exception:
+        reply = json.dumps({"ok": False, "error": traceback.format_exc(), "stderr": reply["stderr"], "cached": reply["cached"], "max_rss_kb": reply["max_rss_kb"]})
+    protocol_out.write(reply + "\n")
+    protocol_out.flush()
+'''
+
+
+def function_hash(function_body):
+    """
+    Content hash of a function body, used as the key of the compiled function caches.
+    """
+    return hashlib.sha256(function_body.encode()).hexdigest()
+
+
+class PythonWorker:
+    """
+    A single long-lived interpreter of a virtual environment executing node functions sent over a pipe.
+    """
+    def __init__(self, python_bin):
+        self.python_bin = python_bin
+        self.tasks_done = 0 # Number of tasks executed by this worker
+        self.max_rss_kb = 0 # Peak resident memory reported by the worker
+        self.generation = 0 # Generation of the pool which started this worker
+        self.known_functions = set() # Hashes of the functions already compiled by this worker
+        self.buffer = b"" # Bytes read from the worker which do not form a complete reply yet
+        self.process = subprocess.Popen(
+            [python_bin, "-u", "-c", WORKER_SOURCE],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE
+        )
+        LOGGER.debug(f"Started python worker {self.process.pid} with {python_bin}. Location: PythonWorker.__init__")
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def execute(self, function_body, arguments, timeout):
+        """
+        Send a task to the worker and wait for its reply.
+        Raises TimeoutError if no complete reply arrives within timeout seconds and RuntimeError if the worker died or
+        the code failed, with the output of the code and its traceback like the former subprocess.
+        """
+        body_hash = function_hash(function_body)
+        task = {"hash": body_hash, "arguments": arguments}
+        if body_hash not in self.known_functions:
+            task["function_body"] = function_body
+        task = json.dumps(task) + "\n"
+        try:
+            self.process.stdin.write(task.encode())
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise RuntimeError(f"Python worker {self.process.pid} is not reachable: {e}")
+
+        reply = json.loads(self._read_line(time.monotonic() + timeout, timeout))
+        self.tasks_done += 1
+        if reply.get("cached"):
+            self.known_functions.add(body_hash)
+        self.max_rss_kb = reply.get("max_rss_kb", 0)
+        if not reply["ok"]:
+            raise RuntimeError(f"Python code failed: {reply.get('stderr', '')}{reply['error']}")
+        return reply["result"]
+
+    def _read_line(self, deadline, timeout):
+        """
+        Read one reply line from the worker, giving up at the deadline even if the reply is only partially written.
+        """
+        fd = self.process.stdout.fileno()
+        while b"\n" not in self.buffer:
+            remaining = deadline - time.monotonic()
+            ready, _, _ = select.select([fd], [], [], max(0, remaining))
+            if not ready:
+                raise TimeoutError(f"Python code timed out after {timeout} seconds.")
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise RuntimeError(f"Python worker {self.process.pid} exited with code {self.process.wait()}.")
+            self.buffer += chunk
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        return line
+
+    def stop(self):
+        """
+        Stop the worker process, killing it if it does not exit promptly.
+        """
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=1)
+        except Exception:
+            self.process.kill()
+            self.process.wait()
+
+
+class PythonWorkerPool:
+    """
+    A pool of warm worker processes for one virtual environment.
+    Workers are started lazily up to `size`. A worker is replaced after a timeout or a crash (the failing task is the
+    only one affected) and is recycled after `max_tasks_per_worker` tasks or once its peak memory exceeds `max_memory_mb`.
+    """
+    def __init__(self, python_bin, size=2, task_timeout=30, max_tasks_per_worker=100, max_memory_mb=512):
+        self.python_bin = python_bin
+        self.size = max(1, int(size)) # Maximum number of worker processes
+        self.task_timeout = task_timeout # Default timeout in seconds of a single task
+        self.max_tasks_per_worker = max_tasks_per_worker # Recycle a worker after this many tasks
+        self.max_memory_mb = max_memory_mb # Recycle a worker once its peak memory exceeds this value
+        self.slots = threading.BoundedSemaphore(self.size) # One slot per worker which may be busy at the same time
+        self.idle_workers = queue.LifoQueue() # Idle workers, the most recently used first as it is the warmest
+        self.generation = 0 # Incremented by recycle_all, workers of an older generation are not reused
+
+    def _acquire(self):
+        """
+        Wait for a free slot, then reuse an idle worker or start a new one.
+        """
+        self.slots.acquire()
+        try:
+            try:
+                worker = self.idle_workers.get_nowait()
+            except queue.Empty:
+                worker = PythonWorker(self.python_bin)
+                worker.generation = self.generation
+            return worker
+        except Exception:
+            self.slots.release()
+            raise
+
+    def _release(self, worker, discard=False):
+        """
+        Return a worker to the pool or recycle it if it is dead, too old or too big, then free its slot.
+        """
+        try:
+            if discard or not worker.is_alive() or worker.generation != self.generation:
+                worker.stop()
+            elif self.max_tasks_per_worker and worker.tasks_done >= self.max_tasks_per_worker:
+                LOGGER.debug(f"Recycling python worker {worker.process.pid} after {worker.tasks_done} tasks. Location: PythonWorkerPool._release")
+                worker.stop()
+            elif self.max_memory_mb and worker.max_rss_kb > self.max_memory_mb * 1024:
+                LOGGER.warning(f"Recycling python worker {worker.process.pid} using {worker.max_rss_kb // 1024} MB. Location: PythonWorkerPool._release")
+                worker.stop()
+            else:
+                self.idle_workers.put(worker)
+        finally:
+            self.slots.release()
+
+    def execute(self, function_body, arguments, timeout=None):
+        """
+        Execute `function(**arguments)` defined in function_body on a warm worker and return its JSON result.
+        """
+        timeout = self.task_timeout if timeout is None else timeout
+        worker = self._acquire()
+        try:
+            result = worker.execute(function_body, arguments, timeout)
+        except TimeoutError:
+            LOGGER.critical(f"Python worker {worker.process.pid} timed out, killing it. Location: PythonWorkerPool.execute")
+            worker.process.kill()
+            self._release(worker, discard=True)
+            raise
+        except Exception:
+            self._release(worker)
+            raise
+        self._release(worker)
+        return result
+
+    def recycle_all(self):
+        """
+        Stop all idle workers, e.g. after new packages were installed. Busy workers are stopped when released.
+        """
+        self.generation += 1
+        while True:
+            try:
+                worker = self.idle_workers.get_nowait()
+            except queue.Empty:
+                break
+            worker.stop()
+
+    def shutdown(self):
+        self.recycle_all()
+
+
+def pool_size():
+    """
+    Number of workers per virtual environment: PYTHON_WORKER_POOL_SIZE, defaulting to MAX_PARALLEL_NODES (0 disables the pool).
+    """
+    return int(os.environ.get("PYTHON_WORKER_POOL_SIZE") or os.environ.get("MAX_PARALLEL_NODES", "8"))
+
+
+# One pool per python executable, shared by every graph using the same virtual environment
+_WORKER_POOLS = {}
+_WORKER_POOLS_LOCK = threading.Lock()
+
+
+def get_worker_pool(python_bin):
+    """
+    Return the process-wide worker pool of a python executable, creating it on first use.
+    The pool is configured with the PYTHON_WORKER_POOL_SIZE, PYTHON_WORKER_TASK_TIMEOUT, PYTHON_WORKER_MAX_TASKS and
+    PYTHON_WORKER_MAX_MEMORY_MB environment variables. The size defaults to MAX_PARALLEL_NODES so a fan-out of Python
+    nodes is not serialized by the pool.
+    """
+    with _WORKER_POOLS_LOCK:
+        if python_bin not in _WORKER_POOLS:
+            _WORKER_POOLS[python_bin] = PythonWorkerPool(
+                python_bin,
+                size=pool_size(),
+                task_timeout=float(os.environ.get("PYTHON_WORKER_TASK_TIMEOUT", "30")),
+                max_tasks_per_worker=int(os.environ.get("PYTHON_WORKER_MAX_TASKS", "100")),
+                max_memory_mb=int(os.environ.get("PYTHON_WORKER_MAX_MEMORY_MB", "512"))
+            )
+        return _WORKER_POOLS[python_bin]
@@ -0,0 +1,169 @@
+from .logger import LOGGER
+from .graph_session import get_graph_session_manager
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import os
+import threading
+import time
+import uuid
+
+
+class Run:
+    """
+    A graph execution submitted to the RunManager.
+    Its node statuses and outputs are updated from the execution events while it runs.
+    """
+    def __init__(self, session_id, start_node, incremental=False, listener=None):
+        self.run_id = uuid.uuid4().hex # str: Unique identifier of the run
+        self.session_id = session_id
+        self.start_node = start_node
+        self.incremental = incremental
+        self.status = "queued" # str: "queued", "running", "completed", "failed" or "cancelled"
+        self.error = None # str: Error message if the run failed
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.node_status = {} # Dict[str, str]: Status of every node executed by the run
+        self.outputs = {} # Dict[str, Dict]: Outputs of the nodes completed by the run
+        self.cancel_event = threading.Event() # Set to stop the run before its next node
+        self.done = threading.Event() # Set once the run reached a final status
+        self.future = None # Future of the run on the executor
+        self.listener = listener # Optional callable also receiving the execution events, e.g. to stream them
+
+    def on_event(self, event):
+        """
+        Record an execution event of the scheduler.
+        """
+        if event["event"] == "node_started":
+            self.node_status[event["node"]] = "running"
+        elif event["event"] in ("node_completed", "node_error"):
+            self.node_status[event["node"]] = event["status"]
+            self.outputs[event["node"]] = event["outputs"]
+        elif event["event"] == "run_finished":
+            self.node_status.update(event["node_status"])
+        if self.listener is not None:
+            self.listener(event)
+
+    def to_dict(self):
+        return {
+            "run_id": self.run_id,
+            "session_id": self.session_id,
+            "start_node": self.start_node,
+            "incremental": self.incremental,
+            "status": self.status,
+            "cancel_requested": self.cancel_event.is_set(),
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "node_status": dict(self.node_status),
+            "outputs": dict(self.outputs)
+        }
+
+
+class RunManager:
+    """
+    Executes graph sessions in the background so that HTTP requests return immediately with a run ID.
+    Runs are executed on a bounded pool of `max_concurrent_runs` threads, later submissions wait in the queue.
+    The most recent `max_finished_runs` finished runs are kept for polling.
+    """
+    def __init__(self, session_manager, max_concurrent_runs=4, max_finished_runs=1000):
+        self.session_manager = session_manager # GraphSessionManager executing the runs
+        self.max_finished_runs = max_finished_runs # Number of finished runs kept in memory
+        self.executor = ThreadPoolExecutor(max_workers=max(1, int(max_concurrent_runs)), thread_name_prefix="graph-run")
+        self.runs = OrderedDict() # OrderedDict[run_id, Run]: runs in submission order
+        self.lock = threading.Lock() # Lock for the runs dictionary
+
+    def submit(self, session_id, start_node, incremental=False, on_event=None):
+        """
+        Queue the execution of a session from a node and return the Run right away.
+        on_event: optional callable receiving the execution events of the run (see GraphScheduler).
+        """
+        if session_id not in self.session_manager.session_metadata:
+            raise ValueError(f"Session with ID {session_id} does not exist.")
+        run = Run(session_id, start_node, incremental, listener=on_event)
+        with self.lock:
+            self.runs[run.run_id] = run
+            self._forget_finished_runs()
+        run.future = self.executor.submit(self._execute, run)
+        LOGGER.info(f"Run {run.run_id} submitted for session {session_id} from node {start_node}. Location: RunManager.submit")
+        return run
+
+    def _execute(self, run):
+        if run.cancel_event.is_set():
+            self._finish(run, "cancelled")
+            return
+        run.status = "running"
+        run.started_at = time.time()
+        try:
+            self.session_manager.execute_session(run.session_id, run.start_node, incremental=run.incremental, on_event=run.on_event, cancel_event=run.cancel_event)
+        except Exception as e:
+            LOGGER.error(f"Run {run.run_id} failed: {e}. Location: RunManager._execute")
+            run.error = str(e)
+            self._finish(run, "failed")
+            return
+        self._finish(run, "cancelled" if run.cancel_event.is_set() else "completed")
+
+    def _finish(self, run, status):
+        run.status = status
+        run.finished_at = time.time()
+        run.listener = None # The finished run is kept for polling, not its listener
+        run.done.set()
+        LOGGER.info(f"Run {run.run_id} {status}. Location: RunManager._finish")
+
+    def _forget_finished_runs(self):
+        """
+        Drop the oldest finished runs beyond max_finished_runs. Must be called with the lock held.
+        """
+        finished = [run_id for run_id, run in self.runs.items() if run.done.is_set()]
+        for run_id in finished[:max(0, len(finished) - self.max_finished_runs)]:
+            del self.runs[run_id]
+
+    def get(self, run_id, wait=None):
+        """
+        Return a run, optionally waiting up to `wait` seconds for it to finish.
+        """
+        with self.lock:
+            run = self.runs.get(run_id)
+        if run is None:
+            raise ValueError(f"Run with ID {run_id} does not exist.")
+        if wait:
+            run.done.wait(timeout=wait)
+        return run
+
+    def cancel(self, run_id):
+        """
+        Cancel a run. A queued run never starts, a running run starts no further node and its running nodes finish.
+        """
+        run = self.get(run_id)
+        if run.done.is_set():
+            return run
+        run.cancel_event.set()
+        if run.future is not None and run.future.cancel():
+            self._finish(run, "cancelled")
+        LOGGER.info(f"Run {run_id} cancellation requested. Location: RunManager.cancel")
+        return run
+
+    def list_runs(self, session_id=None):
+        with self.lock:
+            runs = list(self.runs.values())
+        return [run for run in runs if session_id is None or run.session_id == session_id]
+
+
+_RUN_MANAGER = None
+_RUN_MANAGER_LOCK = threading.Lock()
+
+
+def get_run_manager():
+    """
+    Return the process-wide RunManager configured with the MAX_CONCURRENT_RUNS and MAX_FINISHED_RUNS environment variables.
+    """
+    global _RUN_MANAGER
+    with _RUN_MANAGER_LOCK:
+        if _RUN_MANAGER is None:
+            _RUN_MANAGER = RunManager(
+                get_graph_session_manager(),
+                max_concurrent_runs=int(os.environ.get("MAX_CONCURRENT_RUNS", "4")),
+                max_finished_runs=int(os.environ.get("MAX_FINISHED_RUNS", "1000"))
+            )
+        return _RUN_MANAGER
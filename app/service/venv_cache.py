@@ -0,0 +1,267 @@
+from .logger import LOGGER
+from .pyenv_manager import PythonEnvironmentManager
+from .python_worker_pool import get_worker_pool
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+
+try:
+    import fcntl # File locks shared across processes (gunicorn workers) for building and using environments
+except ImportError:
+    fcntl = None
+
+
+class VirtualEnvCache:
+    """
+    Content-addressed cache of virtual environments.
+    An environment is identified by a fingerprint of the interpreter version and the sorted package list and lives in
+    <cache_dir>/<fingerprint>, shared by the graphs requesting the same packages.
+    Concurrent builders of the same fingerprint are serialized with an in-process lock and a file lock.
+    A process using an environment holds a shared file lock on it. After a build, the least recently used environments
+    beyond `max_envs` are deleted if no process holds that lock. Without fcntl (e.g. on Windows), only the users in
+    this process are taken into account.
+    """
+    def __init__(self, cache_dir, max_envs=10):
+        self.cache_dir = cache_dir # Directory holding one sub-directory per environment
+        self.max_envs = max_envs # Maximum number of environments kept on disk
+        self.lock = threading.Lock() # Lock for the dictionaries below
+        self.build_locks = {} # Dict[fingerprint, threading.Lock]: in-process lock per fingerprint
+        self.managers = {} # Dict[fingerprint, PythonEnvironmentManager]: managers of the ready environments
+        self.ref_counts = {} # Dict[fingerprint, int]: number of graphs of this process using an environment
+        self.use_files = {} # Dict[fingerprint, file]: open files holding the shared use lock of the environments in use
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def normalize_packages(packages):
+        """
+        Return the sorted, de-duplicated list of package specifiers.
+        """
+        if isinstance(packages, str):
+            packages = [packages]
+        return sorted({package.strip() for package in packages or [] if package and package.strip()})
+
+    def fingerprint(self, packages):
+        """
+        Fingerprint of an environment: hash of the interpreter version and the normalized package list.
+        """
+        key = {
+            "python": ".".join(str(v) for v in sys.version_info[:3]),
+            "packages": self.normalize_packages(packages)
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+
+    def _env_path(self, fingerprint):
+        return os.path.join(self.cache_dir, fingerprint)
+
+    def _marker_path(self, fingerprint):
+        # Written once the environment is fully built, its mtime is the last use of the environment
+        return os.path.join(self._env_path(fingerprint), ".ready")
+
+    def _build_lock(self, fingerprint):
+        with self.lock:
+            if fingerprint not in self.build_locks:
+                self.build_locks[fingerprint] = threading.Lock()
+            return self.build_locks[fingerprint]
+
+    def _open_file_lock(self, fingerprint, blocking=True, suffix="lock", shared=False):
+        """
+        Take a cross-process lock of a fingerprint: the build lock (suffix "lock") or the use lock (suffix "use").
+        Returns the open lock file or None if it is held elsewhere.
+        """
+        lock_file = open(os.path.join(self.cache_dir, f"{fingerprint}.{suffix}"), "w")
+        if fcntl is not None:
+            operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+            try:
+                fcntl.flock(lock_file, operation if blocking else operation | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                return None
+        return lock_file
+
+    def _build(self, fingerprint, packages, manager=None):
+        """
+        Build the environment of a fingerprint. Must be called with the build file lock of the fingerprint held.
+        The environment is created for manager if given (see _build_async), otherwise a new manager is returned.
+        """
+        env_path = self._env_path(fingerprint)
+        if os.path.exists(env_path):
+            LOGGER.warning(f"Removing partially built environment {env_path}. Location: VirtualEnvCache._build")
+            shutil.rmtree(env_path)
+
+        LOGGER.info(f"Building environment {fingerprint} for packages {packages}. Location: VirtualEnvCache._build")
+        if manager is None:
+            manager = PythonEnvironmentManager(env_path, create_env=True)
+        else:
+            manager.create_virtualenv()
+        if packages:
+            manager.install_dependencies(packages)
+        with open(self._marker_path(fingerprint), "w") as f:
+            json.dump({"packages": packages, "python": sys.version}, f)
+        return manager
+
+    def _build_async(self, fingerprint, packages):
+        """
+        Return a manager which is not ready until the environment of a fingerprint is available.
+        A background thread waits for the build file lock, which another process may hold while it builds the same
+        environment, then builds the environment unless that process completed it.
+        """
+        manager = PythonEnvironmentManager(self._env_path(fingerprint), defer_check=True)
+
+        def build():
+            lock_file = self._open_file_lock(fingerprint)
+            try:
+                if not os.path.exists(self._marker_path(fingerprint)):
+                    self._build(fingerprint, packages, manager)
+            finally:
+                lock_file.close()
+
+        def on_done(error):
+            if error is None:
+                self.garbage_collect() # Only a build adds an environment to the cache
+                return
+            # Forget the failed environment so that the next acquire rebuilds it
+            with self.lock:
+                if self.managers.get(fingerprint) is manager:
+                    del self.managers[fingerprint]
+
+        with self.lock:
+            self.managers[fingerprint] = manager # Registered before the build can fail and forget it
+        manager.run_in_background(build, on_done=on_done)
+        return manager
+
+    def acquire(self, packages, background=False):
+        """
+        Return the PythonEnvironmentManager of the environment with exactly these packages, building it if needed.
+        With background=True a missing environment is created and its packages are installed on a background thread,
+        which also waits for a build of the same environment by another process, so the caller never blocks on venv
+        or pip (see PythonEnvironmentManager.is_ready).
+        Each call must be balanced by a call to release with the same packages.
+        """
+        packages = self.normalize_packages(packages)
+        fingerprint = self.fingerprint(packages)
+
+        with self.lock:
+            # Counted first, so that neither release nor garbage_collect drops the environment meanwhile
+            self.ref_counts[fingerprint] = self.ref_counts.get(fingerprint, 0) + 1
+        try:
+            self._hold_use_lock(fingerprint)
+            built = False
+            with self._build_lock(fingerprint):
+                with self.lock:
+                    manager = self.managers.get(fingerprint)
+                if manager is None:
+                    if os.path.exists(self._marker_path(fingerprint)):
+                        manager = PythonEnvironmentManager(self._env_path(fingerprint), create_env=False)
+                    elif background:
+                        manager = self._build_async(fingerprint, packages)
+                    else:
+                        lock_file = self._open_file_lock(fingerprint)
+                        try:
+                            if os.path.exists(self._marker_path(fingerprint)):
+                                manager = PythonEnvironmentManager(self._env_path(fingerprint), create_env=False)
+                            else:
+                                manager = self._build(fingerprint, packages)
+                                built = True
+                        finally:
+                            lock_file.close()
+                    with self.lock:
+                        self.managers[fingerprint] = manager
+                if os.path.exists(self._marker_path(fingerprint)):
+                    os.utime(self._marker_path(fingerprint)) # Mark the environment as recently used
+        except Exception:
+            self.release(packages)
+            raise
+
+        if built:
+            self.garbage_collect() # Only a build adds an environment to the cache
+        return manager
+
+    def _hold_use_lock(self, fingerprint):
+        """
+        Take the shared use lock of an environment for this process, if not already held.
+        It waits while another process garbage-collects the environment.
+        """
+        with self.lock:
+            if fingerprint in self.use_files:
+                return
+        use_file = self._open_file_lock(fingerprint, suffix="use", shared=True)
+        with self.lock:
+            if fingerprint not in self.use_files:
+                self.use_files[fingerprint] = use_file
+                return
+        use_file.close()
+
+    def release(self, packages):
+        """
+        Mark an environment as no longer used by one graph of this process.
+        The use lock is released with the last graph.
+        """
+        fingerprint = self.fingerprint(packages)
+        with self.lock:
+            if self.ref_counts.get(fingerprint, 0) > 0:
+                self.ref_counts[fingerprint] -= 1
+            use_file = self.use_files.pop(fingerprint, None) if self.ref_counts.get(fingerprint, 0) == 0 else None
+        if use_file is not None:
+            use_file.close()
+
+    def garbage_collect(self):
+        """
+        Delete the least recently used environments beyond max_envs which are neither in use nor being built
+        by any process.
+        """
+        environments = []
+        for fingerprint in os.listdir(self.cache_dir):
+            marker_path = self._marker_path(fingerprint)
+            if os.path.exists(marker_path):
+                environments.append((os.path.getmtime(marker_path), fingerprint))
+        environments.sort()
+
+        for _, fingerprint in environments[:max(0, len(environments) - self.max_envs)]:
+            build_lock = self._build_lock(fingerprint)
+            if not build_lock.acquire(blocking=False):
+                continue
+            try:
+                with self.lock:
+                    if self.ref_counts.get(fingerprint, 0) > 0:
+                        continue
+                use_file = self._open_file_lock(fingerprint, blocking=False, suffix="use")
+                if use_file is None:
+                    continue # In use by another process
+                try:
+                    lock_file = self._open_file_lock(fingerprint, blocking=False)
+                    if lock_file is None:
+                        continue # Being built by another process
+                    try:
+                        with self.lock:
+                            manager = self.managers.pop(fingerprint, None)
+                        if manager is not None and manager.use_worker_pool:
+                            get_worker_pool(manager.python_bin).shutdown()
+                        shutil.rmtree(self._env_path(fingerprint), ignore_errors=True)
+                        LOGGER.info(f"Garbage-collected environment {fingerprint}. Location: VirtualEnvCache.garbage_collect")
+                    finally:
+                        lock_file.close()
+                finally:
+                    use_file.close()
+            finally:
+                build_lock.release()
+
+
+_VENV_CACHE = None
+_VENV_CACHE_LOCK = threading.Lock()
+
+
+def get_venv_cache():
+    """
+    Return the process-wide VirtualEnvCache configured with the VENV_CACHE_DIR and VENV_CACHE_MAX_ENVS environment variables.
+    """
+    global _VENV_CACHE
+    with _VENV_CACHE_LOCK:
+        if _VENV_CACHE is None:
+            _VENV_CACHE = VirtualEnvCache(
+                cache_dir=os.environ.get("VENV_CACHE_DIR", "./runner_envs/cache"),
+                max_envs=int(os.environ.get("VENV_CACHE_MAX_ENVS", "10"))
+            )
+        return _VENV_CACHE
@@ -0,0 +1,50 @@
+import os
+
+# Graphs are written synchronously and LLM responses are never cached, so every test sees its own writes and calls.
+# Importing the app builds the session manager from ./saved_graphs, run the tests from the repository root.
+os.environ.setdefault("GRAPH_WRITE_BEHIND", "false")
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+
+import pytest
+
+from app.service.graph import Graph
+from app.service.graph_node import GraphNode
+
+
+class FakeEngine:
+    """
+    Stand-in for an LLM engine: it answers "<node>(<prompt>)" and fails for nodes whose system instructions are "fail".
+    """
+    def __init__(self, node, calls):
+        self.node = node
+        self.calls = calls
+
+    def run(self, prompts):
+        self.calls.append(self.node.nodeName)
+        if self.node.systemInstructions == "fail":
+            raise RuntimeError("engine failure")
+        return f"{self.node.nodeName}({prompts[0]})"
+
+    async def arun(self, prompts):
+        return self.run(prompts)
+
+
+@pytest.fixture
+def engine_calls(monkeypatch):
+    """
+    Replace the LLM engines of all nodes by FakeEngine and return the names of the nodes calling them, in call order.
+    """
+    calls = []
+    monkeypatch.setattr(GraphNode, "resolve_engine", lambda self: setattr(self, "engine", FakeEngine(self, calls)))
+    return calls
+
+
+@pytest.fixture
+def graph(tmp_path):
+    graph = Graph(save_dir=f"{tmp_path}/")
+    graph.addInput({"q": "x"})
+    return graph
+
+
+def add_llm_node(graph, nodeName, userPrompt, systemInstructions="sys", **kwargs):
+    return graph.addNode(nodeName, systemInstructions, userPrompt, {}, {"out": "text"}, True, False, "", "", **kwargs)
@@ -0,0 +1,113 @@
+import gzip
+import json
+import os
+
+import pytest
+
+from app.service.graph import Graph, JOURNAL_FILE_NAME
+from app.service.graph_codec import VALUE_PREFIX, decode_graph, encode_graph
+from tests.conftest import add_llm_node
+
+
+def graph_dict():
+    long_value = "x" * 300
+    return {
+        "graph_id": "id",
+        "nodes": {
+            "inputs": {"outputSchema": {"q": long_value}, "_outputs": {"q": long_value}},
+            "a": {"userPrompt": f"{VALUE_PREFIX}not a reference", "_inputs": {"@[inputs.q]": long_value}, "count": 3}
+        },
+        "python_packages": ["requests"],
+        "create_env": False
+    }
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip"])
+def test_codec_round_trip(compression):
+    data = encode_graph(graph_dict(), compression, min_length=256)
+
+    assert decode_graph(data) == graph_dict()
+    if compression == "gzip":
+        assert data[:2] == b"\x1f\x8b"
+
+
+def test_codec_stores_repeated_strings_once():
+    data = json.loads(encode_graph(graph_dict(), "none", min_length=256))
+
+    assert data["format"] == 2
+    assert list(data["values"].values()).count("x" * 300) == 1
+
+
+def test_codec_reads_v1_files():
+    data = json.dumps(graph_dict(), indent=4).encode()
+
+    assert decode_graph(data) == graph_dict()
+    assert decode_graph(gzip.compress(data)) == graph_dict()
+
+
+def reload(graph):
+    loaded = Graph(save_dir=graph.save_dir)
+    loaded.load_graph()
+    return loaded
+
+
+def many_nodes(graph, count=6):
+    for index in range(count):
+        add_llm_node(graph, f"n{index}", f"N{index} @[inputs.q]")
+
+
+def test_small_changes_are_appended_to_the_journal(graph, engine_calls):
+    many_nodes(graph)
+    graph._needs_snapshot = True
+    graph.write_graph()
+    snapshot_path = os.path.join(graph.save_dir, "graph.json")
+    journal_path = os.path.join(graph.save_dir, JOURNAL_FILE_NAME)
+    with open(snapshot_path, "rb") as f:
+        snapshot = f.read()
+    assert not os.path.exists(journal_path)
+
+    node = graph.nodePool["n0"]
+    node.status = "completed"
+    node._outputs = {"out": "done"}
+    graph._record_changes(["n0"], "state")
+    graph.write_graph()
+
+    with open(snapshot_path, "rb") as f:
+        assert f.read() == snapshot
+    with open(journal_path, "rb") as f:
+        records = [json.loads(line) for line in f]
+    assert [record["node"] for record in records if record["op"] != "graph"] == ["n0"]
+    loaded = reload(graph)
+    assert loaded.nodePool["n0"].status == "completed"
+    assert loaded.nodePool["n0"]._outputs == {"out": "done"}
+    assert loaded.nodePool["n1"].status == "pending"
+
+
+def test_journal_replays_added_and_removed_nodes(graph, engine_calls):
+    many_nodes(graph)
+    graph.write_graph()
+
+    graph.removeNode("n5")
+    add_llm_node(graph, "extra", "E @[n0.out]")
+    graph.write_graph()
+
+    loaded = reload(graph)
+    assert set(loaded.nodePool) == set(graph.nodePool)
+    assert loaded.nodePool["extra"]._compiled
+    assert "extra" in loaded.nodePool["n0"]._children
+
+
+def test_truncated_journal_record_is_ignored(graph, engine_calls):
+    many_nodes(graph)
+    graph.write_graph()
+    graph.nodePool["n0"]._outputs = {"out": "done"}
+    graph._record_changes(["n0"], "state")
+    graph.write_graph()
+
+    with open(os.path.join(graph.save_dir, JOURNAL_FILE_NAME), "ab") as f:
+        f.write(b'{"seq": 99, "op": "state", "node": "n1", "da')
+
+    for _ in range(2): # The first load compacts the journal, the second one reads the new snapshot
+        loaded = reload(graph)
+        assert loaded.nodePool["n0"]._outputs == {"out": "done"}
+        assert loaded.nodePool["n1"]._outputs == {}
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+
+from app.service.graph_scheduler import GraphScheduler
+from tests.conftest import add_llm_node
+
+
+class SleepNode:
+    """
+    Minimal node for the scheduler: it sleeps and records the peak number of nodes running at once.
+    """
+    def __init__(self, nodeName, parents, duration, tracker):
+        self.nodeName = nodeName
+        self._parents = [(parent, "out") for parent in parents]
+        self._children = set()
+        self._outputs = {}
+        self._partial_listener = None
+        self.status = "pending"
+        self.duration = duration
+        self.tracker = tracker
+
+    def execute(self, nodePool, python_env_manager):
+        with self.tracker["lock"]:
+            self.tracker["running"] += 1
+            self.tracker["peak"] = max(self.tracker["peak"], self.tracker["running"])
+        time.sleep(self.duration)
+        with self.tracker["lock"]:
+            self.tracker["running"] -= 1
+        self.status = "completed"
+        return self._outputs
+
+    async def aexecute(self, nodePool, python_env_manager):
+        await asyncio.sleep(self.duration)
+        self.status = "completed"
+        return self._outputs
+
+
+def chain_pool(duration, names=("a", "b", "c")):
+    tracker = {"lock": threading.Lock(), "running": 0, "peak": 0}
+    nodePool = {}
+    for index, name in enumerate(names):
+        nodePool[name] = SleepNode(name, names[index - 1:index], duration, tracker)
+        if index:
+            nodePool[names[index - 1]]._children.add(name)
+    return nodePool, tracker
+
+
+def diamond(graph):
+    add_llm_node(graph, "a", "A @[inputs.q]")
+    add_llm_node(graph, "b", "B @[a.out]")
+    add_llm_node(graph, "c", "C @[a.out]")
+    add_llm_node(graph, "d", "D @[b.out] @[c.out]")
+
+
+def test_nodes_run_after_their_parents(graph, engine_calls):
+    diamond(graph)
+    graph.execute_from_node("inputs")
+
+    assert sorted(engine_calls) == ["a", "b", "c", "d"]
+    assert engine_calls[0] == "a" and engine_calls[-1] == "d"
+    assert graph.nodePool["d"]._outputs["out"] == "d(D b(B a(A x)) c(C a(A x)))"
+    assert all(node.status == "completed" for node in graph.nodePool.values())
+
+
+def test_failure_skips_descendants_only(graph, engine_calls):
+    add_llm_node(graph, "a", "A @[inputs.q]")
+    add_llm_node(graph, "b", "B @[a.out]", systemInstructions="fail")
+    add_llm_node(graph, "c", "C @[b.out]")
+    add_llm_node(graph, "d", "D @[a.out]")
+    events = []
+    graph.execute_from_node("inputs", on_event=events.append)
+
+    statuses = {node_name: node.status for node_name, node in graph.nodePool.items()}
+    assert statuses == {"inputs": "completed", "a": "completed", "b": "error", "c": "pending", "d": "completed"}
+    assert "c" not in engine_calls
+    assert ("node_error", "b") in [(event["event"], event.get("node")) for event in events]
+    assert events[-1]["event"] == "run_finished"
+    assert events[-1]["node_status"]["c"] == "pending"
+
+
+def test_aexecute_follows_the_same_order(graph, engine_calls):
+    diamond(graph)
+    asyncio.run(graph.aexecute_from_node("inputs"))
+
+    assert engine_calls[0] == "a" and engine_calls[-1] == "d"
+    assert graph.nodePool["d"].status == "completed"
+
+
+def test_parallel_nodes_are_bounded():
+    tracker = {"lock": threading.Lock(), "running": 0, "peak": 0}
+    nodePool = {f"n{index}": SleepNode(f"n{index}", [], 0.05, tracker) for index in range(6)}
+    GraphScheduler(nodePool, None, max_parallel_nodes=2).run(list(nodePool))
+
+    assert tracker["peak"] == 2
+    assert all(node.status == "completed" for node in nodePool.values())
+
+
+def test_timeout_leaves_waiting_nodes_pending():
+    nodePool, _ = chain_pool(0.2)
+    GraphScheduler(nodePool, None, timeout=0.3).run(list(nodePool))
+    assert [node.status for node in nodePool.values()] == ["completed", "completed", "pending"]
+
+    nodePool, _ = chain_pool(0.2)
+    asyncio.run(GraphScheduler(nodePool, None, timeout=0.3).arun(list(nodePool)))
+    assert [node.status for node in nodePool.values()] == ["completed", "completed", "pending"]
+
+
+def test_cancel_starts_no_further_node():
+    nodePool, _ = chain_pool(0.05)
+    cancel_event = threading.Event()
+    cancel_event.set()
+    GraphScheduler(nodePool, None, cancel_event=cancel_event).run(list(nodePool))
+    assert all(node.status == "pending" for node in nodePool.values())
@@ -0,0 +1,109 @@
+import json
+import os
+import uuid
+
+import pytest
+
+from app.service.graph import Graph
+from app.service.graph_session import GraphSessionManager
+from tests.conftest import add_llm_node
+
+
+def add_python_node(graph, nodeName, function_body):
+    return graph.addNode(nodeName, "", "", {"function_body": function_body, "argument": {"q": "@[inputs.q]"}}, {"out": "text"}, False, False, "", "")
+
+
+@pytest.mark.parametrize("function_body", [
+    "def function(q):\n    return {'out': q}",
+    "function = lambda q: {'out': q}",
+    "from json import loads as function"
+])
+def test_runnable_python_code_compiles(graph, function_body):
+    node = add_python_node(graph, "p", function_body)
+
+    assert node._compiled
+
+
+def test_invalid_python_code_is_rejected(graph):
+    with pytest.raises(ValueError):
+        add_python_node(graph, "p", "def function(q)\n    return {}")
+
+    assert "p" not in graph.nodePool
+
+
+def test_invalid_update_leaves_the_graph_usable(graph, engine_calls):
+    add_llm_node(graph, "a", "A @[inputs.q]")
+    add_python_node(graph, "p", "def function(q):\n    return {'out': q}")
+    old_node = graph.nodePool["p"]
+
+    with pytest.raises(ValueError):
+        graph.updateNode("p", "", "", {"function_body": "def function(q:", "argument": {}}, {"out": "text"}, False, False, "", "")
+    with pytest.raises(ValueError):
+        graph.updateNode("a", "sys", "A @[inputs.q]", {}, {"out": "text"}, True, True, None, None) # JSON mode without a tool
+
+    assert graph.nodePool["p"] is old_node
+    assert graph.nodePool["a"].jsonMode is False
+    graph.compile()
+    add_llm_node(graph, "b", "B @[a.out]")
+    graph.execute_from_node("inputs")
+    assert graph.nodePool["b"].status == "completed"
+
+
+def test_update_creating_a_cycle_is_undone(graph, engine_calls):
+    add_llm_node(graph, "a", "A @[inputs.q]")
+    add_llm_node(graph, "b", "B @[a.out]")
+
+    with pytest.raises(ValueError):
+        graph.updateNode("a", "sys", "A @[b.out]", {}, {"out": "text"}, True, False, "", "")
+
+    assert graph.nodePool["a"].userPrompt == "A @[inputs.q]"
+    assert "b" in graph.nodePool["a"]._children
+    add_llm_node(graph, "c", "C @[b.out]")
+    graph.execute_from_node("inputs")
+    assert graph.nodePool["c"]._outputs["out"] == "c(C b(B a(A x)))"
+
+
+def test_graph_with_an_invalid_saved_node_still_loads(graph):
+    add_llm_node(graph, "a", "A @[inputs.q]")
+    add_python_node(graph, "p", "def function(q):\n    return {'out': q}")
+    graph._needs_snapshot = True
+    graph.write_graph()
+
+    # A node saved by an older version which no longer validates
+    file_path = os.path.join(graph.save_dir, "graph.json")
+    with open(file_path) as f:
+        data = json.load(f)
+    data["graph"]["nodes"]["p"]["pythonCode"]["function_body"] = "def function(q:"
+    with open(file_path, "w") as f:
+        json.dump(data, f)
+
+    loaded = Graph(save_dir=graph.save_dir)
+    loaded.load_graph()
+
+    assert not loaded.nodePool["p"]._compiled
+    assert loaded.nodePool["a"]._compiled
+    loaded.compile() # The invalid node is not validated again until it changes
+    loaded.updateNode("p", "", "", {"function_body": "function = lambda q: {'out': q}", "argument": {"q": "@[inputs.q]"}}, {"out": "text"}, False, False, "", "")
+    assert loaded.nodePool["p"]._compiled
+
+
+def test_session_stays_indexed_after_a_failed_load(tmp_path):
+    manager = GraphSessionManager(str(tmp_path))
+    session_id = str(uuid.uuid4())
+    manager.create_session(session_id)
+    manager.add_input_to_session(session_id, {"q": "x"})
+
+    manager = GraphSessionManager(str(tmp_path))
+    load_graph_into_session = manager.load_graph_into_session
+    failures = [OSError("transient")]
+
+    def flaky_load(session_key):
+        if failures:
+            raise failures.pop()
+        return load_graph_into_session(session_key)
+
+    manager.load_graph_into_session = flaky_load
+    with pytest.raises(ValueError):
+        manager.get_session_graph(session_id)
+
+    assert manager.get_session_graph(session_id).nodePool["inputs"]._outputs == {"q": "x"}
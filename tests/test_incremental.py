@@ -0,0 +1,68 @@
+from tests.conftest import add_llm_node
+
+
+def build(graph):
+    add_llm_node(graph, "a", "A @[inputs.q]")
+    add_llm_node(graph, "b", "B @[a.out]")
+    add_llm_node(graph, "c", "C @[inputs.q]")
+
+
+def test_unchanged_nodes_reuse_their_outputs(graph, engine_calls):
+    build(graph)
+    graph.execute_from_node("inputs")
+    outputs = {node_name: dict(node._outputs) for node_name, node in graph.nodePool.items()}
+    engine_calls.clear()
+
+    events = []
+    graph.execute_from_node("inputs", incremental=True, on_event=events.append)
+
+    assert engine_calls == []
+    assert {node_name: node._outputs for node_name, node in graph.nodePool.items()} == outputs
+    assert all(event.get("reused") for event in events if event["event"] == "node_completed")
+
+
+def test_changed_input_reruns_the_nodes_using_it(graph, engine_calls):
+    build(graph)
+    add_llm_node(graph, "d", "D")
+    graph.execute_from_node("inputs")
+    graph.execute_from_node("d")
+    engine_calls.clear()
+
+    graph.addInput({"q": "y"})
+    graph.compile()
+    graph.execute_from_node("inputs", incremental=True)
+
+    assert sorted(engine_calls) == ["a", "b", "c"]
+    assert graph.nodePool["b"]._outputs["out"] == "b(B a(A y))"
+
+
+def test_changed_node_reruns_its_descendants_only(graph, engine_calls):
+    build(graph)
+    graph.execute_from_node("inputs")
+    engine_calls.clear()
+
+    graph.updateNode("a", "sys", "A2 @[inputs.q]", {}, {"out": "text"}, True, False, "", "")
+    graph.execute_from_node("inputs", incremental=True)
+
+    assert sorted(engine_calls) == ["a", "b"]
+    assert graph.nodePool["b"]._outputs["out"] == "b(B a(A2 x))"
+
+
+def test_full_run_executes_every_node(graph, engine_calls):
+    build(graph)
+    graph.execute_from_node("inputs")
+    engine_calls.clear()
+
+    graph.execute_from_node("inputs")
+
+    assert sorted(engine_calls) == ["a", "b", "c"]
+
+
+def test_failed_node_is_executed_again(graph, engine_calls):
+    add_llm_node(graph, "a", "A @[inputs.q]", systemInstructions="fail")
+    graph.execute_from_node("inputs")
+    engine_calls.clear()
+
+    graph.execute_from_node("inputs", incremental=True)
+
+    assert engine_calls == ["a"]